@@ -0,0 +1,299 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""The kernels of kernels.py in C. Build with `cythonize -i _hskernels.pyx` (see the README),
+kernels.py picks this up on its own. Every function here gives exactly what its Python version gives."""
+from cpython.array cimport array, resize
+from libc.math cimport rint
+from libc.stdlib cimport qsort, realloc
+from time import perf_counter
+
+cdef int HEAT16_MIN = -2 ** 15
+cdef int HEAT16_MAX = 2 ** 15 - 1
+
+
+# Scratch space kept between calls, grown as bigger maps come along. A cell is marked as seen
+# by a call by holding that call's stamp, so nothing has to be cleared between calls. moveset
+# has its own (_seen), multi_astar calls back into Python and that may run moveset.
+cdef int *_seen = NULL
+cdef int *_stamp = NULL
+cdef int *_goal = NULL
+cdef int *_g = NULL
+cdef int *_parent = NULL
+cdef int _size = 0
+cdef int _seen_at = 0
+cdef int _stamp_at = 0
+
+
+cdef int *_resized(int *cells, int size) except NULL:
+    """cells grown from _size to size ints, the new ones 0."""
+    cdef int *grown = <int *> realloc(cells, size * sizeof(int))
+    cdef int i
+    if grown == NULL:
+        raise MemoryError()
+    for i in range(_size, size):
+        grown[i] = 0
+    return grown
+
+
+cdef int _grow(int size) except -1:
+    """Makes the scratch arrays hold at least size cells."""
+    global _seen, _stamp, _goal, _g, _parent, _size
+    if size <= _size:
+        return 0
+    size = max(size, 2 * _size)
+    _seen = _resized(_seen, size)
+    _stamp = _resized(_stamp, size)
+    _goal = _resized(_goal, size)
+    _g = _resized(_g, size)
+    _parent = _resized(_parent, size)
+    _size = size
+    return 0
+
+
+cdef int _next_seen() noexcept:
+    """A stamp no cell of _seen holds yet."""
+    global _seen_at
+    cdef int i
+    _seen_at += 1
+    if _seen_at == 0x7FFFFFFF:  # Ran out, start over from a clean slate.
+        for i in range(_size):
+            _seen[i] = 0
+        _seen_at = 1
+    return _seen_at
+
+
+cdef int _next_stamp() noexcept:
+    """A stamp no cell of _stamp or _goal holds yet."""
+    global _stamp_at
+    cdef int i
+    _stamp_at += 1
+    if _stamp_at == 0x7FFFFFFF:
+        for i in range(_size):
+            _stamp[i] = _goal[i] = 0
+        _stamp_at = 1
+    return _stamp_at
+
+
+cdef int _compare(const void *a, const void *b) noexcept nogil:
+    return (<const int *> a)[0] - (<const int *> b)[0]
+
+
+def moveset(const unsigned char[::1] walkable, offsets, int i, int max_step):
+    cdef int count = len(offsets), n, k, at, to, size = 1, found
+    cdef int[8] steps
+    for k in range(min(count, 8)):
+        steps[k] = offsets[k]
+    count = min(count, 8)
+    _grow(walkable.shape[0])
+
+    cdef array current = array("i", [i])
+    cdef array new = array("i")
+    cdef int stamp
+    for _ in range(max_step):
+        stamp = _next_seen()
+        resize(new, size * count)
+        found = 0
+        for n in range(size):
+            at = current.data.as_ints[n]
+            for k in range(count):
+                to = at + steps[k]
+                if walkable[to] and _seen[to] != stamp:
+                    _seen[to] = stamp
+                    new.data.as_ints[found] = to
+                    found += 1
+        resize(new, found)
+        qsort(new.data.as_ints, found, sizeof(int), _compare)
+        current, new, size = new, current, found
+    return current.tolist()
+
+
+cdef inline bint _line_of_sight(const unsigned char[::1] opaque, int width, int height,
+                                int x0, int y0, int x1, int y1) noexcept:
+    if x0 == x1 and y0 == y1:
+        return True
+    cdef int dx = x1 - x0, dy = y1 - y0
+    cdef int steps = max(abs(dx), abs(dy)), n, x, y, stride = width + 2
+    cdef double step_x = <double> dx / steps, step_y = <double> dy / steps
+    cdef double cur_x = x0, cur_y = y0
+    for n in range(steps):
+        cur_x += step_x
+        cur_y += step_y
+        x, y = <int> rint(cur_x), <int> rint(cur_y)  # rint rounds halves to even, like round().
+        if not (0 <= x < width and 0 <= y < height):
+            return True
+        if opaque[(y + 1) * stride + x + 1] and n != steps - 1:
+            return False
+    return True
+
+
+def line_of_sight(const unsigned char[::1] opaque, int width, int height, int x0, int y0, int x1, int y1):
+    return _line_of_sight(opaque, width, height, x0, y0, x1, y1)
+
+
+def visibility(const unsigned char[::1] opaque, int width, int height, int x, int y, int radius):
+    cdef int side = 2 * radius + 1, bit = 0, dx, dy
+    cdef bytearray bits = bytearray((side * side + 7) // 8)
+    cdef unsigned char *raw = bits
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            if _line_of_sight(opaque, width, height, x, y, x + dx, y + dy):
+                raw[bit >> 3] |= 1 << (bit & 7)
+            bit += 1
+    return int.from_bytes(bits, "little")
+
+
+# The open set of multi_astar, a binary heap ordered and sifted exactly like kernels._pop.
+cdef struct Entry:
+    int f
+    int x
+    int y
+    int cell
+
+cdef Entry *_heap = NULL
+cdef int _heap_size = 0
+
+
+cdef inline bint _before(Entry a, Entry b) noexcept:
+    return a.f < b.f or (a.f == b.f and a.x < b.x and a.y < b.y)
+
+
+cdef inline void _sift_down(int start, int pos) noexcept:
+    cdef Entry item = _heap[pos]
+    cdef int parent
+    while pos > start:
+        parent = (pos - 1) >> 1
+        if not _before(item, _heap[parent]):
+            break
+        _heap[pos] = _heap[parent]
+        pos = parent
+    _heap[pos] = item
+
+
+cdef inline Entry _pop(int *length) noexcept:
+    length[0] -= 1
+    cdef int end = length[0], pos = 0, child = 1
+    cdef Entry last = _heap[end], top
+    if end == 0:
+        return last
+    top = _heap[0]
+    while child < end:
+        if child + 1 < end and not _before(_heap[child], _heap[child + 1]):
+            child += 1
+        _heap[pos] = _heap[child]
+        pos, child = child, 2 * child + 1
+    _heap[pos] = last
+    _sift_down(0, pos)
+    return top
+
+
+cdef inline int _heuristic(int cell, int stride, const int *goal_x, const int *goal_y, int count) noexcept:
+    """The taxicab distance from cell to the closest of the count goals."""
+    cdef int k, h, best = 0x7FFFFFFF
+    for k in range(count):
+        h = abs(cell % stride - goal_x[k]) + abs(cell // stride - goal_y[k])
+        if h < best:
+            best = h
+    return best
+
+
+def multi_astar(neighbors, int max_step, int stride, int start, goals, int budget=0, double deadline=0.0):
+    cdef int goal_count = len(goals), cur, tent, h, length = 1, expanded = 0, stamp, cell, closest, closest_h
+    cdef array goal_x = array("i", [goal % stride for goal in goals])
+    cdef array goal_y = array("i", [goal // stride for goal in goals])
+    cdef Entry *grown
+    _grow(max(max(goals), start) + 1)
+    stamp = _next_stamp()
+    for goal in goals:
+        _goal[<int> goal] = stamp
+
+    global _heap, _heap_size
+    if _heap_size == 0:
+        _heap = <Entry *> realloc(_heap, 64 * sizeof(Entry))
+        if _heap == NULL:
+            raise MemoryError()
+        _heap_size = 64
+    _heap[0] = Entry(0, start % stride, start // stride, start)
+    _stamp[start], _g[start] = stamp, 0
+    closest, closest_h = start, _heuristic(start, stride, goal_x.data.as_ints, goal_y.data.as_ints, goal_count)
+
+    while length:
+        if (budget and expanded >= budget) or \
+                (deadline and expanded & 63 == 0 and perf_counter() >= deadline):
+            while closest != start and _parent[closest] != start:
+                closest = _parent[closest]
+            return closest, expanded, False
+
+        cur = _pop(&length).cell
+        expanded += 1
+
+        if _goal[cur] == stamp:
+            while cur != start and _parent[cur] != start:
+                cur = _parent[cur]
+            return cur, expanded, True
+
+        tent = _g[cur] + 1
+        moves = neighbors(cur, max_step)
+        for neighbor in moves:
+            cell = neighbor
+            if cell >= _size:
+                _grow(cell + 1)
+            if _stamp[cell] == stamp and tent >= _g[cell]:
+                continue
+            _stamp[cell], _g[cell], _parent[cell] = stamp, tent, cur
+
+            h = _heuristic(cell, stride, goal_x.data.as_ints, goal_y.data.as_ints, goal_count)
+            if h < closest_h:
+                closest, closest_h = cell, h
+            if length == _heap_size:
+                grown = <Entry *> realloc(_heap, 2 * _heap_size * sizeof(Entry))
+                if grown == NULL:
+                    raise MemoryError()
+                _heap, _heap_size = grown, 2 * _heap_size
+            _heap[length] = Entry(tent + h, cell % stride, cell // stride, cell)
+            length += 1
+            _sift_down(0, length - 1)
+
+    return -1, expanded, False
+
+
+# Cells mostly come as an array("i") (MapState.visible_cells), those are read straight from memory.
+
+def heat_add(heat, cells, amount):
+    cdef Py_ssize_t n, i
+    cdef const int[::1] ints
+    if isinstance(cells, array) and (<array> cells).ob_descr.typecode == b"i":
+        ints = cells
+        for n in range(ints.shape[0]):
+            i = ints[n]
+            heat[i] += amount
+    else:
+        for i in cells:
+            heat[i] += amount
+
+
+def heat_fill(heat, cells, value):
+    cdef Py_ssize_t n, i
+    cdef const int[::1] ints
+    if isinstance(cells, array) and (<array> cells).ob_descr.typecode == b"i":
+        ints = cells
+        for n in range(ints.shape[0]):
+            heat[ints[n]] = value
+    else:
+        for i in cells:
+            heat[i] = value
+
+
+cdef inline short _add16(short heat, int amount) noexcept:
+    cdef int value = heat + amount
+    return HEAT16_MIN if value < HEAT16_MIN else HEAT16_MAX if value > HEAT16_MAX else value
+
+
+def heat_add16(short[::1] heat, cells, int amount):
+    cdef Py_ssize_t n, i
+    cdef const int[::1] ints
+    if isinstance(cells, array) and (<array> cells).ob_descr.typecode == b"i":
+        ints = cells
+        for n in range(ints.shape[0]):
+            heat[ints[n]] = _add16(heat[ints[n]], amount)
+    else:
+        for i in cells:
+            heat[i] = _add16(heat[i], amount)
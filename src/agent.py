@@ -1,5 +1,18 @@
+from array import array
+from collections import Counter
+from typing import TYPE_CHECKING, Self
 from vector2d import vector
-from map_state import MapState, CellType
+from map_state import MapState
+from heatmap import Heatmap, make_heatmap
+
+import copy
+import logging
+import time
+
+if TYPE_CHECKING:
+    from hide_and_seek import Game
+
+log = logging.getLogger(__name__)
 
 DIRECTIONS = [vector(x, y) for x in range(-1, 2)
               for y in range(-1, 2) if (x, y) != (0, 0)]
@@ -10,45 +23,77 @@ class Agent:
 
     position: vector
     vision_range: int
-    heatmap: list[list[int]]
+    heatmap: Heatmap
     view: MapState
     max_step: int
 
-    def __init__(self, pos: vector, vision_range: int, view: MapState, max_step: int) -> None:
+    # Set by Game.enable_profiling, counts what this agent does (see profiler.COUNTERS).
+    name: str = "agent"
+    stats: Counter[str] | None = None
+
+    # How much planning one move may take, None for no limit: plan_budget cells expanded, plan_time
+    # seconds. A planner that runs out heads for the best cell it got to instead (see multi_astar).
+    # Only the budget plays out the same on every machine.
+    plan_budget: int | None = None
+    plan_time: float | None = None
+
+    def __init__(self, pos: vector, vision_range: int, view: MapState, max_step: int,
+                 heatmap: str = "list") -> None:
         """Initializes a general agent, with starting point pos,
-           limited vision range vision_range, and the dimensions of the map."""
+           limited vision range vision_range, and the dimensions of the map.
+           heatmap picks how the heatmap is stored, see heatmap.HEATMAPS."""
         self.position = pos
         self.vision_range = vision_range
         self.view = view
-        self.heatmap = [[0 for _ in range(view.width)]
-                        for _ in range(view.height)]
+        self.heatmap = make_heatmap(view, heatmap)
         self.max_step = max_step
 
+    def clone(self, view: MapState) -> Self:
+        """Returns a copy of this agent for a copy of its map. The heatmap is copy-on-write."""
+        agent = copy.copy(self)
+        agent.view = view
+        agent.heatmap = self.heatmap.copy(view)
+        agent.stats = None
+        return agent
+
     def get_neighbors(self, at: vector, radius: int) -> list[vector]:
         """Returns the positions in the NxN grid around the agent."""
         return [vector(x, y) for x in range(at.x - radius, at.x + radius + 1)
                 for y in range(at.y - radius, at.y + radius + 1)]
 
+    def count(self, counter: str, amount: int = 1) -> None:
+        """Bumps one of the profiling counters, if anyone is counting."""
+        if self.stats is not None:
+            self.stats[counter] += amount
+
+    def plan_deadline(self) -> float:
+        """The time.perf_counter() time planning this move has to stop by, 0 for no limit."""
+        return 0.0 if self.plan_time is None else time.perf_counter() + self.plan_time
+
+    def visible_cells(self) -> array:
+        """Returns the indices of all cells on the map this agent can see right now."""
+        return self.view.visible_cells(self.view.index_of(self.position), self.vision_range)
+
     def get_moveset(self, at: vector) -> list[vector]:
         """Retrieves the moveset at a certain position, with the agent's max step."""
-        current: list[vector] = [at]
-        for _ in range(self.max_step):
-            new = []
-            for pos in current:
-                for move in DIRECTIONS:
-                    new_pos = pos + move
-                    if self.view[new_pos] == CellType.WALL or self.view[new_pos] == CellType.BORDER:
-                        continue
-                    new.append(new_pos)
-            current = list(set(new))
-        return current
+        if self.stats is not None:
+            self.stats["moveset_calls"] += 1
+        return list(self.view.moveset(self.view.index_of(at), self.max_step))
+
+    def moves_between(self, a: int, b: int) -> int:
+        """The fewest moves it could take this agent to get from cell a to cell b, ignoring walls."""
+        if self.max_step == 0:
+            return 0
+        ax, ay = self.view.coords(a)
+        bx, by = self.view.coords(b)
+        return -(-max(abs(ax - bx), abs(ay - by)) // self.max_step)
 
     def move(self, direction: vector) -> bool:
         """Attempts to move the current agent in the direction dir. 
            Returns True if successful, False otherwise."""
         new_pos = self.position + direction
-        if self.view[new_pos] == CellType.WALL or self.view[new_pos] == CellType.BORDER:
-            print("Can't move here.")
+        if not self.view.is_walkable(new_pos):
+            log.info("%s can't move to %s.", self.name, new_pos)
             return False  # Can not move here.
 
         # Moved successfully.
@@ -71,25 +116,22 @@ class Agent:
 
         # That means, once we take a distance vector from the agent to the position (end - start),
         # If any components > vision_range, the agent can NOT see the position.
-        dist_vec = pos - self.position
-        if abs(dist_vec.x) > self.vision_range or abs(dist_vec.y) > self.vision_range:
+        if self.stats is not None:
+            self.stats["can_see_calls"] += 1
+
+        dx, dy = pos.x - self.position.x, pos.y - self.position.y
+        radius = self.vision_range
+        if abs(dx) > radius or abs(dy) > radius:
             return False
 
-        # If on the same tile, obviously the agent can see the position.
-        if self.position == pos:
-            return True
-
-        # The number of steps to check (no reason to choose this algo).
-        steps = max(abs(dist_vec.x), abs(dist_vec.y))
-        # The direction to move in.
-        direction = dist_vec.free() / steps
-        cur = self.position.free()                    # The starting position.
-
-        for i in range(steps):
-            cur += direction
-            cell = self.view[cur.snap()]
-            if cell == CellType.WALL and i != steps - 1:
-                return False  # If we hit a wall, we can't see the position.
-            if cell == CellType.BORDER:
-                return True  # Out of bounds cell, we hit the edge.
-        return True  # We can see the position.
+        # Everything else is a lookup in the precomputed window of the cell we stand on.
+        visible = self.view.visibility(self.view.index_of(self.position), radius)
+        return (visible >> ((dy + radius) * (2 * radius + 1) + dx + radius)) & 1 == 1
+
+    def perceive(self, game: 'Game') -> None:
+        """Perceives the world, and updates the heatmap accordingly."""
+        raise NotImplementedError
+
+    def accept(self, game: 'Game') -> vector:
+        """Accepts the current world state. Returns the NEXT direction it takes."""
+        raise NotImplementedError
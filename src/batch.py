@@ -0,0 +1,206 @@
+from concurrent.futures import ProcessPoolExecutor
+from batchsim import BatchedGames
+from dataclasses import dataclass, asdict
+from hide_and_seek import game_from_file
+from heatmap import HEATMAPS
+from loader import MapFormatError, load_map
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+# A tick cap so maps with a "LARGE number" time limit still finish.
+DEFAULT_MAX_TICKS = 10000
+
+
+@dataclass
+class MatchResult:
+    """The outcome of one headless game."""
+
+    map_path: str
+    seed: int
+    winner: str         # "seeker", "hiders" or "none" if the tick cap was hit.
+    score: int
+    ticks: int
+    hiders_caught: int
+    hiders_total: int
+    gave_up: bool       # The seeker could not find a path to any hot cell.
+
+
+def winner(outcome: int, gave_up: bool) -> str:
+    """Who won, from Game.terminal_score and whether the seeker gave up."""
+    if gave_up or outcome == -1:
+        return "hiders"
+    return "seeker" if outcome == 1 else "none"
+
+
+def run_match(map_path: str, seed: int, max_ticks: int = DEFAULT_MAX_TICKS,
+              heatmap: str = "list", seeker_planner: str = "astar",
+              hider_planner: str = "dijkstra", cache_dir: str | None = None,
+              replay_dir: str | None = None, plan_budget: int | None = None,
+              plan_time: float | None = None) -> MatchResult:
+    """Plays a single game to a terminal state, without any printing or input.
+       With replay_dir, the game is recorded there as <map file>.<seed>.replay, see replay.py.
+       plan_budget and plan_time cap the planning of every move, see Agent.plan_budget."""
+    game = game_from_file(map_path, heatmap, cache_dir, seed)
+    game.seeker.planner = seeker_planner
+    for hider in game.hiders:
+        hider.planner = hider_planner
+    for agent in [game.seeker, *game.hiders]:
+        agent.plan_budget, agent.plan_time = plan_budget, plan_time
+    hiders_total = len(game.hiders)
+    gave_up = False
+
+    if replay_dir:
+        os.makedirs(replay_dir, exist_ok=True)
+        game.record_replay(os.path.join(replay_dir, f"{os.path.basename(map_path)}.{seed}.replay"))
+    try:
+        while game.terminal_score() == 0 and game.time_elapsed < max_ticks:
+            game.tick()
+    except ValueError:
+        gave_up = True
+    finally:
+        if game.replay is not None:
+            game.replay.close()
+
+    return MatchResult(map_path, seed, winner(game.terminal_score(), gave_up), game.score, game.time_elapsed,
+                       hiders_total - len(game.hiders), hiders_total, gave_up)
+
+
+def run_batched(map_path: str, seeds: list[int], max_ticks: int = DEFAULT_MAX_TICKS,
+                cache_dir: str | None = None) -> list[MatchResult]:
+    """Plays the map once per seed, like run_match with the "field" seeker and "dijkstra" hiders,
+       but all seeds at once in a batchsim.BatchedGames. Needs NumPy."""
+    games = BatchedGames(game_from_file(map_path, cache_dir=cache_dir), seeds)
+    games.run(max_ticks)
+
+    results = []
+    outcome = games.terminal_scores()
+    hiders_total = games.hiders.shape[1]
+    for k, seed in enumerate(seeds):
+        gave_up = bool(games.gave_up[k])
+        results.append(MatchResult(map_path, seed, winner(int(outcome[k]), gave_up),
+                                   int(games.score[k]), int(games.time[k]),
+                                   hiders_total - int(games.alive[k].sum()), hiders_total, gave_up))
+    return results
+
+
+def _run_batched_args(args: tuple[str, list[int], int, str | None]) -> list[MatchResult]:
+    """Unpacks the arguments for run_batched, so it can be mapped over a pool."""
+    return run_batched(*args)
+
+
+def _run_match_args(args: tuple[str, int, int, str, str, str, str | None, str | None,
+                                int | None, float | None]) -> MatchResult:
+    """Unpacks the arguments for run_match, so it can be mapped over a pool."""
+    return run_match(*args)
+
+
+def _cache_map(map_path: str, cache_dir: str) -> None:
+    """Writes the cache of a map, without sending the whole map back from the worker."""
+    load_map(map_path, cache_dir)
+
+
+def run_batch(map_paths: list[str], seeds: list[int], max_ticks: int = DEFAULT_MAX_TICKS,
+              workers: int | None = None, heatmap: str = "list",
+              seeker_planner: str = "astar", hider_planner: str = "dijkstra",
+              cache_dir: str | None = None, vectorized: bool = False,
+              replay_dir: str | None = None, plan_budget: int | None = None,
+              plan_time: float | None = None) -> list[MatchResult]:
+    """Plays every map against every seed, spread across all cores.
+       Results come back in the same order as the (map, seed) pairs.
+       With cache_dir, every map is parsed and preprocessed once up front, and all games read the cache.
+       vectorized plays the seeds of a map in batches instead, see run_batched; the planners are ignored.
+       With replay_dir, every game is recorded there, see run_match. Batched games aren't.
+       plan_budget and plan_time go to run_match as well, batched games don't take them either."""
+    workers = workers or os.cpu_count() or 1
+    if vectorized:
+        per_worker = max(1, -(-len(seeds) // workers))
+        batches = [(path, seeds[k:k + per_worker], max_ticks, cache_dir)
+                   for path in map_paths for k in range(0, len(seeds), per_worker)]
+        if workers == 1:
+            return [result for job in batches for result in _run_batched_args(job)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return [result for results in pool.map(_run_batched_args, batches) for result in results]
+
+    jobs = [(path, seed, max_ticks, heatmap, seeker_planner, hider_planner, cache_dir, replay_dir,
+             plan_budget, plan_time) for path in map_paths for seed in seeds]
+    if workers == 1:
+        if cache_dir:
+            for path in map_paths:
+                load_map(path, cache_dir)
+        return [_run_match_args(job) for job in jobs]
+
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        if cache_dir:
+            list(pool.map(_cache_map, map_paths, [cache_dir] * len(map_paths)))
+        return list(pool.map(_run_match_args, jobs, chunksize=chunksize))
+
+
+def write_results(results: list[MatchResult], file_path: str | None, fmt: str) -> None:
+    """Writes the results as JSON lines or CSV, to a file or stdout."""
+    out = open(file_path, "w", newline="") if file_path else sys.stdout
+    try:
+        if fmt == "csv":
+            writer = csv.DictWriter(out, fieldnames=list(MatchResult.__dataclass_fields__))
+            writer.writeheader()
+            writer.writerows(asdict(result) for result in results)
+        else:
+            for result in results:
+                out.write(json.dumps(asdict(result)) + "\n")
+    finally:
+        if file_path:
+            out.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Runs many headless games of Hide and Seek.")
+    parser.add_argument("maps", nargs="+", help="map files to play")
+    parser.add_argument("-n", "--seeds", type=int, default=1,
+                        help="number of seeds to play per map, starting from --first-seed")
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--max-ticks", type=int, default=DEFAULT_MAX_TICKS)
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="worker processes, defaults to all cores")
+    parser.add_argument("-o", "--output", default=None, help="output file, defaults to stdout")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    parser.add_argument("--heatmap", choices=list(HEATMAPS), default="list",
+                        help="how agents store their heatmaps")
+    parser.add_argument("--seeker-planner", choices=["astar", "field", "incremental", "hpa"], default="astar",
+                        help="how the seeker plans its way to the hottest cells")
+    parser.add_argument("--hider-planner", choices=["dijkstra", "incremental", "astar"], default="dijkstra",
+                        help="how the hiders plan their way to the coldest cells")
+    parser.add_argument("--cache-dir", default=None,
+                        help="keep preprocessed maps here, so later runs load them faster")
+    parser.add_argument("--vectorized", action="store_true",
+                        help="play all seeds of a map at once in NumPy arrays, "
+                             "needs --seeker-planner field and the dijkstra hiders")
+    parser.add_argument("--replays", default=None, metavar="FOLDER",
+                        help="record every game in this folder, to look at or play again with replay.py")
+    parser.add_argument("--plan-budget", type=int, default=None, metavar="CELLS",
+                        help="expand at most this many cells planning one move (astar planners only)")
+    parser.add_argument("--plan-time", type=float, default=None, metavar="SECONDS",
+                        help="plan one move for at most this long (astar planners only), not reproducible")
+    args = parser.parse_args()
+    if args.vectorized and args.replays:
+        parser.error("--vectorized games can't be recorded, drop --replays.")
+    if args.plan_time is not None and args.replays:
+        parser.error("--plan-time games can't be played again the same way, drop --replays.")
+    if args.vectorized and (args.seeker_planner, args.hider_planner) != ("field", "dijkstra"):
+        parser.error("--vectorized needs --seeker-planner field and --hider-planner dijkstra.")
+
+    seeds = list(range(args.first_seed, args.first_seed + args.seeds))
+    try:
+        results = run_batch(args.maps, seeds, args.max_ticks, args.workers, args.heatmap,
+                            args.seeker_planner, args.hider_planner, args.cache_dir, args.vectorized,
+                            args.replays, args.plan_budget, args.plan_time)
+    except (MapFormatError, OSError, ImportError) as error:
+        parser.exit(1, f"{error}\n")
+    write_results(results, args.output, args.format)
+
+
+if __name__ == "__main__":
+    main()
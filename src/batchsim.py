@@ -0,0 +1,287 @@
+from hide_and_seek import Game
+from heatmap import Heatmap
+from hider import FLARE_INTERVAL, FLARE_RANGE
+from map_state import CellType, MapState
+from pathfinding import coldest_step
+from typing import Callable, Sequence
+
+import random
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, only the batched simulator needs it.
+    np = None  # type: ignore[assignment]
+
+
+class BatchedGames:
+    """Many games on the same map, kept side by side in NumPy arrays (one row per game) and
+       ticked all at once: sight, heat, the seeker's distance field and catches are worked
+       out for every game in a handful of array operations instead of one game at a time.
+
+       Every game plays out exactly like Game.tick would, with the seeker on the "field"
+       planner and the hiders on "dijkstra", rolling its dice like a Game with the same seed.
+       Hiders that can move still plan one game at a time with coldest_step, so levels 1
+       and 2 are where this pays off the most. Maps with boxes aren't supported,
+       pushing them around would give every game its own map."""
+
+    state: MapState
+    count: int
+    rngs: list[random.Random]
+
+    def __init__(self, game: Game, seeds: list[int]) -> None:
+        """Starts one copy of game per seed. game is left untouched, it only has to be
+           set up (game_from_file) and may have been ticked already."""
+        if np is None:
+            raise ImportError("The batched simulator needs NumPy to be installed.")
+        state = game.state
+        if CellType.BOX.value in state.cells:
+            raise ValueError("The batched simulator can't play maps with boxes.")
+
+        self.state = state
+        self.count = n = len(seeds)
+        self.rngs = [random.Random(seed) for seed in seeds]
+        self.maximum_time = game.maximum_time
+        self.seeker_step = game.seeker.max_step
+        self.hider_step = game.hiders[0].max_step if game.hiders else 0
+
+        # One extra column past the last cell: padding in the tables below points there,
+        # so padded entries can be read and written along with the rest and never matter.
+        cells = len(state.cells)
+        self.pad = cells
+        self.empty = np.zeros(cells + 1, dtype=bool)
+        self.empty[:cells] = np.frombuffer(state.cells, dtype=np.uint8) == CellType.EMPTY.value
+        self.walkable = np.zeros(cells + 1, dtype=bool)
+        self.walkable[:cells] = np.frombuffer(state.walkable, dtype=np.uint8) == 1
+
+        # Per cell tables, only filled in for cells an agent can stand on.
+        stand = np.flatnonzero(self.walkable).tolist()
+        self.seeker_sight = self._table(stand, lambda i: state.visible_cells(i, game.seeker.vision_range))
+        self.seeker_moves = self._table(stand, lambda i: sorted(state.neighbors(i, self.seeker_step)))
+        hider_vision = game.hiders[0].vision_range if game.hiders else 0
+        self.hider_sight = self._table(stand, lambda i: state.visible_cells(i, hider_vision))
+        self.around_seeker = self._table(stand, lambda i: [j for j in state.window(i, self.seeker_step)
+                                                           if self.empty[j]])
+        self.flare_area = self._table(stand, lambda i: [j for j in state.window(i, FLARE_RANGE)
+                                                        if self.empty[j]])
+
+        # Where a hider standing on a cell may shoot a flare, in the order choose_flare_positions
+        # lists them, so the same seed picks the same spot.
+        self.flare_spots: dict[int, list[int]] = {}
+        for i in stand:
+            x, y = state.coords(i)
+            self.flare_spots[i] = [state.index(x + dx, y + dy)
+                                   for dx in range(-FLARE_RANGE, FLARE_RANGE + 1)
+                                   for dy in range(-FLARE_RANGE, FLARE_RANGE + 1)
+                                   if (dx or dy) and state.validate_coords(x + dx, y + dy)
+                                   and self.empty[state.index(x + dx, y + dy)]]
+
+        def heat(heatmap: Heatmap) -> 'np.ndarray':
+            return np.array([heatmap.get(i) for i in range(cells)] + [0], dtype=np.int32)
+
+        hiders = game.hiders
+        self.time = np.full(n, game.time_elapsed, dtype=np.int64)
+        self.score = np.full(n, game.score, dtype=np.int64)
+        self.gave_up = np.zeros(n, dtype=bool)
+        self.seeker = np.full(n, state.index_of(game.seeker.position), dtype=np.intp)
+        self.hiders = np.tile(np.array([state.index_of(h.position) for h in hiders], dtype=np.intp), (n, 1))
+        self.alive = np.ones((n, len(hiders)), dtype=bool)
+        self.ticks = np.tile(np.array([h.ticks_passed for h in hiders], dtype=np.int64), (n, 1))
+        self.occupied = np.zeros((n, cells + 1), dtype=np.int16)
+        for i in self.hiders[0]:
+            self.occupied[:, i] += 1
+        self.seeker_heat = np.tile(heat(game.seeker.heatmap), (n, 1))
+        self.hider_heat = np.tile(np.stack([heat(h.heatmap) for h in hiders]) if hiders
+                                  else np.zeros((0, cells + 1), dtype=np.int32), (n, 1, 1))
+        self.flares = np.zeros((n, cells + 1), dtype=np.int64)  # Expiry time, 0 for no flare.
+        for where, until in game.flares.items():
+            self.flares[:, state.index_of(where)] = until
+        self.next_expiry = np.full(n, min(game.flares.values(), default=np.iinfo(np.int64).max), dtype=np.int64)
+
+        # coldest_step wants a Heatmap, this one gets its cells swapped in for every hider.
+        self._scratch = Heatmap(state)
+
+    def _table(self, stand: list[int], cells_of: Callable[[int], Sequence[int]]) -> 'np.ndarray':
+        """Lays out cells_of(i) for every cell in stand as a (cells, longest) index table,
+           padded with self.pad."""
+        rows = {i: cells_of(i) for i in stand}
+        table = np.full((self.pad + 1, max(map(len, rows.values()), default=0)), self.pad, dtype=np.intp)
+        for i, row in rows.items():
+            table[i, :len(row)] = row
+        return table
+
+    def terminal_scores(self) -> 'np.ndarray':
+        """Game.terminal_score of every game: -1 if the hiders won, 1 if the seeker did, else 0."""
+        scores = np.zeros(self.count, dtype=np.int8)
+        scores[~self.alive.any(axis=1)] = 1
+        scores[self.time > self.maximum_time] = -1
+        return scores
+
+    def active(self) -> 'np.ndarray':
+        """Indices of the games that are still going."""
+        return np.flatnonzero((self.terminal_scores() == 0) & ~self.gave_up)
+
+    def run(self, max_ticks: int) -> None:
+        """Ticks until every game is over, or has been played for max_ticks."""
+        games = self.active()
+        while True:
+            games = games[self.time[games] < max_ticks]
+            if not len(games):
+                return
+            self.tick(games)
+            games = self.active()
+
+    def tick(self, games: 'np.ndarray | None' = None) -> None:
+        """Ticks the games (by index, all by default) 1 state forward. Games that are
+           over are skipped, like Game.tick. A seeker with nowhere to go gives up, which
+           ends its game where Game.tick would have raised."""
+        if games is None:
+            games = np.arange(self.count)
+        games = games[(self.terminal_scores()[games] == 0) & ~self.gave_up[games]]
+
+        self.score[games] -= 1
+        self.time[games] += 1
+        games = self._tick_seekers(games)
+        self._check_world(games)
+        for h in range(self.hiders.shape[1]):
+            self._tick_hiders(games, h)
+
+    @staticmethod
+    def _shift_or(out: 'np.ndarray', cells: 'np.ndarray', offset: int, length: int) -> None:
+        """ORs cells into out, moved offset cells along, per game. Only the first length columns count."""
+        if offset > 0:
+            out[:, offset:length] |= cells[:, :length - offset]
+        else:
+            out[:, :length + offset] |= cells[:, -offset:length]
+
+    def _spread(self, front: 'np.ndarray') -> 'np.ndarray':
+        """The cells one move away from any cell in front, in every game (MapState.moveset).
+           With a max step of 1 the cells of front itself may come back too, the search drops them anyway."""
+        cells = self.pad
+        if self.seeker_step == 1:
+            # The 3x3 box around every cell, a row at a time then a column at a time.
+            out = front.copy()
+            self._shift_or(out, front, 1, cells)
+            self._shift_or(out, front, -1, cells)
+            rows = out.copy()
+            self._shift_or(out, rows, self.state.stride, cells)
+            self._shift_or(out, rows, -self.state.stride, cells)
+            return out & self.walkable
+
+        for _ in range(self.seeker_step):
+            out = np.zeros_like(front)
+            for offset in self.state.neighbor_offsets:
+                self._shift_or(out, front, offset, cells)
+            front = out & self.walkable
+        return front
+
+    def _flat(self, rows: 'np.ndarray', cells: 'np.ndarray') -> 'np.ndarray':
+        """Turns a row of cells per heatmap into indices into the flattened heatmaps, rows being
+           game numbers (or game * hider count + hider for the hiders' heatmaps). Fancy indexing
+           one flat array is a lot faster than indexing rows and columns."""
+        return rows[:, None] * (self.pad + 1) + cells
+
+    def _tick_seekers(self, games: 'np.ndarray') -> 'np.ndarray':
+        """Seeker.perceive and Seeker.accept with the field planner, then the move.
+           Returns the games whose seeker didn't give up."""
+        here = self.seeker[games]
+
+        # Cool down everything in sight, then heat up the cells with a hider on them.
+        sight = self._flat(games, self.seeker_sight[here])
+        heat = self.seeker_heat.reshape(-1)
+        heat[sight] = np.where(self.occupied.reshape(-1)[sight] > 0, 10, heat[sight] - 1)
+
+        # The hottest EMPTY cells are the goals, like Heatmap.extreme.
+        mine = self.seeker_heat[games]
+        top = np.where(self.empty, mine, np.iinfo(mine.dtype).min).max(axis=1)
+        reached = (mine == top[:, None]) & self.empty
+
+        # One breadth-first search per game, a layer at a time, the same one DistanceField runs.
+        # A seeker first reached in layer d steps to the lowest cell next to it in layer d - 1,
+        # just like DistanceField.next_step. Games drop out of the search once their seeker is reached.
+        step = here.copy()
+        waiting = np.flatnonzero(~reached[np.arange(len(games)), here])
+        front, reached = reached[waiting], reached[waiting]
+        while len(waiting) and front.any():
+            closer, front = front, self._spread(front) & ~reached
+            reached |= front
+            found = front[np.arange(len(waiting)), here[waiting]]
+            if found.any():
+                moves = self.seeker_moves[here[waiting[found]]]
+                first = closer[np.flatnonzero(found)[:, None], moves].argmax(axis=1)
+                step[waiting[found]] = moves[np.arange(len(moves)), first]
+                waiting, front, reached = waiting[~found], front[~found], reached[~found]
+
+        self.gave_up[games[waiting]] = True
+        self.seeker[games] = step
+        return np.delete(games, waiting)
+
+    def _check_world(self, games: 'np.ndarray') -> None:
+        """Game.check_world: catches, and flares running out."""
+        caught = self.alive[games] & (self.hiders[games] == self.seeker[games][:, None])
+        count = caught.sum(axis=1)
+        self.score[games] += 20 * count
+
+        hit = games[count > 0]
+        self.seeker_heat[hit, self.seeker[hit]] = -1
+        self.occupied[hit, self.seeker[hit]] = 0
+        self.alive[games] &= ~caught
+
+        # Only the games with a flare that just ran out need a look.
+        expiring = games[self.next_expiry[games] <= self.time[games]]
+        if len(expiring):
+            flares = self.flares[expiring]
+            flares[flares <= self.time[expiring][:, None]] = 0
+            self.flares[expiring] = flares
+            self._update_expiry(expiring)
+
+    def _update_expiry(self, games: 'np.ndarray') -> None:
+        """Works out when the next flare of each game runs out."""
+        flares = self.flares[games]
+        self.next_expiry[games] = np.where(flares > 0, flares, np.iinfo(np.int64).max).min(axis=1)
+
+    def _tick_hiders(self, games: 'np.ndarray', h: int) -> None:
+        """Hider.perceive and Hider.accept for hider h of every game it's still in."""
+        games = games[self.alive[games, h]]
+        here = self.hiders[games, h]
+        seeker = self.seeker[games]
+
+        # Heat up everything in sight, and a lot around the seeker if it's in sight.
+        count = self.hiders.shape[1]
+        heat = self.hider_heat.reshape(-1)
+        sight = self.hider_sight[here]
+        spotted = sight == seeker[:, None]
+        sight = self._flat(games * count + h, sight)
+        heat[sight] += np.where(spotted, 0, 1).astype(np.int32)
+        seen = spotted.any(axis=1)
+        around = self._flat(games[seen] * count + h, self.around_seeker[seeker[seen]])
+        heat[around] += 2
+
+        # Every FLARE_INTERVAL ticks it shoots a flare, every game with its own dice.
+        self.ticks[games, h] += 1
+        shooting = games[self.ticks[games, h] % FLARE_INTERVAL == 0]
+        if len(shooting):
+            where = np.array([self.rngs[g].choice(self.flare_spots[self.hiders[g, h]]) for g in shooting],
+                             dtype=np.intp)
+            area = self.flare_area[where]
+            self.seeker_heat.reshape(-1)[self._flat(shooting, area)] = 1
+            shot, other = np.nonzero(self.alive[shooting])
+            heat[self._flat(shooting[shot] * count + other, area[shot])] += 2
+            self.flares[shooting, where] = self.time[shooting] + FLARE_INTERVAL
+            self.next_expiry[shooting] = np.minimum(self.next_expiry[shooting], self.time[shooting] + FLARE_INTERVAL)
+
+        if self.hider_step == 0:
+            return
+
+        # Moving is one game at a time: coldest_step is a search of its own.
+        scratch = self._scratch
+        for g in games.tolist():
+            temps = self.hider_heat[g, h]
+            coldest = np.where(self.empty, temps, np.iinfo(temps.dtype).max).min()
+            goals = set(np.flatnonzero((temps == coldest) & self.empty).tolist())
+            start = int(self.hiders[g, h])
+            scratch.cells = temps.tolist()
+            step = coldest_step(self.state, scratch, start, goals, self.hider_step)
+            if step != start:
+                self.occupied[g, start] -= 1
+                self.occupied[g, step] += 1
+                self.hiders[g, h] = step
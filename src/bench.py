@@ -0,0 +1,186 @@
+from hide_and_seek import Game, game_from_file
+from mapgen import LAYOUTS, generate_map
+from typing import Callable
+from vector2d import vector
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    """Summarizes timings (in seconds) as milliseconds."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+
+    def at(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {"n": len(ordered), "mean_ms": sum(ordered) / len(ordered) * 1000,
+            "p50_ms": at(0.50), "p90_ms": at(0.90), "p99_ms": at(0.99), "max_ms": ordered[-1] * 1000}
+
+
+def time_calls(call: Callable[[], object], repeat: int) -> list[float]:
+    """Times every call separately."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_map(map_path: str, ticks: int, samples: int, goals: int, seed: int,
+              seeker_planner: str, hider_planner: str, heatmap: str,
+              profile_path: str | None = None) -> dict[str, dict[str, float]]:
+    """Times every hot spot of the engine on one map, separately."""
+    rng = random.Random(seed)
+    report: dict[str, dict[str, float]] = {}
+
+    # Fresh maps all the way, so nothing one measurement works out speeds up the next one.
+    report["load"] = percentiles(time_calls(lambda: game_from_file(map_path, heatmap, shared=False), 3))
+
+    game = game_from_file(map_path, heatmap, shared=False)
+    view = game.state
+    walkable = [view.index(x, y) for y in range(view.height) for x in range(view.width)
+                if view.walkable[view.index(x, y)]]
+    cells = [view.vector_at(rng.choice(walkable)) for _ in range(samples)]
+    agent = game.seeker
+
+    # The first round fills the caches, the second one is what every tick after that pays.
+    report["get_moveset_cold"] = percentiles([t for pos in cells
+                                              for t in time_calls(lambda: agent.get_moveset(pos), 1)])
+    report["get_moveset"] = percentiles([t for pos in cells
+                                         for t in time_calls(lambda: agent.get_moveset(pos), 1)])
+
+    def look(pos: vector) -> list[bool]:
+        agent.position = pos
+        return [agent.can_see(cell) for cell in agent.get_neighbors(pos, agent.vision_range)]
+
+    report["can_see_window"] = percentiles([t for pos in cells[:samples // 10 + 1]
+                                            for t in time_calls(lambda: look(pos), 1)])
+    agent.position = cells[0]
+
+    def seek(goal_set: set[vector]) -> None:
+        try:
+            game.seeker.multi_astar(game, goal_set)
+        except ValueError:
+            pass  # Unreachable goals, still worth timing.
+
+    goal_sets = [set(rng.sample(cells, min(goals, len(cells)))) for _ in range(samples // 10 + 1)]
+    report["seeker_multi_astar"] = percentiles([t for goal_set in goal_sets
+                                                for t in time_calls(lambda: seek(goal_set), 1)])
+    if game.hiders:
+        # Times the planner games actually use for the hiders, dijkstra unless told otherwise.
+        hider = game.hiders[0]
+        hider.planner = hider_planner
+        goal_lists = [list(map(view.index_of, goal_set)) for goal_set in goal_sets]
+        report["hider_plan"] = percentiles([t for goal_list in goal_lists
+                                            for t in time_calls(lambda: hider.plan(goal_list), 1)])
+
+    report["tick"] = percentiles(time_ticks(map_path, ticks, seed, seeker_planner, hider_planner, heatmap))
+    if profile_path:
+        time_ticks(map_path, ticks, seed, seeker_planner, hider_planner, heatmap, profile_path)
+
+    # tracemalloc slows everything down a lot, so memory gets a shorter run of its own.
+    tracemalloc.start()
+    time_ticks(map_path, min(ticks, 20), seed, seeker_planner, hider_planner, heatmap)
+    report["memory"] = {"peak_mib": tracemalloc.get_traced_memory()[1] / 2 ** 20}
+    tracemalloc.stop()
+    return report
+
+
+def time_ticks(map_path: str, ticks: int, seed: int, seeker_planner: str,
+               hider_planner: str, heatmap: str, profile_path: str | None = None) -> list[float]:
+    """Plays a fresh game for up to ticks ticks, timing every Game.tick.
+       With profile_path, the game is profiled and the records are written there as CSV."""
+    game: Game = game_from_file(map_path, heatmap, seed=seed, shared=False)
+    game.seeker.planner = seeker_planner
+    for hider in game.hiders:
+        hider.planner = hider_planner
+    profiler = game.enable_profiling() if profile_path else None
+
+    samples = []
+    for _ in range(ticks):
+        if game.terminal_score() != 0:
+            break
+        start = time.perf_counter()
+        try:
+            game.tick()
+        except ValueError:
+            break  # The seeker gave up.
+        samples.append(time.perf_counter() - start)
+
+    if profiler is not None and profile_path:
+        profiler.to_csv(profile_path)
+    return samples
+
+
+def print_report(name: str, report: dict[str, dict[str, float]]) -> None:
+    """Prints one map's report as a table."""
+    print(f"== {name}")
+    print(f"{'':<20}{'n':>6}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}  (ms)")
+    for label, stats in report.items():
+        if label == "memory":
+            continue
+        if not stats:
+            print(f"{label:<20}{0:>6}")
+            continue
+        print(f"{label:<20}{stats['n']:>6}" + "".join(f"{stats[key]:>10.3f}" for key in
+                                                       ("mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms")))
+    print(f"{'peak memory':<20}{report['memory']['peak_mib']:>16.2f} MiB\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks the engine on generated maps.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 100, 200],
+                        help="map sizes to try, each map is SIZE x SIZE")
+    parser.add_argument("--layouts", nargs="+", choices=list(LAYOUTS), default=["open", "rooms"])
+    parser.add_argument("--density", type=float, default=0.2)
+    parser.add_argument("--hiders", type=int, default=5)
+    parser.add_argument("--seeker", type=int, nargs=2, default=[3, 1], metavar=("VISION", "STEP"))
+    parser.add_argument("--hider", type=int, nargs=2, default=[2, 1], metavar=("VISION", "STEP"))
+    parser.add_argument("--ticks", type=int, default=100, help="ticks to time per map")
+    parser.add_argument("--samples", type=int, default=200, help="calls to time per function")
+    parser.add_argument("--goals", type=int, default=16, help="goals per multi_astar call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--seeker-planner", default="astar")
+    parser.add_argument("--hider-planner", default="dijkstra")
+    parser.add_argument("--heatmap", default="list")
+    parser.add_argument("-o", "--output", default=None, help="also write the reports as JSON")
+    parser.add_argument("--profile", default=None, metavar="FOLDER",
+                        help="also profile every game, writing one CSV per map into FOLDER")
+    args = parser.parse_args()
+
+    reports = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for size in args.sizes:
+            for layout in args.layouts:
+                name = f"{layout}_{size}x{size}"
+                map_path = os.path.join(folder, f"{name}.txt")
+                with open(map_path, "w") as file:
+                    seeker_vision, seeker_step = args.seeker
+                    hider_vision, hider_step = args.hider
+                    file.write(generate_map(size, size, args.density, layout, args.hiders,
+                                            seeker_vision=seeker_vision, seeker_step=seeker_step,
+                                            hider_vision=hider_vision, hider_step=hider_step,
+                                            time_limit=10 ** 9, seed=args.seed))
+
+                profile_path = os.path.join(args.profile, f"{name}.csv") if args.profile else None
+                reports[name] = bench_map(map_path, args.ticks, args.samples, args.goals, args.seed,
+                                          args.seeker_planner, args.hider_planner, args.heatmap,
+                                          profile_path)
+                print_report(name, reports[name])
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(reports, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
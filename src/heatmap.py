@@ -0,0 +1,300 @@
+from array import array
+from collections import Counter
+from map_state import MapState, CellType
+from typing import Iterator, Sequence
+
+import copy
+import itertools
+import kernels
+import operator
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, only the "numpy" heatmap needs it.
+    np = None  # type: ignore[assignment]
+
+# Turns MapState.cells into a 1 for every EMPTY cell and a 0 for the rest, see HeatIndex.recount.
+_EMPTY_MASK = bytes(value == CellType.EMPTY.value for value in range(256))
+
+
+class Heatmap:
+    """The temperature of every cell, as the agent believes it to be.
+       Cells are addressed with the flat cell indices of the MapState it was made for.
+       This one keeps plain Python ints in a flat list, laid out like MapState.cells."""
+
+    view: MapState
+    cells: list[int]
+
+    # The cells written to since the last drain_changes(), None while nobody is tracking.
+    changed: set[int] | None = None
+
+    # True while the temperatures are shared with a copy() (or the copy it came from).
+    shared: bool = False
+
+    # Where extreme() looks the hottest and coldest cells up, made by its first call.
+    index: 'HeatIndex | None' = None
+
+    def __init__(self, view: MapState) -> None:
+        self.view = view
+        self.cells = [0] * len(view.cells)
+
+    def copy(self, view: MapState | None = None) -> 'Heatmap':
+        """Returns a copy that shares the temperatures with this heatmap until either is
+           written to. view is the map the copy is for, if it isn't the same one."""
+        clone = copy.copy(self)
+        clone.view = view or self.view
+        clone.changed = set(self.changed) if self.changed is not None else None
+        clone.index = None  # Made again if the copy ever needs one.
+        self.shared = clone.shared = True
+        return clone
+
+    def _own(self) -> None:
+        """Makes a private copy of the temperatures, before the first write after copy()."""
+        self.cells = self.cells[:]
+        self.shared = False
+
+    def track_changes(self) -> None:
+        """Starts keeping track of which cells are written to."""
+        if self.changed is None:
+            self.changed = set()
+
+    def drain_changes(self) -> set[int]:
+        """Returns the cells written to since the last call, and forgets about them."""
+        changed, self.changed = self.changed or set(), set()
+        return changed
+
+    def _touch(self, cells: Sequence[int]) -> None:
+        """Notes down the cells about to be written to, for drain_changes() and the index."""
+        if self.changed is not None:
+            self.changed.update(cells)
+        if self.index is not None:
+            self.index.touch(cells)
+
+    def get(self, i: int) -> int:
+        """Returns the temperature of the cell at index i."""
+        return self.cells[i]
+
+    def set(self, i: int, value: int) -> None:
+        """Sets the temperature of the cell at index i."""
+        if self.shared:
+            self._own()
+        self._touch((i,))
+        self.cells[i] = value
+
+    def add(self, cells: Sequence[int], amount: int) -> None:
+        """Heats up (or cools down, if amount is negative) all cells."""
+        if self.shared:
+            self._own()
+        self._touch(cells)
+        kernels.heat_add(self.cells, cells, amount)
+
+    def fill(self, cells: Sequence[int], value: int) -> None:
+        """Sets the temperature of all cells to value."""
+        if self.shared:
+            self._own()
+        self._touch(cells)
+        kernels.heat_fill(self.cells, cells, value)
+
+    def rows(self) -> Iterator[list[int]]:
+        """Yields the temperatures of the map, row by row."""
+        for y in range(self.view.height):
+            start = self.view.index(0, y)
+            yield self.cells[start:start + self.view.width]
+
+    def extreme(self, highest: bool) -> list[int]:
+        """Returns the EMPTY cells with the highest (or lowest) temperature of all EMPTY cells,
+           in cell index order. Walls and boxes are left out: a box pushed onto the hottest
+           cell would otherwise leave nothing to go to. Empty only if no cell is EMPTY.
+           The first call counts every cell into a HeatIndex, later calls only look at the
+           cells written to since."""
+        if self.index is None:
+            self.index = HeatIndex(self)
+        return self.index.extreme(highest)
+
+
+class HeatIndex:
+    """How many EMPTY cells of a heatmap are at every temperature, kept up to date as it's
+       written to. Writes only note down what a cell was before (touch), the counts catch up on
+       the next extreme(), so finding the extreme temperature costs about as much as the cells
+       that heated up or cooled down. The cells at it are then picked out of the heatmap itself
+       in C: with index(), which stops at the last one, or in bulk once they cover a quarter of it.
+       It takes a dict entry per temperature, not per cell. When a box moves (the map's
+       revision changes), the counts are worked out again."""
+
+    def __init__(self, heatmap: Heatmap) -> None:
+        self.heatmap = heatmap
+        self.counts: Counter[int] = Counter()
+        self.revision = -1
+
+        # Cells written to since the counts were last brought up to date, and the temperature
+        # they're counted under.
+        self.pending: dict[int, int] = {}
+
+    def touch(self, cells: Sequence[int]) -> None:
+        """Notes down the cells about to be written to."""
+        pending, heat = self.pending, self.heatmap.cells
+        for i in cells:
+            if i not in pending:
+                pending[i] = heat[i]
+
+    def recount(self) -> None:
+        """Counts every EMPTY cell again."""
+        view = self.heatmap.view
+        empty = view.cells.translate(_EMPTY_MASK)
+        self.counts = Counter(itertools.compress(self.heatmap.cells, empty))
+        self.revision = view.revision
+        self.pending.clear()
+
+    def catch_up(self) -> None:
+        """Moves the cells written to since the last call to the count of their new temperature."""
+        if self.revision != self.heatmap.view.revision:
+            self.recount()
+            return
+        counts, heat, cells = self.counts, self.heatmap.cells, self.heatmap.view.cells
+        empty = CellType.EMPTY.value
+        for i, old in self.pending.items():
+            new = heat[i]
+            if new != old and cells[i] == empty:
+                counts[old] -= 1
+                if not counts[old]:
+                    del counts[old]
+                counts[new] += 1
+        self.pending.clear()
+
+    def extreme(self, highest: bool) -> list[int]:
+        """See Heatmap.extreme."""
+        self.catch_up()
+        if not self.counts:
+            return []
+        temp = max(self.counts) if highest else min(self.counts)
+        heat, cells, empty = self.heatmap.cells, self.heatmap.view.cells, CellType.EMPTY.value
+        left = self.counts[temp]
+        if left * 4 > len(heat):
+            mask = cells.translate(_EMPTY_MASK)
+            return list(itertools.compress(itertools.compress(range(len(heat)), mask),
+                                           map(operator.eq, itertools.compress(heat, mask), itertools.repeat(temp))))
+
+        found: list[int] = []
+        i = -1
+        while left:
+            i = heat.index(temp, i + 1)
+            if cells[i] == empty:
+                found.append(i)
+                left -= 1
+        return found
+
+
+class ArrayHeatmap(Heatmap):
+    """A heatmap kept in a flat NumPy array, so whole vision windows and flare areas are
+       updated with one masked operation and the extremes are found without Python loops."""
+
+    grid: 'np.ndarray'
+
+    def __init__(self, view: MapState) -> None:
+        if np is None:
+            raise ImportError("The numpy heatmap needs NumPy to be installed.")
+        self.view = view
+        self.grid = np.zeros(len(view.cells), dtype=np.int32)
+
+    def _take(self, cells: Sequence[int]) -> 'np.ndarray':
+        """Turns a bunch of cell indices into an index array, without copying if possible."""
+        if isinstance(cells, np.ndarray):
+            return cells
+        try:
+            return np.frombuffer(cells, dtype=np.intc)  # type: ignore[call-overload]
+        except TypeError:
+            return np.fromiter(cells, dtype=np.intp)
+
+    def _own(self) -> None:
+        self.grid = self.grid.copy()
+        self.shared = False
+
+    def get(self, i: int) -> int:
+        return int(self.grid[i])
+
+    def set(self, i: int, value: int) -> None:
+        if self.shared:
+            self._own()
+        self._touch((i,))
+        self.grid[i] = value
+
+    def add(self, cells: Sequence[int], amount: int) -> None:
+        if self.shared:
+            self._own()
+        self._touch(cells)
+        self.grid[self._take(cells)] += amount
+
+    def fill(self, cells: Sequence[int], value: int) -> None:
+        if self.shared:
+            self._own()
+        self._touch(cells)
+        self.grid[self._take(cells)] = value
+
+    def rows(self) -> Iterator[list[int]]:
+        yield from self._inside().tolist()
+
+    def _inside(self) -> 'np.ndarray':
+        """The heatmap as a (height, width) view, without the border frame."""
+        return self.grid.reshape(self.view.height + 2, self.view.stride)[1:-1, 1:-1]
+
+    def extreme(self, highest: bool) -> list[int]:
+        # The border frame is never EMPTY, so it drops out with the mask.
+        empty = np.frombuffer(self.view.cells, dtype=np.uint8) == CellType.EMPTY.value
+        heat = self.grid[empty]
+        if not heat.size:
+            return []
+        temp = heat.max() if highest else heat.min()
+        return np.flatnonzero((self.grid == temp) & empty).tolist()
+
+
+# The temperatures a compact heatmap can hold. It sticks at these instead of wrapping around.
+COMPACT_MIN, COMPACT_MAX = kernels.HEAT16_MIN, kernels.HEAT16_MAX
+
+
+class CompactHeatmap(Heatmap):
+    """A heatmap of 16 bit ints in an array('h'), 2 bytes a cell instead of an 8 byte pointer.
+       No NumPy needed. Temperatures stick at COMPACT_MIN and COMPACT_MAX, which takes a
+       cell being seen every tick for over 30000 ticks."""
+
+    cells: array  # type: ignore[assignment]
+
+    def __init__(self, view: MapState) -> None:
+        self.view = view
+        self.cells = array("h", bytes(2 * len(view.cells)))
+
+    def add(self, cells: Sequence[int], amount: int) -> None:
+        if self.shared:
+            self._own()
+        self._touch(cells)
+        kernels.heat_add16(self.cells, cells, amount)
+
+
+class CompactArrayHeatmap(ArrayHeatmap):
+    """The numpy heatmap in 16 bit ints, sticking at COMPACT_MIN and COMPACT_MAX like CompactHeatmap."""
+
+    def __init__(self, view: MapState) -> None:
+        super().__init__(view)
+        self.grid = self.grid.astype(np.int16)
+
+    def add(self, cells: Sequence[int], amount: int) -> None:
+        if self.shared:
+            self._own()
+        self._touch(cells)
+        take = self._take(cells)
+        self.grid[take] = np.clip(self.grid[take].astype(np.int32) + amount, COMPACT_MIN, COMPACT_MAX)
+
+
+# All heatmap kinds an agent can be made with.
+HEATMAPS: dict[str, type[Heatmap]] = {
+    "list": Heatmap,
+    "numpy": ArrayHeatmap,
+    "compact": CompactHeatmap,
+    "numpy16": CompactArrayHeatmap,
+}
+
+
+def make_heatmap(view: MapState, kind: str = "list") -> Heatmap:
+    """Creates an empty heatmap of the given kind for the map."""
+    if kind not in HEATMAPS:
+        raise ValueError(f"Unknown heatmap kind {kind}.")
+    return HEATMAPS[kind](view)
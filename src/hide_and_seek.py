@@ -1,8 +1,29 @@
-from map_state import MapState, CellType
+from agent import Agent
+from collections import Counter
+from loader import MapFormatError, load_map, shared_map
+from map_state import MapState, CellType, zobrist_key
+from profiler import Profiler
 from seeker import Seeker
 from hider import Hider
+from typing import TYPE_CHECKING
 from vector2d import vector
 
+import copy
+import logging
+import random
+
+if TYPE_CHECKING:
+    from replay import ReplayWriter
+
+log = logging.getLogger(__name__)
+
+# Zobrist kinds of the things on the map that aren't cells, see map_state.zobrist_key.
+SEEKER_KEY = 4
+HIDER_KEY = 5
+FLARE_KEY = 6
+TIME_KEY = 7
+SCORE_KEY = 8
+
 
 class Game:
     """Represents a game of Hide and Seek.
@@ -21,30 +42,106 @@ class Game:
     seeker: Seeker
     hiders: list[Hider]
 
-    def __init__(self, start: MapState, max_time: int) -> None:
+    # Cell index -> the hiders standing there. Kept up to date by move_agent and check_world,
+    # so hiders should only ever be moved through move_agent.
+    hiders_at: dict[int, list[Hider]]
+
+    # Rolls every die in the game (where flares land), so a game with a seed plays out
+    # the same every time. map_path is the file it was read from, if any.
+    seed: int | None
+    rng: random.Random
+    map_path: str | None = None
+
+    # Times every phase of every tick, if enable_profiling() was called.
+    profiler: Profiler | None = None
+
+    # Writes every tick down, if record_replay() was called.
+    replay: 'ReplayWriter | None' = None
+
+    def __init__(self, start: MapState, max_time: int, seed: int | None = None) -> None:
         self.state = start
         self.time_elapsed = 0
         self.score = 50
         self.maximum_time = max_time
         self.flares = {}
         self.turn = False
+        self.seed = seed
+        self.rng = random.Random(seed)
+
+    def enable_profiling(self) -> Profiler:
+        """Attaches a profiler to this game, and has all agents start counting what they do."""
+        self.profiler = Profiler()
+        for agent in [self.seeker, *self.hiders]:
+            agent.stats = Counter()
+        return self.profiler
+
+    def record_replay(self, file_path: str) -> 'ReplayWriter':
+        """Starts writing a replay of this game to a file, see replay.py. Close it when done."""
+        from replay import ReplayWriter  # replay.py replays games, so it needs this module first.
+        self.replay = ReplayWriter(self, file_path)
+        return self.replay
 
     def start_game(self, seeker: Seeker, hiders: list[Hider]) -> None:
         """Starts the game with the seeker and hiders."""
         self.seeker = seeker
         self.hiders = hiders
+        self.seeker.name = "seeker"
+        for i, hider in enumerate(self.hiders):
+            hider.name = f"hider{i}"
+        self.index_hiders()
+        self.arrange_boxes()
+
+    def index_hiders(self) -> None:
+        """Rebuilds hiders_at from scratch."""
+        self.hiders_at = {}
+        for hider in self.hiders:
+            self.hiders_at.setdefault(self.state.index_of(hider.position), []).append(hider)
+
+    def clone(self) -> 'Game':
+        """Returns a snapshot of the game that can be played on without touching this one.
+           The map and the heatmaps are copy-on-write, so this is cheap until either game
+           changes them. The dice carry on from the same state, so both play out the same.
+           Profiling and replays aren't carried over."""
+        game = copy.copy(self)
+        game.state = self.state.copy()
+        game.flares = dict(self.flares)
+        game.rng = random.Random()
+        game.rng.setstate(self.rng.getstate())
+        game.profiler = game.replay = None
+        game.seeker = self.seeker.clone(game.state)
+        game.hiders = [hider.clone(game.state) for hider in self.hiders]
+        game.index_hiders()
+        return game
+
+    def world_hash(self) -> int:
+        """A 64 bit Zobrist hash of the world: the map, where everyone stands, the flares,
+           the time and the score. What the agents believe (their heatmaps) is left out.
+           The map's part is kept up to date as it changes, the rest is a few XORs.
+           Like any XOR hash, two hiders on the same cell cancel each other out."""
+        index_of = self.state.index_of
+        world = self.state.zobrist ^ zobrist_key(index_of(self.seeker.position), SEEKER_KEY)
+        for hider in self.hiders:
+            world ^= zobrist_key(index_of(hider.position), HIDER_KEY)
+        for flare in self.flares:
+            world ^= zobrist_key(index_of(flare), FLARE_KEY)
+        return world ^ zobrist_key(self.time_elapsed, TIME_KEY) ^ zobrist_key(self.score & 0xFFFFFFFF, SCORE_KEY)
 
     def is_there_hider(self, pos: vector) -> bool:
         """Checks if there is a hider at the position pos."""
-        for hider in self.hiders:
-            if hider.position == pos:
-                return True
-        return False
+        return self.state.validate_coords(pos.x, pos.y) and self.state.index_of(pos) in self.hiders_at
+
+    def is_there_hider_at(self, i: int) -> bool:
+        """Checks if there is a hider on the cell at index i."""
+        return i in self.hiders_at
 
     def is_there_seeker(self, pos: vector) -> bool:
         """Checks if there is a seeker at the position pos."""
         return self.seeker.position == pos
 
+    def is_there_seeker_at(self, i: int) -> bool:
+        """Checks if the seeker is on the cell at index i."""
+        return self.state.index_of(self.seeker.position) == i
+
     def terminal_score(self) -> int:
         """Returns the score of the game, if the game is over."""
         if self.time_elapsed > self.maximum_time:
@@ -53,18 +150,129 @@ class Game:
             return 1  # Seeker wins.
         return 0  # Game is not over.
 
+    def push_box(self, at: vector, direction: vector) -> bool:
+        """Pushes the box at at one cell further along direction. If that cell isn't free, the box
+           is shoved to the free cell around it closest to straight ahead, but never back onto
+           whoever pushed it. Returns False if the box has nowhere to go."""
+        ahead = at + vector((direction.x > 0) - (direction.x < 0), (direction.y > 0) - (direction.y < 0))
+        pusher = at - direction
+        spots = sorted((spot for spot in self.seeker.get_neighbors(at, 1)
+                        if spot != at and spot != pusher and self.state[spot] == CellType.EMPTY
+                        and not self.is_there_hider(spot) and not self.is_there_seeker(spot)),
+                       key=lambda spot: ((spot - ahead).length_squared(), spot.y, spot.x))
+        if not spots:
+            return False
+
+        self.state[spots[0]] = CellType.BOX
+        self.state[at] = CellType.EMPTY
+        return True
+
+    def move_agent(self, agent: Agent, direction: vector) -> bool:
+        """Moves an agent, following the rules about boxes. Only the seeker may push them
+           during the game; a box nobody can push is as good as a wall."""
+        target = agent.position + direction
+        if direction != vector(0, 0) and self.state[target] == CellType.BOX:
+            if agent is not self.seeker or not self.push_box(target, direction):
+                log.info("%s can't push the box at %s.", agent.name, target)
+                return False
+
+        start = agent.position
+        if not agent.move(direction):
+            return False
+        if isinstance(agent, Hider) and agent.position != start:
+            # Keep hiders_at up to date.
+            was = self.hiders_at[self.state.index_of(start)]
+            was.remove(agent)
+            if not was:
+                del self.hiders_at[self.state.index_of(start)]
+            self.hiders_at.setdefault(self.state.index_of(agent.position), []).append(agent)
+        return True
+
+    def nearest_box(self, hider: Hider, boxes: list[int]) -> int | None:
+        """The one of boxes the hider can walk up to in the fewest moves, going around walls and
+           every other box. Ties go to the lowest index. None if it can't get to any of them."""
+        state, box = self.state, CellType.BOX.value
+        wanted = set(boxes)
+        start = state.index_of(hider.position)
+        seen, frontier = {start}, [start]
+        while frontier:
+            found: list[int] = []
+            layer: list[int] = []
+            for i in frontier:
+                for j in state.neighbors(i, hider.max_step):
+                    if j in seen:
+                        continue
+                    seen.add(j)
+                    if j in wanted:
+                        found.append(j)
+                    elif state.cells[j] != box:
+                        layer.append(j)
+            if found:
+                return min(found)
+            frontier = layer
+        return None
+
+    def arrange_boxes(self) -> None:
+        """Level 4: before the game starts, the hiders take turns dragging the box nearest to them
+           right next to themselves, to the side where it hides them from the most cells around
+           (what the hider can't see can't see it back). Only boxes a hider can walk up to count.
+           Every box is moved at most once, and only if that hides the hider better. Maps without
+           boxes are left as they are."""
+        state = self.state
+        boxes = [i for i, cell in enumerate(state.cells) if cell == CellType.BOX.value]
+        radius = self.seeker.vision_range
+
+        # Goes round the hiders until every box is done, or none of them can get to the ones left.
+        taken = True
+        while boxes and taken:
+            taken = False
+            for hider in self.hiders:
+                if not boxes:
+                    break
+                at = state.index_of(hider.position)
+                nearest = self.nearest_box(hider, boxes)
+                if nearest is None:
+                    continue
+                boxes.remove(nearest)
+                taken = True
+
+                # Try the box on every free cell around the hider, keep the one it's seen from the least.
+                best, best_seen = nearest, state.visibility(at, radius).bit_count()
+                state[state.vector_at(nearest)] = CellType.EMPTY
+                for spot in state.window(at, 1):
+                    pos = state.vector_at(spot)
+                    if state[pos] != CellType.EMPTY or self.is_there_hider(pos) or self.is_there_seeker(pos):
+                        continue
+                    state[pos] = CellType.BOX
+                    seen = state.visibility(at, radius).bit_count()
+                    state[pos] = CellType.EMPTY
+                    if seen < best_seen:
+                        best, best_seen = spot, seen
+
+                state[state.vector_at(best)] = CellType.BOX
+                if best != nearest:
+                    log.info("%s moved a box from %s to %s.", hider.name, state.vector_at(nearest), state.vector_at(best))
+
+    def tick_agent(self, agent: Agent) -> None:
+        """Tells an agent to look around and move."""
+        if self.profiler is not None:
+            with self.profiler.phase(agent.name, agent):
+                agent.perceive(self)
+                self.move_agent(agent, agent.accept(self))
+            return
+
+        agent.perceive(self)
+        next_dir = agent.accept(self)
+        self.move_agent(agent, next_dir)
+
     def tick_seeker(self) -> None:
         """Tells the seeker to move."""
-        self.seeker.perceive(self)
-        next_dir = self.seeker.accept(self)
-        self.seeker.move(next_dir)
+        self.tick_agent(self.seeker)
 
     def tick_hiders(self) -> None:
         """Tells the hiders to move."""
         for hider in self.hiders:
-            hider.perceive(self)
-            next_dir = hider.accept(self)
-            hider.move(next_dir)
+            self.tick_agent(hider)
 
     def tick_score(self) -> None:
         """Ticks the score."""
@@ -78,23 +286,18 @@ class Game:
             hider.perceive_flare(where)
 
         self.flares[where] = self.time_elapsed + interval
-        print(f"Flare shot at {where} at {self.time_elapsed}s.")
+        log.info("Flare shot at %s at %ds.", where, self.time_elapsed)
 
     def check_world(self) -> None:
         """Attempts to check the world if seeker caught anything."""
-        hiders_left: list[Hider] = []
-        for hider in self.hiders:
-            # This hider has been caught!
-            if self.seeker.position == hider.position:
-                self.score += 20
-
-                # Remove the heated cell.
-                self.seeker.heatmap[hider.position.y][hider.position.x] = -1
-                continue
+        caught = self.hiders_at.pop(self.state.index_of(self.seeker.position), None)
+        if caught:
+            # These hiders have been caught!
+            self.score += 20 * len(caught)
 
-            # If not caught, add to the list.
-            hiders_left.append(hider)
-        self.hiders = hiders_left
+            # Remove the heated cell.
+            self.seeker.heatmap.set(self.state.index_of(self.seeker.position), -1)
+            self.hiders = [hider for hider in self.hiders if hider not in caught]
 
         # Also, remove the flare cells if expired.
         self.flares = {k: v for k, v in self.flares.items() if v >
@@ -105,113 +308,46 @@ class Game:
         if self.terminal_score() != 0:
             return
 
-        self.tick_score()
-        self.tick_seeker()
-        self.check_world()
-        self.tick_hiders()
+        if self.profiler is None:
+            self.tick_score()
+            self.tick_seeker()
+            self.check_world()
+            self.tick_hiders()
+        else:
+            self.profiler.start_tick(self.time_elapsed + 1)
+            with self.profiler.phase("tick"):
+                self.tick_score()
+                self.tick_seeker()
+                with self.profiler.phase("check_world"):
+                    self.check_world()
+                self.tick_hiders()
+
+        if self.replay is not None:
+            self.replay.frame(self)
 
     def print_rep(self) -> None:
-        """Prints the representation of the game."""
-        print("---------------------------------------")
-        print(f"{len(self.hiders)} left, {self.time_elapsed}s elapsed\n")
-
-        seeker = self.seeker.position
-        hiders = set([hider.position for hider in self.hiders])
-
-        perceived = set(filter(lambda pos: self.seeker.can_see(pos),
-                        self.seeker.get_neighbors(self.seeker.position, self.seeker.vision_range)))
-
-        for y in range(len(self.state.current_map)):
-            for x in range(len(self.state.current_map[y])):
-                if vector(x, y) == seeker:
-                    print("S", end="")
-                elif vector(x, y) in hiders:
-                    print("H", end="")
-                elif vector(x, y) in self.flares:
-                    print("*", end="")
-                elif self.state[x, y] == CellType.WALL:
-                    print("X", end="")
-                elif self.state[x, y] == CellType.BOX:
-                    print("☐", end="")
-                elif vector(x, y) in perceived:
-                    print("-", end="")
-                else:
-                    print(".", end="")
-            print()
-
-
-def game_from_file(file_path: str) -> Game:
-    """Reads a game from a file and returns a Game object."""
-    try:
-        file = open(file_path, "r")
-
-        # First line is the time limit.
-        time_limit = int(file.readline().strip())
-
-        # Second line is seeker's vision and step count.
-        # Third line is hider's vision and step count.
-        seeker_vision, seeker_step = tuple(map(int, file.readline().split()))
-        hider_vision, hider_step = tuple(map(int, file.readline().split()))
-
-        # All others are the map.
-        map_lines = [line.strip() for line in file.read().splitlines()]
-
-        # All lines must have the same length.
-        if len(set(map(len, map_lines))) != 1:
-            print(f"Invalid line lengths in file {file_path}.")
-            raise ValueError("Invalid map file")
-
-        # Extract information.
-        cells: list[list[CellType]] = []
-        hiders: list[vector] = []
-        seeker: vector | None = None
-
-        for y, line in enumerate(map_lines):
-            cell_line: list[CellType] = []
-            for x, cell in enumerate(line):
-                if cell == "X":
-                    cell_line.append(CellType.WALL)
-                    continue
-                elif cell == ".":
-                    cell_line.append(CellType.EMPTY)
-                    continue
-                elif cell == "H":
-                    cell_line.append(CellType.EMPTY)
-                    hiders.append(vector(x, y))
-                    continue
-                elif cell == "S":
-                    if seeker:  # Multiple seekers.
-                        print(f"Multiple seekers in file {file_path}.")
-                        raise ValueError("Invalid map file")
-
-                    cell_line.append(CellType.EMPTY)
-                    seeker = vector(x, y)
-                    continue
-                elif cell == "☐":
-                    cell_line.append(CellType.BOX)
-                    continue
-
-                print(f"Invalid character {
-                      cell} at ({x},{y}) in file {file_path}.")
-                raise ValueError("Invalid map file")
-            cells.append(cell_line)
-
-        # Check if seeker is present.
-        if not seeker:
-            print(f"Seeker not found in file {file_path}.")
-            raise ValueError("Invalid map file")
-
-        # Create the game.
-        state = MapState(cells)
-        seeker_agent = Seeker(seeker, seeker_vision, state, seeker_step)
-        hider_agents = [Hider(hider, hider_vision, state, hider_step)
-                        for hider in hiders]
-        game = Game(state, time_limit)
-        game.start_game(seeker_agent, hider_agents)
-        return game
-    except FileNotFoundError:
-        print(f"File {file_path} not found.")
-        exit(1)
-    except ValueError:
-        print(f"Invalid format in file {file_path}.")
-        exit(1)
+        """Prints the representation of the game. See render.py for drawing it again and again."""
+        from render import board, frame, status  # render builds on this module.
+        print(f"---------------------------------------\n{status(self)}\n\n{board(self, frame(self))}")
+
+
+def game_from_file(file_path: str, heatmap: str = "list", cache_dir: str | None = None,
+                   seed: int | None = None, shared: bool = True) -> Game:
+    """Reads a game from a file and returns a Game object.
+       heatmap is the kind of heatmap the agents keep, see heatmap.HEATMAPS.
+       cache_dir keeps a binary cache of the map around, see loader.load_map.
+       seed seeds the game's dice, without one every game is different.
+       shared plays on this process' copy of the map (see loader.shared_map), so every game on
+       the same map shares its precomputed tables. Turn it off to start from a fresh map.
+       Raises loader.MapFormatError if the file isn't a game map, OSError if it can't be read."""
+    spec, state = shared_map(file_path, cache_dir) if shared else load_map(file_path, cache_dir)
+    if spec.seeker is None:
+        raise MapFormatError(f"{file_path}: not a game map, there are no agents in it.")
+
+    seeker_agent = Seeker(spec.seeker, spec.seeker_vision, state, spec.seeker_step, heatmap)
+    hider_agents = [Hider(hider, spec.hider_vision, state, spec.hider_step, heatmap)
+                    for hider in spec.hiders]
+    game = Game(state, spec.time_limit, seed)
+    game.map_path = file_path
+    game.start_game(seeker_agent, hider_agents)
+    return game
@@ -1,14 +1,20 @@
 from agent import Agent
 from vector2d import vector
-from typing import TYPE_CHECKING
-from map_state import CellType
+from typing import TYPE_CHECKING, Self
+from map_state import CellType, MapState
+from pathfinding import coldest_step
+from incremental import DStarLite
 
 import random
 import heapq
+import logging
+import time
 
 if TYPE_CHECKING:
     from hide_and_seek import Game
 
+log = logging.getLogger(__name__)
+
 # The interval at which the hider shoots out an alert flare.
 # This is to notify the seeker.
 FLARE_INTERVAL = 10
@@ -23,8 +29,21 @@ class Hider(Agent):
 
     ticks_passed: int = 0
 
-    def choose_flare_positions(self) -> vector:
-        """Yields a flare position."""
+    # How the hider finds the coldest path. "dijkstra" is pathfinding.coldest_step,
+    # "incremental" keeps a D* Lite search around and repairs it with the cells that heated up,
+    # "astar" is the old multi_astar, which can miss the coldest path.
+    planner: str = "dijkstra"
+    replanner: DStarLite | None = None
+    replanned_at: int = -1  # view.revision the replanner was made at.
+
+    def clone(self, view: MapState) -> Self:
+        """Same as Agent.clone. Searches are tied to their map, so the copy starts its own."""
+        hider = super().clone(view)
+        hider.replanner = None
+        return hider
+
+    def choose_flare_positions(self, rng: random.Random) -> vector:
+        """Yields a flare position, picked with rng."""
         positions: list[vector] = []
         for dx in range(-FLARE_RANGE, FLARE_RANGE + 1):
             for dy in range(-FLARE_RANGE, FLARE_RANGE + 1):
@@ -32,91 +51,140 @@ class Hider(Agent):
                 if pos == self.position or self.view[pos] != CellType.EMPTY:
                     continue
                 positions.append(self.position + vector(dx, dy))
-        return random.choice(positions)
+        return rng.choice(positions)
 
     def perceive(self, game: 'Game') -> None:
         """Perceives the world."""
-        for cell in self.get_neighbors(self.position, self.vision_range):
-            # Uh oh, out of bounds.
-            if self.view[cell] == CellType.BORDER or not self.can_see(cell):
-                continue
-
-            if not game.is_there_seeker(cell):
-                self.heatmap[cell.y][cell.x] += 1  # Heat up slightly.
+        seen: list[int] = []
+        visible = self.visible_cells()
+        self.count("can_see_calls", len(visible))  # One sight check per cell, worked out ahead of time.
+        for cell in visible:
+            if not game.is_there_seeker_at(cell):
+                seen.append(cell)
                 continue
 
             # Oh no. A seeker.
             # Heat up ALL cells around it.
-            for pos in self.get_neighbors(cell, game.seeker.max_step):
-                if self.view[pos] != CellType.EMPTY:
-                    continue
-                self.heatmap[pos.y][pos.x] += 2  # Heat up more.
+            around = [self.view.index_of(pos)
+                      for pos in self.get_neighbors(self.view.vector_at(cell), game.seeker.max_step)
+                      if self.view[pos] == CellType.EMPTY]
+            self.heatmap.add(around, 2)  # Heat up more.
+            self.count("heat_cells", len(around))
+
+        self.heatmap.add(seen, 1)  # Heat up slightly.
+        self.count("heat_cells", len(seen))
 
-            # There's no concept of cooling down for the hider.
+        # There's no concept of cooling down for the hider.
 
     def perceive_flare(self, flare: vector) -> None:
         """Perceives a flare."""
-        for pos in self.get_neighbors(flare, FLARE_RANGE):
-            if self.view[pos] != CellType.EMPTY:
-                continue
-            self.heatmap[pos.y][pos.x] += 2  # Heat up more.
+        cells = [self.view.index_of(pos) for pos in self.get_neighbors(flare, FLARE_RANGE)
+                 if self.view[pos] == CellType.EMPTY]
+        self.heatmap.add(cells, 2)  # Heat up more.
+        self.count("heat_cells", len(cells))
 
     def heuristic(self, cur: vector, goals: set[vector]) -> float:
         """Returns the heuristic value of the current position to the goal."""
         return max([cur.taxicab(goal) for goal in goals])
 
     def multi_astar(self, goals: set[vector]) -> vector:
-        """Launches a multi A* search, that finds the COLDEST path to ONE of the goals."""
+        """Launches a multi A* search, that finds the COLDEST path to ONE of the goals.
+           Goals it can't get to are left out up front. With a plan_budget or plan_time it stops
+           there, and heads for the cell with the best heuristic it came across instead."""
+        components = self.view.components(self.max_step)
+        component = components[self.view.index_of(self.position)]
+        goals = {goal for goal in goals if components[self.view.index_of(goal)] == component}
+        if not goals:
+            return vector(0, 0)  # Nowhere it can go, same as when the search runs dry.
+
         open_set: list[tuple[float, vector]] = [(0, self.position)]
         parents: dict[vector, vector] = {}
         g_score: dict[vector, float] = {self.position: 0}
+        budget, deadline, expanded = self.plan_budget or 0, self.plan_deadline(), 0
+        best, best_h = self.position, self.heuristic(self.position, goals)
 
         while open_set:
+            # Out of budget or time, settle for getting closer.
+            if (budget and expanded >= budget) or \
+                    (deadline and expanded % 64 == 0 and time.perf_counter() >= deadline):
+                log.debug("Ran out of planning after %d cells, heading to %s.", expanded, best)
+                self.count("partial_plans")
+                return self.first_step(best, parents)
+
             # Pop the current position.
             cur = heapq.heappop(open_set)[1]
+            expanded += 1
+            if self.stats is not None:
+                self.stats["nodes_expanded"] += 1
 
             # Found a goal, return the path.
             if cur in goals:
-                print(f"Found goal at {cur} in {len(goals)} goals.")
-                path: list[vector] = []
-                while cur != self.position:
-                    path.append(cur)
-                    cur = parents[cur]
-                return path[-1] - self.position
+                log.debug("Found goal at %s in %d goals.", cur, len(goals))
+                return self.first_step(cur, parents)
 
             for neighbor in self.get_moveset(cur):
-                # If the neighbor is out of bounds, or is a wall, skip it.
-                if self.view[neighbor] == CellType.BORDER or self.view[neighbor] == CellType.WALL:
+                # If the neighbor is out of bounds, a wall or a box it can't push, skip it.
+                if not self.view.is_walkable(neighbor) or self.view[neighbor] == CellType.BOX:
                     continue
 
                 # Calculate the new g score.
-                new_g = g_score[cur] + self.heatmap[neighbor.y][neighbor.x]
+                new_g = g_score[cur] + self.heatmap.get(self.view.index_of(neighbor))
 
                 # If the new g score is better than the old one, update it.
                 if new_g < g_score.get(neighbor, float('inf')):
                     g_score[neighbor] = new_g
-                    f_score = new_g + self.heuristic(neighbor, goals)
-                    heapq.heappush(open_set, (f_score, neighbor))
+                    h = self.heuristic(neighbor, goals)
+                    if h < best_h:
+                        best, best_h = neighbor, h
+                    heapq.heappush(open_set, (new_g + h, neighbor))
                     parents[neighbor] = cur
 
         return vector(0, 0)
 
+    def first_step(self, to: vector, parents: dict[vector, vector]) -> vector:
+        """The direction of the first move on the path multi_astar found to to."""
+        path: list[vector] = []
+        while to != self.position:
+            path.append(to)
+            to = parents[to]
+        return path[-1] - self.position if path else vector(0, 0)
+
+    def replan(self, goals: list[int]) -> vector:
+        """Takes one step along the coldest path, repairing last tick's search."""
+        # A box that moved blocks other cells now, the search has to start over.
+        if self.replanner is None or not self.replanner.is_valid_for(self.view, self.max_step) \
+                or self.replanned_at != self.view.revision:
+            self.replanner = DStarLite(self.view, self.max_step, cost=self.heatmap.get, stats=self.stats,
+                                       neighbors=self.view.open_neighbors)
+            self.replanned_at = self.view.revision
+            self.heatmap.track_changes()
+            self.heatmap.drain_changes()  # A brand new search has nothing to repair.
+
+        start = self.view.index_of(self.position)
+        step = self.replanner.next_step(start, goals, self.heatmap.drain_changes())
+        return self.view.vector_at(start if step is None else step) - self.position
+
     def accept(self, game: 'Game') -> vector:
         """Accepts the current world state, and retrieves the next move."""
 
         # Shoots a flare every FLARE_INTERVAL ticks.
         self.ticks_passed += 1
         if self.ticks_passed % FLARE_INTERVAL == 0:
-            game.shoot_flare(self.choose_flare_positions(), FLARE_INTERVAL)
+            game.shoot_flare(self.choose_flare_positions(game.rng), FLARE_INTERVAL)
+
+        # Pop ALL coldest cells, and calculate the best direction to move to.
+        return self.plan(self.heatmap.extreme(highest=False))
 
-        # Ravel the heatmap into a list.
-        raveled = [cell for row in self.heatmap for cell in row]
+    def plan(self, coldest: list[int]) -> vector:
+        """Works out the next move towards the coldest cells, with the hider's planner."""
+        if self.planner == "dijkstra":
+            start = self.view.index_of(self.position)
+            step = coldest_step(self.view, self.heatmap, start, set(coldest), self.max_step, self.stats)
+            return self.view.vector_at(step) - self.position
+        if self.planner == "incremental":
+            return self.replan(coldest)
 
-        # Pop ALL hottest cells, and calculate the best direction to move to.
-        lowest_temp: int = min(raveled)
-        coldest_cells: set[vector] = set([vector(x, y) for y in range(len(self.heatmap))
-                                          for x in range(len(self.heatmap[y])) if self.heatmap[y][x] == lowest_temp
-                                          and self.view[vector(x, y)] == CellType.EMPTY])
+        coldest_cells: set[vector] = set(map(self.view.vector_at, coldest))
 
         # Now the hider can't really move.
         return self.multi_astar(coldest_cells)
@@ -0,0 +1,319 @@
+from array import array
+from collections import Counter
+from map_state import CellType, MapState
+from typing import Collection
+
+import heapq
+
+# How many cells a cluster is across (and down). Small clusters make the local legs cheap,
+# big ones make the abstract graph small.
+CLUSTER_SIZE = 16
+
+# An entrance this many cells long or longer gets a transition at both ends instead of one in the middle.
+LONG_ENTRANCE = 6
+
+# The cells nobody can stand on.
+_BLOCKED = (CellType.WALL, CellType.BORDER)
+
+# The abstract node every goal leads to, once a search gets into a cluster with goals in it.
+_GOAL = -1
+
+
+class HierarchicalPlanner:
+    """Hierarchical path-finding (HPA*) over the map, for moves of a single step.
+
+       The map is cut into CLUSTER_SIZE x CLUSTER_SIZE clusters. Where two clusters touch, every
+       stretch of cells that can be crossed (an entrance) gets one or two transitions, a pair of
+       cells facing each other across the border. Those cells are the nodes of an abstract graph:
+       transitions link the two clusters, and the nodes of one cluster are linked by how many
+       moves it takes between them without leaving it. A search walks that graph instead of
+       the cells, and only the leg inside the agent's own cluster is worked out cell by cell.
+       Paths are close to the shortest, not always the shortest.
+
+       Everything is worked out lazily, and kept. When a cell becomes walkable or stops being
+       walkable, only the clusters around it are worked out again."""
+
+    view: MapState
+    max_step: int
+    size: int
+    goals: frozenset[int]
+
+    def __init__(self, view: MapState, size: int = CLUSTER_SIZE, stats: Counter[str] | None = None) -> None:
+        self.view = view
+        self.max_step = 1
+        self.size = size
+        self.stats = stats
+        self.columns = -(-view.width // size)
+
+        # The cluster of every cell, -1 on the BORDER frame.
+        self.cluster_of = array("i", [-1]) * len(view.cells)
+        for y in range(view.height):
+            row = view.index(0, y)
+            for x in range(view.width):
+                self.cluster_of[row + x] = (y // size) * self.columns + x // size
+
+        # (lower cluster, higher cluster) -> transitions (a, b), a in the lower one and b in the other.
+        self._entrances: dict[tuple[int, int], list[tuple[int, int]]] = {}
+        # cluster -> its nodes. node -> the nodes of the other clusters it's linked to, in one move.
+        self._nodes: dict[int, list[int]] = {}
+        self._across: dict[int, list[int]] = {}
+        # node -> moves to every other node of its cluster it can get to inside it.
+        self._inside: dict[int, dict[int, int]] = {}
+
+        # The goals of the last search, by cluster, and how far every node of a cluster is from them.
+        self.goals = frozenset()
+        self._goals_in: dict[int, set[int]] = {}
+        self._goal_moves: dict[int, dict[int, int]] = {}
+        self._goal_boxes: dict[int, tuple[int, int, int, int]] = {}
+
+        view.watch(self._cell_changed)
+
+    def is_valid_for(self, view: MapState, max_step: int) -> bool:
+        """Checks if this planner can keep going on the map as it is now. Writes to the
+           map are taken care of as they happen, so this is only about which map it is."""
+        return self.view is view and self.max_step == max_step
+
+    def close(self) -> None:
+        """Stops listening to the map."""
+        self.view.unwatch(self._cell_changed)
+
+    def _count(self, expanded: int, movesets: int = 0) -> None:
+        if self.stats is not None:
+            self.stats["nodes_expanded"] += expanded
+            self.stats["moveset_calls"] += movesets
+
+    def _cell_changed(self, i: int, old: CellType, new: CellType) -> None:
+        """Forgets the clusters a write to cell i could change, if it changed where agents can go."""
+        if (old in _BLOCKED) == (new in _BLOCKED):
+            return  # A box came or went, boxes are walked over like empty cells.
+
+        home = self.cluster_of[i]
+        for cluster in {self.cluster_of[j] for j in self.view.window(i, 1)}:
+            if cluster != home:
+                self._entrances.pop((min(home, cluster), max(home, cluster)), None)
+            self._forget(cluster)
+
+    def _forget(self, cluster: int) -> None:
+        """Drops the nodes of a cluster, and everything worked out about them."""
+        for node in self._nodes.pop(cluster, []):
+            self._across.pop(node, None)
+            self._inside.pop(node, None)
+        self._goal_moves.pop(cluster, None)
+
+    def _flood(self, sources: list[int], clusters: Collection[int], parents: dict[int, int] | None = None,
+               limit: int = 0) -> dict[int, int]:
+        """Breadth-first search from the sources, without leaving the clusters, at most limit moves
+           out (0 for no limit). Returns the moves to every cell it got to, and fills in where each
+           one was reached from, if asked."""
+        view, cluster_of = self.view, self.cluster_of
+        moves = dict.fromkeys(sources, 0)
+        frontier, depth, asked = sorted(sources), 0, 0
+        while frontier and (not limit or depth < limit):
+            depth += 1
+            asked += len(frontier)
+            new = []
+            for i in frontier:
+                for j in view.neighbors(i, 1):
+                    if j not in moves and cluster_of[j] in clusters:
+                        moves[j] = depth
+                        new.append(j)
+                        if parents is not None:
+                            parents[j] = i
+            frontier = new
+        self._count(len(moves), asked)
+        return moves
+
+    def _neighbor_clusters(self, cluster: int) -> list[int]:
+        """The (up to 8) clusters around a cluster."""
+        cx, cy = cluster % self.columns, cluster // self.columns
+        rows = -(-self.view.height // self.size)
+        return [ny * self.columns + nx for ny in range(max(cy - 1, 0), min(cy + 2, rows))
+                for nx in range(max(cx - 1, 0), min(cx + 2, self.columns)) if (nx, ny) != (cx, cy)]
+
+    def _edge(self, cluster: int) -> list[int]:
+        """The cells of a cluster on its outline, in cell index order."""
+        view, size = self.view, self.size
+        left, top = (cluster % self.columns) * size, (cluster // self.columns) * size
+        right, bottom = min(left + size, view.width) - 1, min(top + size, view.height) - 1
+        cells: set[int] = set()
+        for x in range(left, right + 1):
+            cells.update((view.index(x, top), view.index(x, bottom)))
+        for y in range(top, bottom + 1):
+            cells.update((view.index(left, y), view.index(right, y)))
+        return sorted(cells)
+
+    def entrances(self, low: int, high: int) -> list[tuple[int, int]]:
+        """The transitions between two clusters, low being the lower numbered one."""
+        transitions = self._entrances.get((low, high))
+        if transitions is not None:
+            return transitions
+
+        view, cluster_of = self.view, self.cluster_of
+        crossings = [(a, b) for a in self._edge(low) if view.walkable[a]
+                     for b in view.neighbors(a, 1) if cluster_of[b] == high]
+
+        def touching(i: int, j: int) -> bool:
+            (ix, iy), (jx, jy) = view.coords(i), view.coords(j)
+            return abs(ix - jx) <= 1 and abs(iy - jy) <= 1
+
+        # One entrance is a run of crossings whose cells touch on both sides, so any crossing
+        # of it can be swapped for another one by moving along the border.
+        run: list[tuple[int, int]] = []
+        transitions = []
+        for a, b in crossings:
+            if run and not (touching(run[-1][0], a) and touching(run[-1][1], b)):
+                transitions.extend([run[0], run[-1]] if len(run) >= LONG_ENTRANCE else [run[len(run) // 2]])
+                run = []
+            run.append((a, b))
+        if run:
+            transitions.extend([run[0], run[-1]] if len(run) >= LONG_ENTRANCE else [run[len(run) // 2]])
+
+        self._entrances[(low, high)] = transitions
+        return transitions
+
+    def nodes(self, cluster: int) -> list[int]:
+        """The nodes of a cluster, the cells of its transitions on its side of the border."""
+        nodes = self._nodes.get(cluster)
+        if nodes is not None:
+            return nodes
+
+        across: dict[int, list[int]] = {}
+        for other in self._neighbor_clusters(cluster):
+            for a, b in self.entrances(min(cluster, other), max(cluster, other)):
+                mine, theirs = (a, b) if cluster < other else (b, a)
+                across.setdefault(mine, []).append(theirs)
+        nodes = self._nodes[cluster] = sorted(across)
+        for node in nodes:
+            self._across[node] = sorted(across[node])
+        return nodes
+
+    def inside(self, node: int) -> dict[int, int]:
+        """The moves from a node to the other nodes of its cluster, without leaving it."""
+        moves = self._inside.get(node)
+        if moves is None:
+            cluster = self.cluster_of[node]
+            reached = self._flood([node], (cluster,))
+            moves = self._inside[node] = {other: reached[other] for other in self.nodes(cluster)
+                                          if other != node and other in reached}
+        return moves
+
+    def goal_moves(self, cluster: int) -> dict[int, int]:
+        """The moves from every node of a cluster to the nearest goal in it, without leaving it."""
+        moves = self._goal_moves.get(cluster)
+        if moves is None:
+            reached = self._flood([goal for goal in self._goals_in[cluster] if self.view.walkable[goal]], (cluster,))
+            moves = self._goal_moves[cluster] = {node: reached[node] for node in self.nodes(cluster)
+                                                 if node in reached}
+        return moves
+
+    def goal_box(self, cluster: int) -> tuple[int, int, int, int]:
+        """The box (min x, min y, max x, max y) around the goals in a cluster."""
+        box = self._goal_boxes.get(cluster)
+        if box is None:
+            coords = [self.view.coords(goal) for goal in self._goals_in[cluster]]
+            box = self._goal_boxes[cluster] = (min(x for x, _ in coords), min(y for _, y in coords),
+                                               max(x for x, _ in coords), max(y for _, y in coords))
+        return box
+
+    def next_step(self, start: int, goals: frozenset[int]) -> int | None:
+        """Returns the cell to move to from start, to get to the nearest of the goals.
+           Returns start itself if it's a goal, None if no goal can be reached."""
+        if start in goals:
+            return start
+        self._set_goals(goals)
+
+        # A path of at most size moves can't leave the clusters around start, so goals that
+        # close are searched for cell by cell, and the nearest one is found exactly.
+        home = self.cluster_of[start]
+        parents: dict[int, int] = {}
+        reached = self._flood([start], {home, *self._neighbor_clusters(home)}, parents, self.size)
+        near = [(moves, cell) for cell, moves in reached.items() if cell in goals]
+        if near:
+            return self._first_move(start, min(near)[1], parents)
+        if not self._goals_in:
+            return None
+
+        # Taxicab distance to the box around all goals, like the seeker's multi_astar.
+        boxes = [self.goal_box(cluster) for cluster in self._goals_in]
+        min_x, min_y = min(box[0] for box in boxes), min(box[1] for box in boxes)
+        max_x, max_y = max(box[2] for box in boxes), max(box[3] for box in boxes)
+
+        def bound(i: int) -> int:
+            if i == _GOAL:
+                return 0
+            x, y = self.view.coords(i)
+            return max(min_x - x, x - max_x, 0) + max(min_y - y, y - max_y, 0)
+
+        # Otherwise the leg inside the agent's own cluster is searched cell by cell, the rest node
+        # by node. first[node] is the cell the path to node starts out towards: a node or goal of
+        # the home cluster, or a node across the border from start.
+        parents = {}
+        reached = self._flood([start], (home,), parents)
+        g_score: dict[int, int] = {}
+        first: dict[int, int] = {}
+        open_set: list[tuple[int, int, int]] = []
+
+        def push(g: int, node: int, towards: int) -> None:
+            if g < g_score.get(node, g + 1):
+                g_score[node], first[node] = g, towards
+                heapq.heappush(open_set, (g + bound(node), g, node))
+
+        for node in self.nodes(home):
+            if node != start and node in reached:
+                push(reached[node], node, node)
+        for node in self._across.get(start, []):
+            push(1, node, node)
+        near = [(reached[goal], goal) for goal in self._goals_in.get(home, []) if goal in reached]
+        if near:
+            moves, goal = min(near)
+            push(moves, _GOAL, goal)
+
+        done: set[int] = set()
+        expanded = 0
+        while open_set:
+            _, g, node = heapq.heappop(open_set)
+            if node in done or g != g_score[node]:
+                continue  # An older, worse entry of a node we already got to cheaper.
+            expanded += 1
+            done.add(node)
+            if node == _GOAL:
+                break
+
+            towards = first[node]
+            for other, moves in self.inside(node).items():
+                push(g + moves, other, towards)
+            for other in self._across[node]:
+                push(g + 1, other, towards)
+            cluster = self.cluster_of[node]
+            if cluster in self._goals_in and node in self.goal_moves(cluster):
+                push(g + self.goal_moves(cluster)[node], _GOAL, towards)
+        self._count(expanded)
+        if _GOAL not in done:
+            return None
+
+        return self._first_move(start, first[_GOAL], parents)
+
+    def _set_goals(self, goals: frozenset[int]) -> None:
+        """Sorts the goals into their clusters. Only the goals that came or went since the last
+           search are looked at, and only the clusters they're in have to be searched again."""
+        for goal in goals ^ self.goals:
+            cluster = self.cluster_of[goal]
+            if cluster < 0:
+                continue
+            self._goal_moves.pop(cluster, None)
+            self._goal_boxes.pop(cluster, None)
+            if goal in goals:
+                self._goals_in.setdefault(cluster, set()).add(goal)
+            elif goal in self._goals_in.get(cluster, ()):
+                self._goals_in[cluster].discard(goal)
+                if not self._goals_in[cluster]:
+                    del self._goals_in[cluster]
+        self.goals = goals
+
+    def _first_move(self, start: int, to: int, parents: dict[int, int]) -> int:
+        """The first move on the way from start to a cell, from a search out of start."""
+        if to not in parents:
+            return to  # Straight across the border.
+        while parents[to] != start:
+            to = parents[to]
+        return to
@@ -0,0 +1,149 @@
+from collections import Counter
+from map_state import MapState
+from typing import Callable, Iterable
+
+import heapq
+
+INF = float("inf")
+
+
+class DStarLite:
+    """An incremental planner (D* Lite) that keeps its search between ticks.
+
+       It searches backwards, from the goals to the agent, so g[i] is the cost of getting
+       from cell i to the nearest goal. When the agent moves, goals come and go, or cells
+       get more expensive to enter, only the cells whose cost to a goal changed are
+       searched again, instead of starting from scratch every tick.
+
+       cost(j) is the cost of entering cell j (1 if not given), it must not be negative.
+       bound(a, b) must never overestimate the cost of getting from a to b (0 if not given).
+       neighbors(i, max_step) are the cells a move from i can end on (view.neighbors if not given).
+       They're also taken as the cells that can move onto i, so leaving out cells nobody ever
+       stands on, like MapState.open_neighbors does, is the only way it may be one-sided."""
+
+    view: MapState
+    max_step: int
+    revision: int
+    goals: frozenset[int]
+
+    def __init__(self, view: MapState, max_step: int, cost: Callable[[int], int] | None = None,
+                 bound: Callable[[int, int], int] | None = None, stats: Counter[str] | None = None,
+                 neighbors: Callable[[int, int], tuple[int, ...]] | None = None) -> None:
+        self.view = view
+        self.stats = stats
+        self.max_step = max_step
+        self.revision = view.walk_revision
+        self.cost = cost or (lambda _: 1)
+        self.bound = bound or (lambda a, b: 0)
+        self.neighbors = neighbors or view.neighbors
+
+        self.goals = frozenset()
+        self.g = [INF] * len(view.cells)
+        self.rhs = [INF] * len(view.cells)
+        self.start: int | None = None
+        self.last: int | None = None
+        self.km = 0
+
+        # Heap of (key, cell), cells may be in there more than once. Only the entry that
+        # matches queued[cell] is real, the others are skipped when popped.
+        self.open: list[tuple[tuple[float, float], int]] = []
+        self.queued: dict[int, tuple[float, float]] = {}
+
+    def is_valid_for(self, view: MapState, max_step: int) -> bool:
+        """Checks if this planner can keep going on the map as it is now."""
+        return self.view is view and self.revision == view.walk_revision and self.max_step == max_step
+
+    def around(self, i: int) -> tuple[int, ...]:
+        """neighbors(i), counted as a moveset call."""
+        if self.stats is not None:
+            self.stats["moveset_calls"] += 1
+        return self.neighbors(i, self.max_step)
+
+    def key(self, i: int) -> tuple[float, float]:
+        """The priority of cell i in the open list."""
+        best = min(self.g[i], self.rhs[i])
+        return best + self.bound(self.start, i) + self.km, best  # type: ignore[arg-type]
+
+    def update_vertex(self, i: int) -> None:
+        """Recomputes the one-step lookahead cost of cell i, and (un)queues it."""
+        if i not in self.goals:
+            self.rhs[i] = min((self.cost(j) + self.g[j] for j in self.around(i)),
+                              default=INF)
+
+        if self.g[i] != self.rhs[i]:
+            key = self.queued[i] = self.key(i)
+            heapq.heappush(self.open, (key, i))
+        else:
+            self.queued.pop(i, None)
+
+    def top_key(self) -> tuple[float, float]:
+        """The key of the best queued cell, dropping stale entries on the way."""
+        while self.open:
+            key, i = self.open[0]
+            if self.queued.get(i) == key:
+                return key
+            heapq.heappop(self.open)
+        return INF, INF
+
+    def compute(self) -> None:
+        """Searches until the cost from the agent's cell to the nearest goal is settled."""
+        start = self.start
+        assert start is not None
+        while self.top_key() < self.key(start) or self.rhs[start] != self.g[start]:
+            if not self.open:
+                break
+
+            old_key, i = heapq.heappop(self.open)
+            del self.queued[i]
+            if self.stats is not None:
+                self.stats["nodes_expanded"] += 1
+
+            new_key = self.key(i)
+            if old_key < new_key:
+                # Keys got stale since the agent moved, queue it again with the right one.
+                self.queued[i] = new_key
+                heapq.heappush(self.open, (new_key, i))
+            elif self.g[i] > self.rhs[i]:
+                self.g[i] = self.rhs[i]
+                for j in self.around(i):
+                    self.update_vertex(j)
+            else:
+                self.g[i] = INF
+                self.update_vertex(i)
+                for j in self.around(i):
+                    self.update_vertex(j)
+
+    def next_step(self, start: int, goals: Iterable[int], changed: Iterable[int] = ()) -> int | None:
+        """Returns the cell to move to from start, on the cheapest path to any of the goals.
+           changed are the cells whose cost went up or down since the last call.
+           Returns start itself if it's a goal, None if no goal can be reached."""
+        if self.start is None:
+            self.start = self.last = start
+        elif start != self.start:
+            # The agent moved, the keys already queued are now off by at most this much.
+            self.km += self.bound(self.last, start)  # type: ignore[arg-type]
+            self.start = self.last = start
+
+        goals = frozenset(goals)
+        moved_goals = goals ^ self.goals
+        self.goals = goals
+        for i in sorted(moved_goals):
+            if i in goals:
+                self.rhs[i] = 0
+            self.update_vertex(i)
+
+        # Entering a changed cell costs something else now, so every cell next to it
+        # has to look at its neighbors again.
+        for i in changed:
+            if not self.view.walkable[i]:
+                continue  # Nobody walks in there anyway.
+            for j in self.around(i):
+                self.update_vertex(j)
+
+        self.compute()
+
+        if self.g[start] == INF:
+            return None
+        if start in goals:
+            return start
+        return min((self.cost(j) + self.g[j], j) for j in self.around(start))[1]
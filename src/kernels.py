@@ -0,0 +1,256 @@
+"""The inner loops of the engine, on the flat padded grid of MapState and plain cell indices.
+
+They come from the compiled _hskernels module when it has been built (see the README), and
+from the plain Python versions below when it hasn't. Both give exactly the same results,
+`python kernels.py` checks that on a bunch of random maps."""
+from array import array
+from typing import Callable, MutableSequence, Sequence
+
+import itertools
+import time
+
+# The temperatures a 16 bit heatmap can hold. It sticks at these instead of wrapping around.
+HEAT16_MIN, HEAT16_MAX = -2 ** 15, 2 ** 15 - 1
+
+
+def moveset(walkable: bytearray, offsets: Sequence[int], i: int, max_step: int) -> list[int]:
+    """The cells that max_step single steps (offsets) over walkable cells can end up on,
+       starting from cell i, in cell index order. See MapState.moveset."""
+    current = [i]
+    for _ in range(max_step):
+        new = set()
+        for at in current:
+            for offset in offsets:
+                # Every cell we step from is inside the map, so the neighbor
+                # is at worst in the BORDER frame, never out of the grid.
+                if walkable[at + offset]:
+                    new.add(at + offset)
+        current = sorted(new)
+    return current
+
+
+def line_of_sight(opaque: bytearray, width: int, height: int, x0: int, y0: int, x1: int, y1: int) -> bool:
+    """Walks a ray from (x0, y0) to (x1, y1), checks if nothing opaque is in the way.
+       The cell at the end may be opaque itself, a wall can be seen."""
+    # If on the same tile, obviously the agent can see the position.
+    if x0 == x1 and y0 == y1:
+        return True
+
+    # The number of steps to check (no reason to choose this algo).
+    dx, dy = x1 - x0, y1 - y0
+    steps = max(abs(dx), abs(dy))
+    # The direction to move in. Same float math as vectorf, without making one per step.
+    step_x, step_y = float(dx) / steps, float(dy) / steps
+    cur_x, cur_y = float(x0), float(y0)  # The starting position.
+
+    stride = width + 2
+    for i in range(steps):
+        cur_x += step_x
+        cur_y += step_y
+        x, y = round(cur_x), round(cur_y)
+        if not (0 <= x < width and 0 <= y < height):
+            return True  # Out of bounds cell, we hit the edge.
+        if opaque[(y + 1) * stride + x + 1] and i != steps - 1:
+            return False  # If we hit a wall (or a box), we can't see the position.
+    return True  # We can see the position.
+
+
+def visibility(opaque: bytearray, width: int, height: int, x: int, y: int, radius: int) -> int:
+    """Which cells of the (2 * radius + 1)^2 window around (x, y) can be seen from it, as a
+       bitset, row by row. See MapState.visibility."""
+    visible, bit = 0, 0
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            if line_of_sight(opaque, width, height, x, y, x + dx, y + dy):
+                visible |= 1 << bit
+            bit += 1
+    return visible
+
+
+def _before(a: tuple[int, int, int, int], b: tuple[int, int, int, int]) -> bool:
+    """How the seeker's heap always ordered (f, vector) entries: by f, then by vector.__lt__,
+       which only puts a first if both its x and y are smaller."""
+    return a[0] < b[0] or (a[0] == b[0] and a[1] < b[1] and a[2] < b[2])
+
+
+def _sift_down(heap: list, start: int, pos: int) -> None:
+    """heapq._siftdown, with _before for <."""
+    item = heap[pos]
+    while pos > start:
+        parent = (pos - 1) >> 1
+        if not _before(item, heap[parent]):
+            break
+        heap[pos] = heap[parent]
+        pos = parent
+    heap[pos] = item
+
+
+def _pop(heap: list) -> tuple[int, int, int, int]:
+    """heapq.heappop, with _before for <. The compiled kernel has to pop in the very same
+       order, so this spells out what heapq does instead of leaving it to heapq."""
+    last = heap.pop()
+    if not heap:
+        return last
+    top, heap[0] = heap[0], last
+    end, pos, child = len(heap), 0, 1
+    while child < end:
+        if child + 1 < end and not _before(heap[child], heap[child + 1]):
+            child += 1
+        heap[pos] = heap[child]
+        pos, child = child, 2 * child + 1
+    heap[pos] = last
+    _sift_down(heap, 0, pos)
+    return top
+
+
+def multi_astar(neighbors: Callable[[int, int], Sequence[int]], max_step: int, stride: int,
+                start: int, goals: Sequence[int], budget: int = 0,
+                deadline: float = 0.0) -> tuple[int, int, bool]:
+    """A* from start to the nearest of the goals, every move costing 1, guided by the taxicab
+       distance to the closest goal. neighbors(i, max_step) are the cells one move away from i.
+       Returns the first cell on the path (start itself if it's a goal, -1 if no goal can be
+       reached), how many cells were expanded, and whether a goal was found.
+       With a budget (cells to expand) or a deadline (a time.perf_counter() time), the search
+       stops there if it hasn't found a goal yet, and heads for the cell closest to a goal by
+       the heuristic instead, out of all it has come across. 0 is no limit."""
+    goal_set = set(goals)
+    coords = [(goal % stride, goal // stride) for goal in goal_set]
+
+    def heuristic(i: int) -> int:
+        x, y = i % stride, i // stride
+        return min(abs(x - gx) + abs(y - gy) for gx, gy in coords)
+
+    open_set = [(0, start % stride, start // stride, start)]
+    parents: dict[int, int] = {}
+    g_score = {start: 0}
+    expanded = 0
+    best, best_h = start, heuristic(start)  # Where to head for if it runs out of budget or time.
+
+    while open_set:
+        if (budget and expanded >= budget) or \
+                (deadline and expanded & 63 == 0 and time.perf_counter() >= deadline):
+            while best != start and parents[best] != start:
+                best = parents[best]
+            return best, expanded, False
+
+        cur = _pop(open_set)[3]
+        expanded += 1
+
+        # Found a goal, walk the path back to its first step.
+        if cur in goal_set:
+            while cur != start and parents[cur] != start:
+                cur = parents[cur]
+            return cur, expanded, True
+
+        tent = g_score[cur] + 1
+        for neighbor in neighbors(cur, max_step):
+            if tent >= g_score.get(neighbor, tent + 1):
+                continue
+            g_score[neighbor] = tent
+            parents[neighbor] = cur
+            h = heuristic(neighbor)
+            if h < best_h:
+                best, best_h = neighbor, h
+            open_set.append((tent + h, neighbor % stride, neighbor // stride, neighbor))
+            _sift_down(open_set, 0, len(open_set) - 1)
+
+    return -1, expanded, False
+
+
+def heat_add(heat: MutableSequence[int], cells: Sequence[int], amount: int) -> None:
+    """Adds amount to the temperature of every cell. See Heatmap.add."""
+    for i in cells:
+        heat[i] += amount
+
+
+def heat_fill(heat: MutableSequence[int], cells: Sequence[int], value: int) -> None:
+    """Sets the temperature of every cell to value. See Heatmap.fill."""
+    for i in cells:
+        heat[i] = value
+
+
+def heat_add16(heat: array, cells: Sequence[int], amount: int) -> None:
+    """heat_add for an array('h'), sticking at HEAT16_MIN and HEAT16_MAX."""
+    left = iter(cells)
+    try:
+        for i in left:
+            heat[i] += amount
+    except OverflowError:
+        # Only the cell that ran over and the ones after it still need adding.
+        for i in itertools.chain((i,), left):
+            heat[i] = max(HEAT16_MIN, min(HEAT16_MAX, heat[i] + amount))
+
+
+# The plain Python kernels, whichever ones end up in use.
+python_kernels = {name: globals()[name] for name in
+                  ["moveset", "line_of_sight", "visibility", "multi_astar", "heat_add", "heat_fill", "heat_add16"]}
+
+try:
+    from _hskernels import (moveset, line_of_sight, visibility, multi_astar,  # type: ignore[import-not-found, no-redef]
+                            heat_add, heat_fill, heat_add16)
+    COMPILED = True
+except ImportError:  # Not built, the Python versions above it are.
+    COMPILED = False
+
+
+def check_parity(maps: int = 30, seed: int = 0) -> None:
+    """Runs every compiled kernel and its Python version on random maps, and raises
+       AssertionError on the first result that doesn't match."""
+    import random
+
+    from map_state import MapState
+    rng = random.Random(seed)
+    py = python_kernels
+    for _ in range(maps):
+        width, height = rng.randint(1, 30), rng.randint(1, 30)
+        density = rng.random() * 0.5
+        grid = bytes(rng.choice([1, 2]) if rng.random() < density else 0 for _ in range(width * height))
+        state = MapState.from_grid(grid, width, height)
+        walkable = [i for i in range(len(state.cells)) if state.walkable[i]]
+        if not walkable:
+            continue
+
+        for i in rng.sample(walkable, min(len(walkable), 40)):
+            x, y = state.coords(i)
+            for max_step in (1, 2, 3):
+                assert moveset(state.walkable, state.neighbor_offsets, i, max_step) == \
+                    py["moveset"](state.walkable, state.neighbor_offsets, i, max_step), (grid, width, i, max_step)
+            for radius in (0, 1, 3, 5):
+                assert visibility(state.opaque, width, height, x, y, radius) == \
+                    py["visibility"](state.opaque, width, height, x, y, radius), (grid, width, i, radius)
+            x1, y1 = rng.randint(-3, width + 2), rng.randint(-3, height + 2)
+            assert line_of_sight(state.opaque, width, height, x, y, x1, y1) == \
+                py["line_of_sight"](state.opaque, width, height, x, y, x1, y1), (grid, width, i, x1, y1)
+            for max_step in (1, 2):
+                goals = rng.sample(walkable, rng.randint(1, min(len(walkable), 6)))
+                for budget in (0, 1, 5, 40):
+                    assert multi_astar(state.neighbors, max_step, state.stride, i, goals, budget) == \
+                        py["multi_astar"](state.neighbors, max_step, state.stride, i, goals, budget), \
+                        (grid, width, i, goals, budget)
+
+        cells = array("i", rng.sample(walkable, min(len(walkable), 50)))
+        for amount in (-1, 2, 10):
+            mine = [rng.randint(-50, 50) for _ in state.cells]
+            theirs = mine[:]
+            heat_add(mine, cells, amount)
+            py["heat_add"](theirs, cells, amount)
+            assert mine == theirs
+            heat_fill(mine, list(cells), amount)
+            py["heat_fill"](theirs, list(cells), amount)
+            assert mine == theirs
+            short = array("h", mine)
+            heat_fill(short, cells, amount)
+            assert list(short) == theirs
+            short = array("h", (rng.choice([HEAT16_MIN + 5, 0, HEAT16_MAX - 5]) for _ in state.cells))
+            other = array("h", short)
+            heat_add16(short, cells, amount * 4)
+            py["heat_add16"](other, cells, amount * 4)
+            assert short == other
+
+
+if __name__ == "__main__":
+    if not COMPILED:
+        print("_hskernels isn't built, the Python kernels are in use. Nothing to compare.")
+    else:
+        check_parity()
+        print("The compiled kernels match the Python ones.")
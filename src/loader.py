@@ -0,0 +1,288 @@
+from array import array
+from dataclasses import dataclass, field
+from map_state import CellType, MapState
+from vector2d import vector
+
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+
+class MapFormatError(ValueError):
+    """Raised when a map file can't be read, tells where and why."""
+
+
+# Map file character -> cell byte. Hiders and the seeker stand on empty cells.
+# Boxes are B in map files, but the board prints them as ☐, so both are fine.
+TEXT_CELLS = str.maketrans({".": "\0", "H": "\0", "S": "\0", "X": "\1", "B": "\2", "☐": "\2"})
+
+
+@dataclass
+class MapSpec:
+    """Everything a map file says, before any agents are made.
+       Maps in the numeric format have no agents, so those fields are left empty."""
+
+    width: int
+    height: int
+    grid: bytes                  # Raw cell bytes, row by row, see MapState.from_grid.
+    time_limit: int = 0
+    seeker_vision: int = 0
+    seeker_step: int = 0
+    hider_vision: int = 0
+    hider_step: int = 0
+    seeker: vector | None = None
+    hiders: list[vector] = field(default_factory=list)
+
+
+def _find_all(line: str, char: str) -> list[int]:
+    """Returns every x at which char shows up in line."""
+    found = []
+    x = line.find(char)
+    while x != -1:
+        found.append(x)
+        x = line.find(char, x + 1)
+    return found
+
+
+def _parse_ints(line: str, count: int, what: str, where: str) -> list[int]:
+    """Parses a header line of exactly count integers."""
+    try:
+        values = [int(value) for value in line.split()]
+    except ValueError:
+        values = []
+    if len(values) != count:
+        raise MapFormatError(f"{where}: expected {what}, got {line.strip()!r}.")
+    return values
+
+
+def _parse_game(lines: list[str], file_path: str) -> MapSpec:
+    """Parses the map format from the README: time limit, seeker and hider stats, then the map."""
+    if len(lines) < 4:
+        raise MapFormatError(f"{file_path}: expected 3 header lines and a map.")
+    time_limit, = _parse_ints(lines[0], 1, "a time limit", f"{file_path}:1")
+    seeker_vision, seeker_step = _parse_ints(lines[1], 2, "the seeker's vision and step", f"{file_path}:2")
+    hider_vision, hider_step = _parse_ints(lines[2], 2, "the hider's vision and step", f"{file_path}:3")
+
+    rows = [line.strip() for line in lines[3:]]
+    while rows and not rows[-1]:
+        rows.pop()  # Trailing blank lines.
+    if not rows or len(set(map(len, rows))) != 1:
+        raise MapFormatError(f"{file_path}: all map lines must have the same length.")
+
+    width = len(rows[0])
+    grid = bytearray()
+    seeker: vector | None = None
+    hiders: list[vector] = []
+    for y, row in enumerate(rows):
+        raw = row.translate(TEXT_CELLS).encode("latin-1", "replace")
+        if raw.translate(None, b"\0\1\2"):
+            x = next(x for x, cell in enumerate(row) if cell.translate(TEXT_CELLS) == cell)
+            raise MapFormatError(f"{file_path}:{y + 4}: invalid character {row[x]!r} at ({x},{y}).")
+        grid += raw
+
+        hiders.extend(vector(x, y) for x in _find_all(row, "H"))
+        for x in _find_all(row, "S"):
+            if seeker is not None:
+                raise MapFormatError(f"{file_path}:{y + 4}: multiple seekers, the second at ({x},{y}).")
+            seeker = vector(x, y)
+
+    if seeker is None:
+        raise MapFormatError(f"{file_path}: seeker not found.")
+    return MapSpec(width, len(rows), bytes(grid), time_limit, seeker_vision, seeker_step,
+                   hider_vision, hider_step, seeker, hiders)
+
+
+def _parse_numeric(lines: list[str], file_path: str) -> MapSpec:
+    """Parses the numeric format: the width and height, then one CellType value per cell."""
+    width, height = _parse_ints(lines[0], 2, "the width and height", f"{file_path}:1")
+    if width <= 0 or height <= 0 or len(lines) < height + 1:
+        raise MapFormatError(f"{file_path}: expected {height} rows of {width} cells.")
+
+    grid = bytearray()
+    for y, line in enumerate(lines[1:height + 1]):
+        try:
+            row = bytes(int(value) for value in line.split())
+        except ValueError:
+            row = b""
+        if len(row) != width or max(row) >= len(CellType):
+            raise MapFormatError(f"{file_path}:{y + 2}: expected {width} cell values from 0 to {len(CellType) - 1}.")
+        grid += row
+    return MapSpec(width, height, bytes(grid))
+
+
+def parse_map(text: str, file_path: str = "<map>") -> MapSpec:
+    """Parses a map in either format. A first line with one number is a game map,
+       a first line with two is a numeric map (width and height)."""
+    lines = text.splitlines()
+    if not lines:
+        raise MapFormatError(f"{file_path}: the file is empty.")
+    if len(lines[0].split()) == 2:
+        return _parse_numeric(lines, file_path)
+    return _parse_game(lines, file_path)
+
+
+def read_map(file_path: str) -> MapSpec:
+    """Reads and parses a map file. Missing files raise the usual OSError."""
+    with open(file_path, "r", encoding="utf-8") as file:
+        return parse_map(file.read(), file_path)
+
+
+# The binary cache. All numbers are little endian. The header is followed by the hider
+# positions (x, y int32 pairs), the raw grid, then every precomputed moveset and visibility table.
+CACHE_MAGIC = b"HSMC"
+CACHE_VERSION = 2
+_HEADER = struct.Struct("<4sHxxqqiiqiiiiiiiii")
+_TABLE = struct.Struct("<ii")
+
+
+def _little_endian(values: array) -> array:
+    """Swaps an int array to little endian on big endian machines (both ways)."""
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def cache_path(file_path: str, cache_dir: str) -> str:
+    """Where the cache of a map file lives in cache_dir."""
+    digest = hashlib.sha1(os.path.abspath(file_path).encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, f"{os.path.basename(file_path)}.{digest}.cache")
+
+
+def write_cache(path: str, spec: MapSpec, state: MapState, source: os.stat_result,
+                steps: list[int], radii: list[int]) -> None:
+    """Writes the parsed map, and its movesets and visibility for the given steps and radii.
+       source is the stat of the map file, a cache only counts for the exact same file."""
+    seeker = spec.seeker if spec.seeker is not None else vector(-1, -1)
+    parts = [_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, source.st_mtime_ns, source.st_size,
+                          spec.width, spec.height, spec.time_limit, spec.seeker_vision, spec.seeker_step,
+                          spec.hider_vision, spec.hider_step, seeker.x, seeker.y,
+                          len(spec.hiders), len(steps), len(radii)),
+             _little_endian(array("i", [v for pos in spec.hiders for v in (pos.x, pos.y)])).tobytes(),
+             spec.grid]
+
+    for max_step in steps:
+        offsets, targets = state.export_neighbors(max_step)
+        parts += [_TABLE.pack(max_step, len(targets)),
+                  _little_endian(offsets).tobytes(), _little_endian(targets).tobytes()]
+
+    for radius in radii:
+        size = ((2 * radius + 1) ** 2 + 7) // 8
+        parts += [_TABLE.pack(radius, size),
+                  b"".join(bits.to_bytes(size, "little") for bits in state.export_visibility(radius))]
+
+    # Write next to it and swap it in, so parallel workers never read half a cache.
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "wb") as file:
+        file.write(b"".join(parts))
+    os.replace(temp, path)
+
+
+def read_cache(path: str, source: os.stat_result | None = None,
+               use_mmap: bool = True) -> tuple[MapSpec, MapState] | None:
+    """Reads a cache written by write_cache. Returns None if there is no usable cache:
+       missing, from another version, or (if source is given) from a different map file."""
+    try:
+        with open(path, "rb") as file:
+            if use_mmap:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return _decode_cache(memoryview(data), source)
+            return _decode_cache(memoryview(file.read()), source)
+    except OSError:
+        return None
+
+
+def _decode_cache(data: memoryview, source: os.stat_result | None) -> tuple[MapSpec, MapState] | None:
+    """Unpacks a cache, see write_cache for the layout. Every array is copied out of data,
+       so an mmap behind it can be closed right after."""
+    try:
+        (magic, version, mtime, size, width, height, time_limit, seeker_vision, seeker_step,
+         hider_vision, hider_step, seeker_x, seeker_y, hider_count, step_count, radius_count) = \
+            _HEADER.unpack_from(data)
+        if magic != CACHE_MAGIC or version != CACHE_VERSION:
+            return None
+        if source is not None and (mtime, size) != (source.st_mtime_ns, source.st_size):
+            return None
+
+        def ints(at: int, count: int) -> tuple[array, int]:
+            values = array("i")
+            values.frombytes(data[at:at + 4 * count])
+            if len(values) != count:
+                raise ValueError("Truncated cache")
+            return _little_endian(values), at + 4 * count
+
+        at = _HEADER.size
+        coords, at = ints(at, 2 * hider_count)
+        hiders = [vector(coords[k], coords[k + 1]) for k in range(0, len(coords), 2)]
+        grid = bytes(data[at:at + width * height])
+        at += width * height
+
+        spec = MapSpec(width, height, grid, time_limit, seeker_vision, seeker_step, hider_vision, hider_step,
+                       vector(seeker_x, seeker_y) if seeker_x >= 0 else None, hiders)
+        state = MapState.from_grid(grid, width, height)
+
+        for _ in range(step_count):
+            max_step, total = _TABLE.unpack_from(data, at)
+            offsets, at = ints(at + _TABLE.size, len(state.cells) + 1)
+            targets, at = ints(at, total)
+            state.import_neighbors(max_step, offsets, targets)
+
+        for _ in range(radius_count):
+            radius, size = _TABLE.unpack_from(data, at)
+            at += _TABLE.size
+            table = bytes(data[at:at + size * len(state.cells)])
+            if len(table) != size * len(state.cells):
+                raise ValueError("Truncated cache")
+            state.import_visibility(radius, table, size)
+            at += len(table)
+        return spec, state
+    except (ValueError, struct.error):
+        return None  # Truncated or garbled, parse the map again.
+
+
+def load_map(file_path: str, cache_dir: str | None = None,
+             use_mmap: bool = True) -> tuple[MapSpec, MapState]:
+    """Reads a map file in either format, and builds its MapState.
+       With cache_dir, the parsed map and the movesets and visibility of both agents are
+       kept there in a binary cache, and later loads of the same file read that instead."""
+    if cache_dir is None:
+        spec = read_map(file_path)
+        return spec, MapState.from_grid(spec.grid, spec.width, spec.height)
+
+    source = os.stat(file_path)
+    path = cache_path(file_path, cache_dir)
+    cached = read_cache(path, source, use_mmap)
+    if cached is not None:
+        return cached
+
+    spec = read_map(file_path)
+    state = MapState.from_grid(spec.grid, spec.width, spec.height)
+    if spec.seeker is not None:
+        write_cache(path, spec, state, source, sorted({spec.seeker_step, spec.hider_step}),
+                    sorted({spec.seeker_vision, spec.hider_vision}))
+    else:
+        write_cache(path, spec, state, source, [], [])
+    return spec, state
+
+
+# (absolute path, cache_dir) -> (size and mtime of the file, its spec, its MapState), see shared_map.
+_shared: dict[tuple[str, str | None], tuple[tuple[int, int], MapSpec, MapState]] = {}
+
+
+def shared_map(file_path: str, cache_dir: str | None = None) -> tuple[MapSpec, MapState]:
+    """Same as load_map, but a map is only loaded once per process. Every caller gets a
+       copy-on-write MapState.copy() of the same map, so the masks, movesets and visibility
+       worked out for one game are there for every other game on that map, and are only
+       duplicated once a game changes its map (pushes a box). The spec is shared as is,
+       don't change it. A map is loaded again once its file changes."""
+    source = os.stat(file_path)
+    key = (os.path.abspath(file_path), cache_dir)
+    stamp = (source.st_mtime_ns, source.st_size)
+    entry = _shared.get(key)
+    if entry is None or entry[0] != stamp:
+        entry = _shared[key] = (stamp, *load_map(file_path, cache_dir))
+    _, spec, state = entry
+    return spec, state.copy()
@@ -1,9 +1,20 @@
 from hide_and_seek import game_from_file
+from loader import MapFormatError
+
+import logging
+import sys
 
 
 def playout(game_map_path: str) -> None:
     """Playout a game from a given map."""
-    game = game_from_file(game_map_path)
+    try:
+        game = game_from_file(game_map_path)
+    except MapFormatError as error:
+        print(f"Invalid map: {error}")
+        return
+    except OSError:
+        print(f"File {game_map_path} not found.")
+        return
 
     while True:
         try:
@@ -23,6 +34,8 @@ def playout(game_map_path: str) -> None:
 
 
 def main() -> None:
+    # The engine logs everything it does, but only an interactive game wants to read all of it.
+    logging.basicConfig(level=logging.DEBUG, format="%(message)s", stream=sys.stdout)
     while True:
         print("  Hide and Seek")
         map_path = input("Play map: ")
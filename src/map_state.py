@@ -1,8 +1,12 @@
+from array import array
 from dataclasses import dataclass
 from enum import Enum
-from typing import Any
+from typing import Any, Callable, Iterator
 from vector2d import vector
 
+import copy
+import kernels
+
 
 class CellType(Enum):
     EMPTY = 0      # An empty cell
@@ -11,76 +15,420 @@ class CellType(Enum):
     BORDER = 3     # A border cell, this cell is out of bounds.
 
 
+# Raw cell byte -> CellType, indexing a tuple is a lot cheaper than calling CellType(...).
+CELL_TYPES: tuple[CellType, ...] = tuple(CellType(value) for value in range(len(CellType)))
+
+# Raw cell byte -> mask byte, so whole grids of masks are a single bytes.translate.
+_WALKABLE = bytes(value != CellType.WALL.value and value != CellType.BORDER.value for value in range(256))
+_OPAQUE = bytes(value == CellType.WALL.value or value == CellType.BOX.value for value in range(256))
+
+_MASK64 = (1 << 64) - 1
+
+
+def zobrist_key(i: int, kind: int) -> int:
+    """A random looking 64 bit key for a kind of thing (a CellType value, or one of the
+       game's own kinds) at cell index i. Worked out on the spot (splitmix64), so maps of
+       any size need no key table, and the same map always hashes the same."""
+    z = (i * 16 + kind + 1) * 0x9E3779B97F4A7C15 & _MASK64
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9 & _MASK64
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EB & _MASK64
+    return z ^ (z >> 31)
+
+
 @dataclass
 class MapState:
-    """Represents a state of the map. This should be hashable and fast."""
+    """Represents a state of the map. Hashable (see zobrist) and fast.
+       The cells live in a flat bytearray, row by row, with a one cell thick BORDER
+       frame around the map. Cell indices point into that padded grid, so stepping
+       one cell away from any cell inside the map never needs a bounds check."""
 
-    current_map: list[list[CellType]]
+    cells: bytearray
     height: int
     width: int
+    stride: int
+    walkable: bytearray  # 1 if an agent may stand on the cell (not a WALL or BORDER), boxes can be pushed off.
+    opaque: bytearray    # 1 if the cell blocks vision (a WALL or a BOX).
 
     def __init__(self, cur_map: list[list[CellType]]) -> None:
-        self.current_map = cur_map
-        self.height = len(cur_map)
-        self.width = len(cur_map[0])
+        self._load(b"".join(bytes(cell.value for cell in row) for row in cur_map), len(cur_map[0]), len(cur_map))
+
+    @classmethod
+    def from_grid(cls, grid: bytes, width: int, height: int) -> 'MapState':
+        """Creates a map from its raw cell bytes, row by row without the BORDER frame."""
+        state = cls.__new__(cls)
+        state._load(grid, width, height)
+        return state
+
+    def _load(self, grid: bytes, width: int, height: int) -> None:
+        """Sets up the padded grid, the masks and the empty caches from raw cell bytes."""
+        self.height = height
+        self.width = width
+        self.stride = self.width + 2
+
+        border = CellType.BORDER.value
+        self.cells = bytearray([border]) * (self.stride * (self.height + 2))
+        for y in range(self.height):
+            start = self.index(0, y)
+            self.cells[start:start + self.width] = grid[y * width:(y + 1) * width]
+
+        self.walkable = self.cells.translate(_WALKABLE)
+        self.opaque = self.cells.translate(_OPAQUE)
+
+        # Interned cell vectors, created the first time a cell index is turned into a vector.
+        self._vectors: list[vector | None] = [None] * len(self.cells)
+
+        # The 8 directions as flat cell index offsets, same order as agent.DIRECTIONS.
+        self.neighbor_offsets = [self.offset(dx, dy) for dx in range(-1, 2)
+                                 for dy in range(-1, 2) if (dx, dy) != (0, 0)]
+
+        # max_step -> moveset of every cell, filled in lazily by moveset() and neighbors().
+        self._movesets: dict[int, list[tuple[vector, ...] | None]] = {}
+        self._neighbors: dict[int, list[tuple[int, ...] | None]] = {}
+
+        # Bumped on every write that changes a cell. walk_revision is only bumped when a cell
+        # becomes walkable or stops being walkable, so planners know when to start over.
+        self.revision = 0
+        self.walk_revision = 0
+
+        # max_step -> (walk_revision, component of every cell), see components().
+        self._components: dict[int, tuple[int, array]] = {}
+
+        # Called with (index, old, new) after every write that changes a cell, see watch().
+        self._listeners: list[Callable[[int, CellType, CellType], None]] = []
+
+        # True while the cells are shared with a copy() (or the copy it came from).
+        self._shared = False
+
+        # Zobrist hash of the cells, worked out on first use and then kept up to date by writes.
+        self._zobrist: int | None = None
+
+        # vision range -> visibility bitset of every cell, filled in lazily by visibility().
+        self._visibility: dict[int, list[int | None]] = {}
+        self._visible_cells: dict[int, list[array | None]] = {}
+
+        # Tables read from a map cache (see loader.py), cells are only unpacked from them when
+        # first asked for. max_step -> (offsets, targets, stale), radius -> (bitsets, bytes per
+        # cell, stale). stale marks the cells whose stored entry no longer holds since a write.
+        self._stored_neighbors: dict[int, tuple[array, array, bytearray]] = {}
+        self._stored_visibility: dict[int, tuple[bytes, int, bytearray]] = {}
+
+    @property
+    def current_map(self) -> list[list[CellType]]:
+        """The map as nested lists of CellType, built on demand. Prefer the flat accessors."""
+        return [[CELL_TYPES[self.cells[self.index(x, y)]] for x in range(self.width)]
+                for y in range(self.height)]
+
+    def _update_masks(self, i: int) -> None:
+        """Recomputes the walkable and opaque masks of the cell at index i."""
+        cell = self.cells[i]
+        self.walkable[i] = _WALKABLE[cell]
+        self.opaque[i] = _OPAQUE[cell]
+
+    def window(self, i: int, radius: int) -> Iterator[int]:
+        """Yields the indices of the cells inside the map at most radius cells away
+           (in any of the 8 directions) from the cell at index i."""
+        x, y = self.coords(i)
+        left, right = max(0, x - radius), min(self.width, x + radius + 1)
+        for wy in range(max(0, y - radius), min(self.height, y + radius + 1)):
+            row = self.index(0, wy)
+            yield from range(row + left, row + right)
 
     def validate_coords(self, x: int, y: int) -> bool:
         """Checks if the coordinates are valid."""
         return 0 <= x < self.width and 0 <= y < self.height
 
+    def index(self, x: int, y: int) -> int:
+        """Returns the flat cell index of (x, y). Valid for -1 <= x <= width, -1 <= y <= height."""
+        return (y + 1) * self.stride + x + 1
+
+    def coords(self, i: int) -> tuple[int, int]:
+        """Returns the (x, y) coordinates of the flat cell index i."""
+        y, x = divmod(i, self.stride)
+        return x - 1, y - 1
+
+    def index_of(self, pos: vector) -> int:
+        """Returns the flat cell index of the vector pos."""
+        return (pos.y + 1) * self.stride + pos.x + 1
+
+    def offset(self, dx: int, dy: int) -> int:
+        """Returns how far apart two cell indices are, if the cells are (dx, dy) apart."""
+        return dy * self.stride + dx
+
+    def vector_at(self, i: int) -> vector:
+        """Returns the interned vector of the flat cell index i. The same index always
+           gives back the same object, so hot loops don't have to allocate new vectors."""
+        pos = self._vectors[i]
+        if pos is None:
+            pos = self._vectors[i] = vector(*self.coords(i))
+        return pos
+
+    def moveset(self, i: int, max_step: int) -> tuple[vector, ...]:
+        """Returns every cell reachable in max_step steps from the cell at index i, in cell index order.
+           Walls don't move, so this is only worked out once per cell and step count."""
+        cache = self._movesets.get(max_step)
+        if cache is None:
+            cache = self._movesets[max_step] = [None] * len(self.cells)
+
+        moves = cache[i]
+        if moves is None:
+            moves = cache[i] = tuple(map(self.vector_at, self.neighbors(i, max_step)))
+        return moves
+
+    def neighbors(self, i: int, max_step: int) -> tuple[int, ...]:
+        """Same as moveset, but as flat cell indices. The moveset graph is undirected,
+           j is a neighbor of i exactly when i is a neighbor of j."""
+        cache = self._neighbors.get(max_step)
+        if cache is None:
+            cache = self._neighbors[max_step] = [None] * len(self.cells)
+
+        moves = cache[i]
+        if moves is None and max_step in self._stored_neighbors and self.walkable[i]:
+            offsets, targets, stale = self._stored_neighbors[max_step]
+            if not stale[i]:
+                moves = cache[i] = tuple(targets[offsets[i]:offsets[i + 1]])
+        if moves is None:
+            # Sorted, so planners that break ties by order never depend on how a set iterates.
+            moves = cache[i] = tuple(kernels.moveset(self.walkable, self.neighbor_offsets, i, max_step))
+        return moves
+
+    def open_neighbors(self, i: int, max_step: int) -> tuple[int, ...]:
+        """Same as neighbors, without the cells that hold a box. For the hiders, who can't
+           push them. Not cached, boxes move around."""
+        box, cells = CellType.BOX.value, self.cells
+        return tuple(j for j in self.neighbors(i, max_step) if cells[j] != box)
+
+    def components(self, max_step: int) -> array:
+        """The connected component of every cell, as moves of max_step go: two cells have the same
+           number exactly when one can be reached from the other. Cells nobody can stand on get -1.
+           Worked out once, and again only after a cell becomes walkable or stops being walkable."""
+        cached = self._components.get(max_step)
+        if cached is not None and cached[0] == self.walk_revision:
+            return cached[1]
+
+        labels = array("i", [-1]) * len(self.cells)
+        component = 0
+        for first in range(len(self.cells)):
+            if not self.walkable[first] or labels[first] != -1:
+                continue
+            # Flood fill straight off kernels.moveset, the neighbors cache only fills up with what's walked.
+            labels[first] = component
+            frontier = [first]
+            while frontier:
+                for j in kernels.moveset(self.walkable, self.neighbor_offsets, frontier.pop(), max_step):
+                    if labels[j] == -1:
+                        labels[j] = component
+                        frontier.append(j)
+            component += 1
+        self._components[max_step] = (self.walk_revision, labels)
+        return labels
+
+    def export_neighbors(self, max_step: int) -> tuple[array, array]:
+        """Works out the neighbors of every walkable cell, and packs them as (offsets, targets):
+           the neighbors of cell i are targets[offsets[i]:offsets[i + 1]]. Used by the map cache."""
+        offsets, targets = array("i", [0]), array("i")
+        for i in range(len(self.cells)):
+            if self.walkable[i]:
+                targets.extend(self.neighbors(i, max_step))
+            offsets.append(len(targets))
+        return offsets, targets
+
+    def import_neighbors(self, max_step: int, offsets: array, targets: array) -> None:
+        """Hands moveset() the output of export_neighbors, instead of working it out again."""
+        self._stored_neighbors[max_step] = (offsets, targets, bytearray(len(self.cells)))
+
+    def line_of_sight(self, start: vector, end: vector) -> bool:
+        """Walks a ray from start to end, checks if no wall is in the way."""
+        return kernels.line_of_sight(self.opaque, self.width, self.height, start.x, start.y, end.x, end.y)
+
+    def visibility(self, i: int, radius: int) -> int:
+        """Returns which cells of the (2 * radius + 1)^2 window around the cell at index i
+           can be seen from it, as a bitset. Bit (dy + radius) * (2 * radius + 1) + dx + radius
+           is set if the cell (dx, dy) away is in sight. Worked out once per cell and radius."""
+        cache = self._visibility.get(radius)
+        if cache is None:
+            cache = self._visibility[radius] = [None] * len(self.cells)
+
+        visible = cache[i]
+        if visible is None and radius in self._stored_visibility and self.walkable[i]:
+            bitsets, size, stale = self._stored_visibility[radius]
+            if not stale[i]:
+                visible = cache[i] = int.from_bytes(bitsets[i * size:(i + 1) * size], "little")
+        if visible is None:
+            x, y = self.coords(i)
+            visible = cache[i] = kernels.visibility(self.opaque, self.width, self.height, x, y, radius)
+        return visible
+
+    def export_visibility(self, radius: int) -> list[int]:
+        """Works out the visibility bitset of every walkable cell, 0 for all other cells."""
+        return [self.visibility(i, radius) if self.walkable[i] else 0 for i in range(len(self.cells))]
+
+    def import_visibility(self, radius: int, bitsets: bytes, size: int) -> None:
+        """Hands visibility() the output of export_visibility, packed little endian
+           in size bytes per cell, instead of working it out again."""
+        self._stored_visibility[radius] = (bitsets, size, bytearray(len(self.cells)))
+
+    def visible_cells(self, i: int, radius: int) -> array:
+        """Returns the indices of all cells inside the map that can be seen from the cell
+           at index i with the given vision range, as an array of C ints."""
+        cache = self._visible_cells.get(radius)
+        if cache is None:
+            cache = self._visible_cells[radius] = [None] * len(self.cells)
+
+        cells = cache[i]
+        if cells is None:
+            visible = self.visibility(i, radius)
+            x, y = self.coords(i)
+            cells = cache[i] = array("i")
+            for bit, (dy, dx) in enumerate((dy, dx) for dy in range(-radius, radius + 1)
+                                           for dx in range(-radius, radius + 1)):
+                if (visible >> bit) & 1 and self.validate_coords(x + dx, y + dy):
+                    cells.append(self.index(x + dx, y + dy))
+        return cells
+
+    def at(self, i: int) -> CellType:
+        """Retrieves the cell at the flat index i. No bounds checks, no key parsing."""
+        return CELL_TYPES[self.cells[i]]
+
+    def is_walkable(self, pos: vector) -> bool:
+        """Checks if an agent may stand at pos."""
+        x, y = pos.x, pos.y
+        return 0 <= x < self.width and 0 <= y < self.height \
+            and self.walkable[(y + 1) * self.stride + x + 1] == 1
+
+    def _key_coords(self, key: Any) -> tuple[int, int]:
+        """Extracts the coordinates from a key of type vector, tuple or list."""
+        if isinstance(key, vector):
+            return key.x, key.y
+        if isinstance(key, (tuple, list)) and len(key) == 2:
+            return int(key[0]), int(key[1])
+        raise ValueError("Invalid key type")
+
     def __getitem__(self, key: Any) -> CellType:
         """Retrieves the cell from the map using key. Key must be of
            type tuple, list or vector. Tuple and list must have 2 keys.
            Returns a BORDER cell if the cell is out of bounds by any chance."""
-        try:
-            x: int
-            y: int
+        x, y = self._key_coords(key)
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return CELL_TYPES[self.cells[(y + 1) * self.stride + x + 1]]
+        return CellType.BORDER
 
-            if (isinstance(key, tuple) or isinstance(key, list)) and len(key) == 2:
-                x, y = int(key[0]), int(key[1])
-            elif isinstance(key, vector):
-                x, y = key.x, key.y
-            else:
-                raise ValueError("Invalid key type")
+    def copy(self) -> 'MapState':
+        """Returns a copy of the map that shares everything with this one until either is
+           written to, then the one being written to copies its cells and caches first.
+           Whoever watches this map doesn't watch the copy."""
+        clone = copy.copy(self)
+        clone._listeners = []
+        self._shared = clone._shared = True
+        return clone
 
-            return self.current_map[y][x] if self.validate_coords(x, y) else CellType.BORDER
-        except IndexError:
-            return CellType.BORDER  # If out of bounds, just return a border cell
+    def _own(self) -> None:
+        """Makes private copies of everything a write touches, while it's shared with a copy()."""
+        self.cells, self.walkable, self.opaque = self.cells[:], self.walkable[:], self.opaque[:]
+        self._movesets = {key: cache[:] for key, cache in self._movesets.items()}
+        self._neighbors = {key: cache[:] for key, cache in self._neighbors.items()}
+        self._components = dict(self._components)
+        self._visibility = {key: cache[:] for key, cache in self._visibility.items()}
+        self._visible_cells = {key: cache[:] for key, cache in self._visible_cells.items()}
+        self._stored_neighbors = {key: (offsets, targets, stale[:])
+                                  for key, (offsets, targets, stale) in self._stored_neighbors.items()}
+        self._stored_visibility = {key: (bitsets, size, stale[:])
+                                   for key, (bitsets, size, stale) in self._stored_visibility.items()}
+        self._shared = False
 
-        raise ValueError("Invalid key type")
+    def watch(self, listener: Callable[[int, CellType, CellType], None]) -> None:
+        """Calls listener with (index, old, new) after every write that changes a cell."""
+        self._listeners.append(listener)
+
+    def unwatch(self, listener: Callable[[int, CellType, CellType], None]) -> None:
+        """Stops calling a listener given to watch()."""
+        self._listeners.remove(listener)
+
+    def _forget_movesets(self, i: int) -> None:
+        """Drops the cached movesets that could go through the cell at index i.
+           A moveset of max_step only looks at cells up to max_step away, so that's all."""
+        for max_step in {*self._movesets, *self._neighbors, *self._stored_neighbors}:
+            window = list(self.window(i, max_step))
+            for cache in (self._movesets.get(max_step), self._neighbors.get(max_step)):
+                if cache is not None:
+                    for j in window:
+                        cache[j] = None
+            if max_step in self._stored_neighbors:
+                stale = self._stored_neighbors[max_step][2]
+                for j in window:
+                    stale[j] = 1
+
+    def _forget_visibility(self, i: int) -> None:
+        """Drops the cached visibility that could be blocked by the cell at index i.
+           Every ray of a vision range stays inside its window, so that's all."""
+        for radius in {*self._visibility, *self._stored_visibility}:
+            window = list(self.window(i, radius))
+            for cache in (self._visibility.get(radius), self._visible_cells.get(radius)):
+                if cache is not None:
+                    for j in window:
+                        cache[j] = None
+            if radius in self._stored_visibility:
+                stale = self._stored_visibility[radius][2]
+                for j in window:
+                    stale[j] = 1
+
+    @property
+    def zobrist(self) -> int:
+        """A 64 bit hash of every cell, kept up to date as cells are written."""
+        if self._zobrist is None:
+            self._zobrist = 0
+            empty = CellType.EMPTY.value
+            for i, cell in enumerate(self.cells):
+                if cell != empty:
+                    self._zobrist ^= zobrist_key(i, cell)
+        return self._zobrist
+
+    def __hash__(self) -> int:
+        return self.zobrist
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, MapState):
+            return NotImplemented
+        return self.width == other.width and self.height == other.height and self.cells == other.cells
 
     def __setitem__(self, key: Any, value: CellType) -> None:
         """Sets the cell at the key to the value. Key must be of
-           type tuple, list or vector. Tuple and list must have 2 keys."""
-        try:
-            x: int
-            y: int
-
-            if (isinstance(key, tuple) or isinstance(key, list)) and len(key) == 2:
-                x, y = int(key[0]), int(key[1])
-            elif isinstance(key, vector):
-                x, y = key.x, key.y
-            else:
-                raise ValueError("Invalid key type")
-
-            if self.validate_coords(x, y):
-                self.current_map[y][x] = value
-        except IndexError:
-            raise ValueError("Invalid key")
+           type tuple, list or vector. Tuple and list must have 2 keys.
+           Out of bounds writes are ignored."""
+        x, y = self._key_coords(key)
+        if not self.validate_coords(x, y):
+            return
 
-        raise ValueError("Invalid key type")
+        i = self.index(x, y)
+        if self.cells[i] == value.value:
+            return
+
+        if self._shared:
+            self._own()  # Someone else still looks at these cells, make our own before writing.
+
+        old = CELL_TYPES[self.cells[i]]
+        if self._zobrist is not None:
+            for cell in (old.value, value.value):
+                if cell != CellType.EMPTY.value:
+                    self._zobrist ^= zobrist_key(i, cell)
+
+        was_walkable, was_opaque = self.walkable[i], self.opaque[i]
+        self.cells[i] = value.value
+        self._update_masks(i)
+        self.revision += 1
+
+        # Only cells becoming (un)walkable change where agents can step, and only cells that
+        # block vision (or stop blocking it) change what they can see. Both only around the cell.
+        if self.walkable[i] != was_walkable:
+            self.walk_revision += 1
+            self._forget_movesets(i)
+        if self.walkable[i] != was_walkable or self.opaque[i] != was_opaque:
+            self._forget_visibility(i)
+
+        for listener in self._listeners:
+            listener(i, old, value)
 
 
 def state_from_file(file_path: str) -> MapState:
-    """Reads a map from a file and returns a MapState object."""
-    cells: list[list[CellType]] = []
-    with open(file_path, "r") as file:
-        # The first line is the dimensions of the map
-        width, height = tuple(map(int, file.readline().split()))
-        for _ in range(height):
-            line = list(map(lambda x: CellType(int(x)),
-                        file.readline().strip().split()))
-            if len(line) != width:
-                raise ValueError("Invalid map file")
-            cells.append(line)
-    return MapState(cells)
+    """Reads a map from a file and returns a MapState object. Takes both formats, see loader.py."""
+    from loader import load_map  # loader builds on this module.
+    return load_map(file_path)[1]
@@ -0,0 +1,153 @@
+from collections import deque
+from typing import Callable
+
+import argparse
+import random
+
+
+def _open_layout(width: int, height: int, density: float, rng: random.Random) -> list[list[bool]]:
+    """Scatters single walls all over the map."""
+    return [[rng.random() < density for _ in range(width)] for _ in range(height)]
+
+
+def _rooms_layout(width: int, height: int, density: float, rng: random.Random) -> list[list[bool]]:
+    """Splits the map into a grid of rooms, with a doorway in every wall between two rooms.
+       density is used for clutter inside the rooms."""
+    room = 8
+    walls = [[rng.random() < density / 4 for _ in range(width)] for _ in range(height)]
+    for y in range(height):
+        for x in range(width):
+            if x % room == room - 1 or y % room == room - 1:
+                walls[y][x] = True
+
+    # Knock a doorway into the walls on the right and the bottom of every room.
+    for top in range(0, height, room):
+        for left in range(0, width, room):
+            door_x = left + room - 1
+            door_y = top + rng.randrange(room - 1)
+            if door_x < width and door_y < height:
+                walls[door_y][door_x] = False
+            door_x = left + rng.randrange(room - 1)
+            door_y = top + room - 1
+            if door_x < width and door_y < height:
+                walls[door_y][door_x] = False
+    return walls
+
+
+def _corridors_layout(width: int, height: int, density: float, rng: random.Random) -> list[list[bool]]:
+    """Carves a maze of one cell wide corridors, then knocks out some walls so there are loops.
+       The higher the density, the fewer walls are knocked out."""
+    walls = [[True] * width for _ in range(height)]
+    stack = [(0, 0)]
+    walls[0][0] = False
+    while stack:
+        x, y = stack[-1]
+        options = [(dx, dy) for dx, dy in ((2, 0), (-2, 0), (0, 2), (0, -2))
+                   if 0 <= x + dx < width and 0 <= y + dy < height and walls[y + dy][x + dx]]
+        if not options:
+            stack.pop()
+            continue
+        dx, dy = rng.choice(options)
+        walls[y + dy // 2][x + dx // 2] = False
+        walls[y + dy][x + dx] = False
+        stack.append((x + dx, y + dy))
+
+    for y in range(height):
+        for x in range(width):
+            if walls[y][x] and rng.random() > density:
+                walls[y][x] = False
+    return walls
+
+
+# The kinds of maps generate_map knows how to make.
+LAYOUTS: dict[str, Callable[[int, int, float, random.Random], list[list[bool]]]] = {
+    "open": _open_layout,
+    "rooms": _rooms_layout,
+    "corridors": _corridors_layout,
+}
+
+
+def _largest_area(walls: list[list[bool]]) -> list[tuple[int, int]]:
+    """Returns the cells of the largest area agents can walk around in (8 directions)."""
+    height, width = len(walls), len(walls[0])
+    seen = [[False] * width for _ in range(height)]
+    best: list[tuple[int, int]] = []
+
+    for sy in range(height):
+        for sx in range(width):
+            if walls[sy][sx] or seen[sy][sx]:
+                continue
+
+            area = [(sx, sy)]
+            seen[sy][sx] = True
+            queue = deque(area)
+            while queue:
+                x, y = queue.popleft()
+                for dx in range(-1, 2):
+                    for dy in range(-1, 2):
+                        nx, ny = x + dx, y + dy
+                        if 0 <= nx < width and 0 <= ny < height and not walls[ny][nx] and not seen[ny][nx]:
+                            seen[ny][nx] = True
+                            area.append((nx, ny))
+                            queue.append((nx, ny))
+            if len(area) > len(best):
+                best = area
+    return best
+
+
+def generate_map(width: int, height: int, wall_density: float = 0.2, layout: str = "open",
+                 hiders: int = 1, seeker_vision: int = 3, seeker_step: int = 1,
+                 hider_vision: int = 2, hider_step: int = 1, time_limit: int = 1000,
+                 seed: int = 0, boxes: int = 0) -> str:
+    """Generates a map in the same format game_from_file reads. The same arguments
+       always give the same map. All agents (and boxes, for level 4) are put in the same walkable area."""
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout {layout}.")
+
+    rng = random.Random(seed)
+    walls = LAYOUTS[layout](width, height, wall_density, rng)
+
+    area = _largest_area(walls)
+    if len(area) < hiders + boxes + 1:
+        raise ValueError("Not enough room for all agents, try a lower wall density.")
+
+    grid = [["X" if wall else "." for wall in row] for row in walls]
+    spots = rng.sample(area, hiders + boxes + 1)
+    seeker_x, seeker_y = spots[0]
+    grid[seeker_y][seeker_x] = "S"
+    for x, y in spots[1:hiders + 1]:
+        grid[y][x] = "H"
+    for x, y in spots[hiders + 1:]:
+        grid[y][x] = "B"
+
+    lines = [str(time_limit), f"{seeker_vision} {seeker_step}", f"{hider_vision} {hider_step}"]
+    lines.extend("".join(row) for row in grid)
+    return "\n".join(lines) + "\n"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generates a random map for Hide and Seek.")
+    parser.add_argument("output", help="where to write the map")
+    parser.add_argument("--width", type=int, default=50)
+    parser.add_argument("--height", type=int, default=50)
+    parser.add_argument("--density", type=float, default=0.2, help="how many walls, 0 to 1")
+    parser.add_argument("--layout", choices=list(LAYOUTS), default="open")
+    parser.add_argument("--hiders", type=int, default=1)
+    parser.add_argument("--seeker", type=int, nargs=2, default=[3, 1], metavar=("VISION", "STEP"))
+    parser.add_argument("--hider", type=int, nargs=2, default=[2, 1], metavar=("VISION", "STEP"))
+    parser.add_argument("--time", type=int, default=1000, help="time limit")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--boxes", type=int, default=0, help="boxes to scatter around, for level 4")
+    args = parser.parse_args()
+
+    seeker_vision, seeker_step = args.seeker
+    hider_vision, hider_step = args.hider
+    with open(args.output, "w") as file:
+        file.write(generate_map(args.width, args.height, args.density, args.layout, args.hiders,
+                                seeker_vision=seeker_vision, seeker_step=seeker_step,
+                                hider_vision=hider_vision, hider_step=hider_step,
+                                time_limit=args.time, seed=args.seed, boxes=args.boxes))
+
+
+if __name__ == "__main__":
+    main()
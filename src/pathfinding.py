@@ -0,0 +1,163 @@
+from collections import Counter
+from heatmap import Heatmap
+from map_state import MapState
+
+import heapq
+
+
+class BucketQueue:
+    """A priority queue for small integer priorities, like the heat costs of the hider.
+       Items with the same priority share a bucket, and a heap only keeps track of which
+       priorities are in use, so there are far fewer heap operations than items."""
+
+    def __init__(self) -> None:
+        self._buckets: dict[int, list[int]] = {}
+        self._keys: list[int] = []
+
+    def __bool__(self) -> bool:
+        return bool(self._keys)
+
+    def push(self, priority: int, item: int) -> None:
+        """Adds an item with the given priority."""
+        bucket = self._buckets.get(priority)
+        if bucket is None:
+            bucket = self._buckets[priority] = []
+            heapq.heappush(self._keys, priority)
+        bucket.append(item)
+
+    def pop(self) -> tuple[int, int]:
+        """Removes and returns the (priority, item) with the lowest priority."""
+        priority = self._keys[0]
+        bucket = self._buckets[priority]
+        item = bucket.pop()
+        if not bucket:
+            del self._buckets[priority]
+            heapq.heappop(self._keys)
+        return priority, item
+
+
+def coldest_step(view: MapState, heatmap: Heatmap, start: int, goals: set[int], max_step: int,
+                 stats: Counter[str] | None = None) -> int:
+    """Finds the coldest path from start to ANY of the goals, and returns the first cell on it.
+       Entering a cell costs its temperature, which must not be negative, and the goals must
+       be the coldest cells on the map. Boxes are in the way, it's for the hiders, who can't
+       push them. Returns start if it's a goal already, or if no goal can be reached.
+
+       This is A* with a bound that never overestimates: every move costs at least the
+       coldest temperature on the map, and it takes at least ceil(d / max_step) moves to
+       cover a distance of d, d being the distance to the box around all goals."""
+    if start in goals or not goals or max_step == 0:
+        return start
+
+    # The box around all goals. Chebyshev distance to it is never more than to the nearest goal.
+    goal_coords = [view.coords(goal) for goal in goals]
+    min_x, max_x = min(x for x, _ in goal_coords), max(x for x, _ in goal_coords)
+    min_y, max_y = min(y for _, y in goal_coords), max(y for _, y in goal_coords)
+    lowest = max(min(heatmap.get(goal) for goal in goals), 0)
+    stride = view.stride
+
+    def bound(i: int) -> int:
+        if i in goals:
+            return 0
+        y, x = divmod(i, stride)
+        x, y = x - 1, y - 1
+        far = max(min_x - x, x - max_x, min_y - y, y - max_y, 0)
+        return max(-(-far // max_step), 1) * lowest
+
+    g_score: dict[int, int] = {start: 0}
+    parents: dict[int, int] = {}
+    queue = BucketQueue()
+    queue.push(bound(start), start)
+
+    while queue:
+        f_score, cur = queue.pop()
+        if f_score != g_score[cur] + bound(cur):
+            continue  # An older, worse entry of a cell we already got to cheaper.
+        if stats is not None:
+            stats["nodes_expanded"] += 1
+
+        # The first goal out of the queue is the cheapest one, stop right here.
+        if cur in goals:
+            while parents[cur] != start:
+                cur = parents[cur]
+            return cur
+
+        if stats is not None:
+            stats["moveset_calls"] += 1
+        for neighbor in view.open_neighbors(cur, max_step):
+            new_g = g_score[cur] + heatmap.get(neighbor)
+            if new_g < g_score.get(neighbor, new_g + 1):
+                g_score[neighbor] = new_g
+                parents[neighbor] = cur
+                queue.push(new_g + bound(neighbor), neighbor)
+
+    return start
+
+
+class DistanceField:
+    """How many moves it takes to reach the nearest goal, from every cell of the map.
+       Built with one breadth-first search over the moveset graph, seeded from all goals at
+       once. The search is lazy: it only runs as far out as the cells that were asked about,
+       and picks up where it left off when asked about a cell further away."""
+
+    view: MapState
+    max_step: int
+    goals: frozenset[int]
+    revision: int
+    dist: list[int]
+
+    def __init__(self, view: MapState, max_step: int, goals: frozenset[int],
+                 stats: Counter[str] | None = None) -> None:
+        self.view = view
+        self.max_step = max_step
+        self.goals = goals
+        self.revision = view.walk_revision
+        self.stats = stats
+
+        # -1 means not reached YET, the cell may still be reachable.
+        self.dist = [-1] * len(view.cells)
+        for goal in goals:
+            self.dist[goal] = 0
+        self._frontier = list(goals)
+        self._depth = 0
+
+    def is_valid_for(self, view: MapState, max_step: int, goals: frozenset[int]) -> bool:
+        """Checks if this field can be reused for the goals, on the map as it is now."""
+        return self.view is view and self.revision == view.walk_revision \
+            and self.max_step == max_step and self.goals == goals
+
+    def _expand(self) -> None:
+        """Runs the search one layer further out."""
+        self._depth += 1
+        dist, new = self.dist, []
+        for i in self._frontier:
+            for j in self.view.neighbors(i, self.max_step):
+                if dist[j] < 0:
+                    dist[j] = self._depth
+                    new.append(j)
+        if self.stats is not None:
+            self.stats["nodes_expanded"] += len(self._frontier)
+            self.stats["moveset_calls"] += len(self._frontier)
+        self._frontier = new
+
+    def distance(self, i: int) -> int:
+        """Returns the number of moves from the cell at index i to the nearest goal, -1 if there's no way."""
+        # Finishing the layer the cell is in means all cells closer than it are known too.
+        while self.dist[i] < 0 and self._frontier:
+            self._expand()
+        return self.dist[i]
+
+    def next_step(self, i: int) -> int | None:
+        """Returns the cell to move to from the cell at index i, to get closer to a goal.
+           Returns i itself if it's already a goal, None if no goal can be reached.
+           Ties go to the lowest cell index, so the choice never depends on set order."""
+        here = self.distance(i)
+        if here < 0:
+            return None
+        if here == 0:
+            return i
+
+        # Every cell closer than here is already known, so unknown neighbors can't be better.
+        if self.stats is not None:
+            self.stats["moveset_calls"] += 1
+        return min((self.dist[j], j) for j in self.view.neighbors(i, self.max_step) if self.dist[j] >= 0)[1]
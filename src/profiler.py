@@ -0,0 +1,72 @@
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Iterator
+
+import csv
+import json
+import time
+
+if TYPE_CHECKING:
+    from agent import Agent
+
+# The counters agents keep while a profiler is attached.
+COUNTERS = ["nodes_expanded", "moveset_calls", "can_see_calls", "heat_cells", "partial_plans"]
+
+
+class Profiler:
+    """Records how long every phase of every tick takes, and what the agents did in it.
+       One record per (tick, phase), agent phases also carry that agent's counters.
+       Attach one with Game.enable_profiling(), games without one pay nothing."""
+
+    records: list[dict[str, Any]]
+    tick: int
+
+    def __init__(self) -> None:
+        self.records = []
+        self.tick = 0
+
+    def start_tick(self, tick: int) -> None:
+        """Marks the start of a new tick, all phases after this belong to it."""
+        self.tick = tick
+
+    @contextmanager
+    def phase(self, name: str, agent: 'Agent | None' = None) -> Iterator[None]:
+        """Times the code inside the with block as one phase of the current tick.
+           If agent is given, its counters are moved into the record as well."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record: dict[str, Any] = {"tick": self.tick, "phase": name,
+                                      "ms": (time.perf_counter() - start) * 1000}
+            if agent is not None and agent.stats is not None:
+                record.update({counter: agent.stats[counter] for counter in COUNTERS})
+                agent.stats.clear()
+            self.records.append(record)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Totals up every phase over all ticks: calls, total and worst time, and counters."""
+        totals: dict[str, dict[str, float]] = {}
+        for record in self.records:
+            total = totals.setdefault(record["phase"], dict.fromkeys(["calls", "total_ms", "max_ms", *COUNTERS], 0))
+            total["calls"] += 1
+            total["total_ms"] += record["ms"]
+            total["max_ms"] = max(total["max_ms"], record["ms"])
+            for counter in COUNTERS:
+                total[counter] += record.get(counter, 0)
+        return totals
+
+    def slowest(self, count: int = 10) -> list[dict[str, Any]]:
+        """Returns the records of the slowest phases."""
+        return sorted(self.records, key=lambda record: record["ms"], reverse=True)[:count]
+
+    def to_json(self, file_path: str) -> None:
+        """Writes all records to a JSON file."""
+        with open(file_path, "w") as file:
+            json.dump(self.records, file)
+
+    def to_csv(self, file_path: str) -> None:
+        """Writes all records to a CSV file, one row per record."""
+        with open(file_path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=["tick", "phase", "ms", *COUNTERS], restval=0)
+            writer.writeheader()
+            writer.writerows(self.records)
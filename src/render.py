@@ -0,0 +1,196 @@
+from hide_and_seek import Game, game_from_file
+from map_state import CellType
+from typing import TextIO
+
+import argparse
+import json
+import shutil
+import sys
+import time
+
+# A frame is one byte per cell of the padded grid (see MapState), the glyph drawn there.
+# Boxes are drawn as ☐, which doesn't fit in a byte, so they stand in as \x02 until the text is made.
+EMPTY, WALL, BOX, BORDER = ".", "X", "\x02", " "
+SEEN, FLARE, HIDER, SEEKER = "-", "*", "H", "S"
+_CELL_GLYPHS = {CellType.EMPTY.value: EMPTY, CellType.WALL.value: WALL, CellType.BOX.value: BOX}
+_GLYPHS = bytes(ord(_CELL_GLYPHS.get(value, BORDER)) for value in range(256))
+
+# Lines above the map: the status line, and an empty one.
+HEADER_LINES = 2
+
+
+def frame(game: Game) -> bytearray:
+    """The glyph of every cell, the way print_rep has always drawn them: the seeker, then hiders,
+       then flares, walls and boxes, then the empty cells the seeker can see."""
+    state = game.state
+    glyphs = state.cells.translate(_GLYPHS)
+    seen, empty = ord(SEEN), ord(EMPTY)
+    for i in game.seeker.visible_cells():
+        if glyphs[i] == empty:
+            glyphs[i] = seen
+    for where in game.flares:
+        glyphs[state.index_of(where)] = ord(FLARE)
+    for hider in game.hiders:
+        glyphs[state.index_of(hider.position)] = ord(HIDER)
+    glyphs[state.index_of(game.seeker.position)] = ord(SEEKER)
+    return glyphs
+
+
+def status(game: Game) -> str:
+    """The line above the map."""
+    return f"{len(game.hiders)} left, {game.time_elapsed}s elapsed"
+
+
+def width(game: Game) -> int:
+    """The widest a frame gets: the map, or the status line once the clock has run out."""
+    longest = f"{len(game.hiders)} left, {game.maximum_time + 1}s elapsed"
+    return max(game.state.width, len(longest))
+
+
+def board(game: Game, glyphs: bytearray) -> str:
+    """A frame as text, row by row."""
+    state = game.state
+    rows = [glyphs[state.index(0, y):state.index(state.width, y)].decode() for y in range(state.height)]
+    return "\n".join(rows).replace(BOX, "☐")
+
+
+class Renderer:
+    """Draws a game to a terminal, frame after frame. The first frame is drawn whole; after that,
+       only the cells that look different are drawn over, by moving the cursor to them (ANSI
+       escapes), so a frame costs about as much as the agents moved and the seeker looked around.
+       With delta=False (or a frame taller or wider than the terminal it's drawn to), every frame
+       is drawn whole instead.
+       Whatever gets drawn can also be recorded, see record()."""
+
+    def __init__(self, game: Game, stream: TextIO = sys.stdout, delta: bool = True) -> None:
+        self.game = game
+        self.stream = stream
+        self.delta = delta
+        if delta and stream.isatty():
+            # Cells that scrolled off the top, or wrapped onto the next line, can't be drawn over.
+            size = shutil.get_terminal_size()
+            self.delta = game.state.height + HEADER_LINES < size.lines and width(game) < size.columns
+        self.glyphs: bytearray | None = None   # The frame on screen.
+        self.marked: set[int] = set()          # Cells of it that aren't just the map.
+        self.written: set[int] = set()         # Cells of the map written to since.
+        self.recording: TextIO | None = None
+        self.frames = 0
+        self.interval = 0.1
+        game.state.watch(self._cell_changed)
+
+    def _cell_changed(self, i: int, old: CellType, new: CellType) -> None:
+        self.written.add(i)
+
+    def record(self, file_path: str, interval: float = 0.1) -> None:
+        """Also writes everything drawn to a file, as an asciicast (v2) with a frame every interval
+           seconds. Play it back with `python render.py --play FILE`, or asciinema."""
+        state = self.game.state
+        self.recording = open(file_path, "w")
+        self.interval = interval
+        self.recording.write(json.dumps({"version": 2, "width": width(self.game),
+                                         "height": state.height + HEADER_LINES + 1}) + "\n")
+        self.glyphs = None  # The recording starts with a whole frame.
+
+    def draw(self) -> None:
+        """Draws the game as it is now."""
+        game, state = self.game, self.game.state
+        glyphs = frame(game)
+        # The cells that aren't just the map this frame. They may look different next frame, or
+        # once they're left behind, the rest only when the map itself is written to.
+        marked = set(game.seeker.visible_cells())
+        marked.update(state.index_of(where) for where in game.flares)
+        marked.update(state.index_of(hider.position) for hider in game.hiders)
+        marked.add(state.index_of(game.seeker.position))
+
+        if not self.delta or self.glyphs is None:
+            clear = "\x1b[H\x1b[2J" if self.delta else ""
+            text = f"{clear}{status(game)}\n\n{board(game, glyphs)}\n"
+        else:
+            text = self._changes(glyphs, self.marked | marked | self.written)
+        self.glyphs, self.marked = glyphs, marked
+        self.written.clear()
+
+        self.stream.write(text)
+        self.stream.flush()
+        if self.recording is not None:
+            self.recording.write(json.dumps([round(self.frames * self.interval, 6), "o", text]) + "\n")
+        self.frames += 1
+
+    def _changes(self, glyphs: bytearray, cells: set[int]) -> str:
+        """What to write to turn the frame on screen into glyphs, looking only at cells."""
+        state, old = self.game.state, self.glyphs
+        assert old is not None
+        parts = [f"\x1b[1;1H{status(self.game)}\x1b[K"]
+        changed = sorted(i for i in cells if glyphs[i] != old[i])
+        run = 0
+        while run < len(changed):
+            # Cells next to each other on a row are written in one go.
+            end = run + 1
+            while end < len(changed) and changed[end] == changed[end - 1] + 1:
+                end += 1
+            x, y = state.coords(changed[run])
+            text = glyphs[changed[run]:changed[end - 1] + 1].decode().replace(BOX, "☐")
+            parts.append(f"\x1b[{y + HEADER_LINES + 1};{x + 1}H{text}")
+            run = end
+        parts.append(f"\x1b[{state.height + HEADER_LINES + 1};1H")
+        return "".join(parts)
+
+    def close(self) -> None:
+        """Stops listening to the map, and closes the recording."""
+        self.game.state.unwatch(self._cell_changed)
+        if self.recording is not None:
+            self.recording.close()
+
+
+def play(file_path: str, speed: float = 1.0, stream: TextIO = sys.stdout) -> None:
+    """Plays a recording back, at speed times the speed it was recorded at."""
+    with open(file_path) as file:
+        file.readline()  # The header.
+        start = time.monotonic()
+        for line in file:
+            at, _, text = json.loads(line)
+            delay = start + at / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            stream.write(text)
+            stream.flush()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Watches a game of Hide and Seek play out in the terminal.")
+    parser.add_argument("map", nargs="?", help="map file to play")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--interval", type=float, default=0.1, help="seconds between two ticks")
+    parser.add_argument("--record", default=None, metavar="FILE", help="also record the game to FILE")
+    parser.add_argument("--full", action="store_true", help="redraw the whole map every tick")
+    parser.add_argument("--play", default=None, metavar="FILE", help="play a recording back instead")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed")
+    args = parser.parse_args()
+
+    if args.play:
+        play(args.play, args.speed)
+        return
+    if args.map is None:
+        parser.error("Give a map to play, or --play a recording.")
+
+    game = game_from_file(args.map, seed=args.seed)
+    renderer = Renderer(game, delta=not args.full)
+    if args.record:
+        renderer.record(args.record, args.interval)
+    try:
+        renderer.draw()
+        while game.terminal_score() == 0:
+            time.sleep(args.interval)
+            game.tick()
+            renderer.draw()
+        print("Seeker has won!" if game.terminal_score() == 1 else "Hiders have won!", f"Score: {game.score}!")
+    except ValueError:
+        print("The seeker has given up.")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        renderer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+from dataclasses import dataclass, field
+from heatmap import HEATMAPS
+from hide_and_seek import Game, game_from_file
+from map_state import CellType, MapState
+
+import argparse
+import struct
+
+# A replay file is a header, then one frame per tick. All numbers are little endian.
+# The header holds what it takes to play the game again (map file, seed, planners and their
+# plan budgets) and what
+# it takes to show it without the map file (the cells and where everyone starts). A frame only
+# holds what changed: where the seeker is, the hiders that moved or got caught, the flares
+# shot and the cells that changed (pushed boxes), plus the world hash to check a re-run against.
+REPLAY_MAGIC = b"HSRP"
+REPLAY_VERSION = 2
+_HEADER = struct.Struct("<4sH?xqiiqiiiQHHii")
+_FRAME = struct.Struct("<iqiQHHH")
+_MOVE = struct.Struct("<Hi")     # Hider number, its cell, -1 once caught.
+_FLARE = struct.Struct("<iq")    # Cell, the time it runs out.
+_WRITE = struct.Struct("<iB")    # Cell, the CellType it became.
+_LENGTH = struct.Struct("<H")
+
+# How often Replay.world_at keeps a copy of the world around, in ticks.
+CHECKPOINT_INTERVAL = 64
+
+
+def grid_bytes(state: MapState) -> bytes:
+    """The raw cell bytes of a map, row by row without the BORDER frame. See MapState.from_grid."""
+    return b"".join(bytes(state.cells[state.index(0, y):state.index(state.width, y)]) for y in range(state.height))
+
+
+def _pack_text(text: str) -> bytes:
+    """A string as UTF-8, after its length."""
+    raw = text.encode()
+    return _LENGTH.pack(len(raw)) + raw
+
+
+@dataclass
+class Frame:
+    """What one tick changed, see ChangeTracker.frame. Cells are MapState cell indices."""
+
+    time: int
+    score: int
+    seeker: int
+    world_hash: int
+    moves: list[tuple[int, int]]    # Hider number, its cell, -1 once caught.
+    flares: list[tuple[int, int]]   # Cell, the time it runs out.
+    writes: list[tuple[int, int]]   # Cell, the CellType value it became.
+
+
+class ChangeTracker:
+    """Keeps track of what a game changes from one tick to the next. Hiders are numbered by
+       where they were in game.hiders when it started tracking."""
+
+    def __init__(self, game: Game) -> None:
+        self.state = game.state
+        self.hiders = list(game.hiders)
+        self.cells = [self.state.index_of(hider.position) for hider in self.hiders]
+        self.flares = dict(game.flares)
+        self.writes: list[tuple[int, int]] = []
+        self.state.watch(self._cell_changed)
+
+    def _cell_changed(self, i: int, old: CellType, new: CellType) -> None:
+        self.writes.append((i, new.value))
+
+    def frame(self, game: Game) -> Frame:
+        """What changed since the last frame (or since it started tracking)."""
+        index_of = self.state.index_of
+        playing = set(map(id, game.hiders))
+        moves = []
+        for number, hider in enumerate(self.hiders):
+            cell = index_of(hider.position) if id(hider) in playing else -1
+            if cell != self.cells[number]:
+                self.cells[number] = cell
+                moves.append((number, cell))
+
+        shot = [(index_of(where), until) for where, until in game.flares.items()
+                if self.flares.get(where) != until]
+        self.flares = dict(game.flares)
+
+        writes, self.writes = self.writes, []
+        return Frame(game.time_elapsed, game.score, index_of(game.seeker.position), game.world_hash(),
+                     moves, shot, writes)
+
+    def close(self) -> None:
+        """Stops listening to the map."""
+        self.state.unwatch(self._cell_changed)
+
+
+class ReplayWriter:
+    """Writes a game down as it's played, see Game.record_replay. Games with a plan_time can't
+       be played again the same way, so they can't be recorded: raises ValueError."""
+
+    def __init__(self, game: Game, file_path: str) -> None:
+        if any(agent.plan_time is not None for agent in [game.seeker, *game.hiders]):
+            raise ValueError("A game with a plan_time can't be replayed, it depends on the clock.")
+        self.file = open(file_path, "wb")
+        self.changes = ChangeTracker(game)
+
+        state = game.state
+        heatmap = next((kind for kind, cls in HEATMAPS.items() if type(game.seeker.heatmap) is cls), "list")
+        planner = game.hiders[0].planner if game.hiders else "dijkstra"
+        budget = game.hiders[0].plan_budget if game.hiders else None
+        self.file.write(b"".join([
+            _HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, game.seed is not None, game.seed or 0,
+                         state.width, state.height, game.maximum_time, game.time_elapsed, game.score,
+                         state.index_of(game.seeker.position), game.world_hash(), len(game.hiders), len(game.flares),
+                         game.seeker.plan_budget or 0, budget or 0),
+            _pack_text(game.map_path or ""), _pack_text(game.seeker.planner), _pack_text(planner), _pack_text(heatmap),
+            grid_bytes(state),
+            b"".join(struct.pack("<i", cell) for cell in self.changes.cells),
+            b"".join(_FLARE.pack(state.index_of(where), until) for where, until in game.flares.items()),
+        ]))
+
+    def frame(self, game: Game) -> None:
+        """Writes down what changed in the tick that was just played."""
+        frame = self.changes.frame(game)
+        self.file.write(b"".join([
+            _FRAME.pack(frame.time, frame.score, frame.seeker, frame.world_hash,
+                        len(frame.moves), len(frame.flares), len(frame.writes)),
+            *(_MOVE.pack(number, cell) for number, cell in frame.moves),
+            *(_FLARE.pack(cell, until) for cell, until in frame.flares),
+            *(_WRITE.pack(i, value) for i, value in frame.writes),
+        ]))
+
+    def close(self) -> None:
+        """Stops listening to the map, and closes the file."""
+        self.changes.close()
+        self.file.close()
+
+
+@dataclass
+class World:
+    """Everything there is to see at one point of a replay. Cells are MapState cell indices."""
+
+    state: MapState
+    time: int
+    score: int
+    seeker: int
+    hiders: list[int]        # -1 for the hiders that have been caught.
+    flares: dict[int, int]   # Cell -> the time it runs out.
+
+    def copy(self) -> 'World':
+        """A copy to play more frames on, the map is copy-on-write."""
+        return World(self.state.copy(), self.time, self.score, self.seeker, list(self.hiders), dict(self.flares))
+
+    def apply(self, frame: Frame) -> None:
+        """Plays a frame on top of this world."""
+        self.time, self.score, self.seeker = frame.time, frame.score, frame.seeker
+        for number, cell in frame.moves:
+            self.hiders[number] = cell
+        self.flares = {cell: until for cell, until in self.flares.items() if until > self.time}
+        self.flares.update(frame.flares)
+        for i, value in frame.writes:
+            self.state[self.state.vector_at(i)] = CellType(value)
+
+    def board(self) -> str:
+        """The board as Game.print_rep shows it, without what the seeker can see."""
+        state, hiders = self.state, set(self.hiders)
+        rows = []
+        for y in range(state.height):
+            row = ""
+            for x in range(state.width):
+                i = state.index(x, y)
+                if i == self.seeker:
+                    row += "S"
+                elif i in hiders:
+                    row += "H"
+                elif i in self.flares:
+                    row += "*"
+                else:
+                    row += {CellType.WALL: "X", CellType.BOX: "☐"}.get(state.at(i), ".")
+            rows.append(row)
+        return "\n".join(rows)
+
+
+@dataclass
+class Replay:
+    """A replay file, read back. world_at(n) is the world after n ticks."""
+
+    map_path: str
+    seed: int | None
+    seeker_planner: str
+    hider_planner: str
+    heatmap: str
+    seeker_budget: int | None  # Agent.plan_budget of the seeker, and of the hiders.
+    hider_budget: int | None
+    maximum_time: int
+    world_hash: int          # Of the world before the first tick.
+    start: World
+    frames: list[Frame]
+    checkpoints: dict[int, World] = field(default_factory=dict)
+
+    def world_at(self, tick: int) -> World:
+        """The world after tick ticks of the replay (0 is the start), without playing any agent.
+           Worlds every CHECKPOINT_INTERVAL ticks are kept, so scrubbing back and forth is cheap."""
+        tick = max(0, min(tick, len(self.frames)))
+        at = max((n for n in self.checkpoints if n <= tick), default=0)
+        world = (self.checkpoints.get(at) or self.start).copy()
+        for n in range(at, tick):
+            world.apply(self.frames[n])
+            if (n + 1) % CHECKPOINT_INTERVAL == 0:
+                self.checkpoints[n + 1] = world.copy()
+        return world
+
+    def game(self, cache_dir: str | None = None) -> Game:
+        """A fresh game set up the same way as the recorded one, to play it again."""
+        game = game_from_file(self.map_path, self.heatmap, cache_dir, self.seed)
+        game.seeker.planner = self.seeker_planner
+        game.seeker.plan_budget = self.seeker_budget
+        for hider in game.hiders:
+            hider.planner = self.hider_planner
+            hider.plan_budget = self.hider_budget
+        return game
+
+    def verify(self, cache_dir: str | None = None) -> int | None:
+        """Plays the game again from the map file and the seed, and checks every tick against
+           the replay. Returns the first tick that came out different (0 if the starts differ),
+           None if all of them match."""
+        game = self.game(cache_dir)
+        if game.world_hash() != self.world_hash:
+            return 0
+        for n, frame in enumerate(self.frames):
+            try:
+                game.tick()
+            except ValueError:
+                return n + 1  # The seeker gave up, the recording went on.
+            if game.world_hash() != frame.world_hash:
+                return n + 1
+        return None
+
+
+def read_replay(file_path: str) -> Replay:
+    """Reads a replay file. A frame cut short at the end (the game crashed) is left out.
+       Raises ValueError if it isn't a replay file."""
+    with open(file_path, "rb") as file:
+        data = file.read()
+
+    try:
+        (magic, version, seeded, seed, width, height, maximum_time, time, score, seeker, world_hash,
+         hider_count, flare_count, seeker_budget, hider_budget) = _HEADER.unpack_from(data)
+    except struct.error:
+        raise ValueError(f"{file_path}: not a replay file.") from None
+    if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+        raise ValueError(f"{file_path}: not a replay file, or from another version.")
+
+    at = _HEADER.size
+    texts = []
+    for _ in range(4):
+        length, = _LENGTH.unpack_from(data, at)
+        texts.append(data[at + _LENGTH.size:at + _LENGTH.size + length].decode())
+        at += _LENGTH.size + length
+    map_path, seeker_planner, hider_planner, heatmap = texts
+
+    state = MapState.from_grid(data[at:at + width * height], width, height)
+    at += width * height
+    hiders = list(struct.unpack_from(f"<{hider_count}i", data, at))
+    at += 4 * hider_count
+    flares = {}
+    for _ in range(flare_count):
+        cell, until = _FLARE.unpack_from(data, at)
+        flares[cell] = until
+        at += _FLARE.size
+
+    frames = []
+    try:
+        while at < len(data):
+            frame_time, frame_score, seeker_at, frame_hash, move_count, shot_count, write_count = \
+                _FRAME.unpack_from(data, at)
+            at += _FRAME.size
+            moves = [_MOVE.unpack_from(data, at + k * _MOVE.size) for k in range(move_count)]
+            at += move_count * _MOVE.size
+            shot = [_FLARE.unpack_from(data, at + k * _FLARE.size) for k in range(shot_count)]
+            at += shot_count * _FLARE.size
+            writes = [_WRITE.unpack_from(data, at + k * _WRITE.size) for k in range(write_count)]
+            at += write_count * _WRITE.size
+            frames.append(Frame(frame_time, frame_score, seeker_at, frame_hash, moves, shot, writes))
+    except struct.error:
+        pass  # Cut short.
+
+    start = World(state, time, score, seeker, hiders, flares)
+    return Replay(map_path, seed if seeded else None, seeker_planner, hider_planner, heatmap,
+                  seeker_budget or None, hider_budget or None, maximum_time, world_hash, start, frames)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Shows a recorded game of Hide and Seek, or checks it.")
+    parser.add_argument("replay", help="replay file, see batch.py --replays")
+    parser.add_argument("-t", "--tick", type=int, default=None, help="tick to show, defaults to the last one")
+    parser.add_argument("--verify", action="store_true",
+                        help="play the game again from the map and the seed, and check every tick")
+    parser.add_argument("--cache-dir", default=None, help="map cache to play it again with")
+    args = parser.parse_args()
+
+    try:
+        replay = read_replay(args.replay)
+    except (ValueError, OSError) as error:
+        parser.exit(1, f"{error}\n")
+
+    print(f"{replay.map_path}, seed {replay.seed}, seeker {replay.seeker_planner}, "
+          f"hiders {replay.hider_planner}, {len(replay.frames)} ticks")
+    world = replay.world_at(len(replay.frames) if args.tick is None else args.tick)
+    print(f"{sum(cell >= 0 for cell in world.hiders)} left, {world.time}s elapsed, score {world.score}\n")
+    print(world.board())
+
+    if args.verify:
+        diverged = replay.verify(args.cache_dir)
+        print("\nReplays exactly." if diverged is None else f"\nDiverges at tick {diverged}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,20 @@
 from agent import Agent
 from vector2d import vector
 from map_state import MapState, CellType
-from typing import TYPE_CHECKING
+from pathfinding import DistanceField
+from incremental import DStarLite
+from hpa import HierarchicalPlanner
+from typing import TYPE_CHECKING, Self
 
 
 if TYPE_CHECKING:
     from hide_and_seek import Game
 
 import hider
-import heapq
+import kernels
+import logging
+
+log = logging.getLogger(__name__)
 
 
 class Seeker(Agent):
@@ -16,77 +22,75 @@ class Seeker(Agent):
 
     pathfinders: dict[tuple[vector, vector], vector] = {}
 
-    def log_heatmap(self) -> None:
+    # How the seeker finds its way to the hottest cells. "astar" runs multi_astar every tick,
+    # "field" walks down a distance field that's kept for as long as the hottest cells stay the same,
+    # "incremental" keeps a D* Lite search around and only repairs it when the hottest cells change,
+    # "hpa" plans over clusters of the map (see hpa.py). It only does single steps, a seeker with
+    # a bigger max_step runs multi_astar instead.
+    planner: str = "astar"
+    field: DistanceField | None = None
+    replanner: DStarLite | None = None
+    hierarchy: HierarchicalPlanner | None = None
+
+    def clone(self, view: MapState) -> Self:
+        """Same as Agent.clone. Searches are tied to their map, so the copy starts its own."""
+        seeker = super().clone(view)
+        seeker.field = seeker.replanner = seeker.hierarchy = None
+        return seeker
+
+    def log_heatmap(self, file_path: str = "test/heatmap.txt") -> None:
         """Logs down the heatmap to a file."""
-        with open("test/heatmap.txt", "w") as f:
-            for row in self.heatmap:
+        with open(file_path, "w") as f:
+            for row in self.heatmap.rows():
                 for cell in row:
                     f.write(f"{cell:>5}")
                 f.write("\n")
 
     def perceive(self, game: 'Game') -> None:
         """Perceives the world then updates the heatmap accordingly."""
-        for cell in self.get_neighbors(self.position, self.vision_range):
-            # Uh oh, out of bounds.
-            if self.view[cell] == CellType.BORDER or not self.can_see(cell):
-                continue
+        visible = self.visible_cells()
+        self.count("can_see_calls", len(visible))  # One sight check per cell, worked out ahead of time.
 
-            # If there's a hider, increase the heat.
-            if game.is_there_hider(cell):
-                self.heatmap[cell.y][cell.x] = 10
-            else:
-                self.heatmap[cell.y][cell.x] -= 1  # Cool down the cell.
+        # Cool down everything in sight, then heat up the cells with a hider on them.
+        self.heatmap.add(visible, -1)
+        self.heatmap.fill([cell for cell in visible
+                           if game.is_there_hider_at(cell)], 10)
+        self.count("heat_cells", len(visible))
 
     def perceive_flare(self, flare: vector) -> None:
         """A flare has been shot, update the heatmap accordingly."""
 
         # A flare has been shot which means there's a hider nearby.
         # Increases heat for a certain radius around the flare.
-        for dx in range(-hider.FLARE_RANGE, hider.FLARE_RANGE + 1):
-            for dy in range(-hider.FLARE_RANGE, hider.FLARE_RANGE + 1):
-                pos = flare + vector(dx, dy)
-                if self.view[pos] != CellType.EMPTY:
-                    continue
-                self.heatmap[pos.y][pos.x] = 1
-
-    def heuristic(self, cur: vector, goals: set[vector]) -> float:
-        """Returns the heuristic value of the current position to the goal."""
-        return min([cur.taxicab(goal) for goal in goals])
+        cells = [self.view.index_of(pos) for pos in self.get_neighbors(flare, hider.FLARE_RANGE)
+                 if self.view[pos] == CellType.EMPTY]
+        self.heatmap.fill(cells, 1)
+        self.count("heat_cells", len(cells))
 
     def multi_astar(self, game: 'Game', goals: set[vector]) -> vector:
-        """Performs a breadth-first search to find the shortest path to ANY goal."""
-
-        open_set: list[tuple[float, vector]] = [(0, self.position)]
-        parents: dict[vector, vector] = {}
-        g_score: dict[vector, float] = {self.position: 0}
-
-        while open_set:
-            _, current = heapq.heappop(open_set)
-
-            # Found a goal, return the path.
-            if current in goals:
-                print(f"Found goal at {current} in {len(goals)} goals.")
-                path: list[vector] = []
-                while current != self.position:
-                    path.append(current)
-                    current = parents[current]
-                return path[-1] - self.position if path else vector(0, 0)
-
-            # Add all neighbors to the queue.
-            for neighbor in self.get_moveset(current):
-                if self.view[neighbor] == CellType.WALL or self.view[neighbor] == CellType.BORDER:
-                    continue
-
-                tent = g_score[current] + 1
-                if tent >= g_score.get(neighbor, float('inf')):
-                    continue
-
-                # Add the new position to the queue.
-                g_score[neighbor] = tent
-                parents[neighbor] = current
-                heapq.heappush(open_set,
-                               (tent + self.heuristic(neighbor, goals), neighbor))
-                parents[neighbor] = current
+        """Performs an A* search to find the shortest path to ANY goal. The search itself
+           is kernels.multi_astar, this only turns the goals into cells and back.
+           Goals the seeker can't get to are left out up front, and with a plan_budget or
+           plan_time it may only get part of the way, see kernels.multi_astar."""
+        view = self.view
+        start = view.index_of(self.position)
+        components = view.components(self.max_step)
+        cells = [cell for cell in map(view.index_of, goals) if components[cell] == components[start]]
+
+        step, expanded, found = -1, 0, False
+        if cells:
+            step, expanded, found = kernels.multi_astar(view.neighbors, self.max_step, view.stride, start, cells,
+                                                        self.plan_budget or 0, self.plan_deadline())
+        self.count("nodes_expanded", expanded)
+        self.count("moveset_calls", expanded - found)  # The goal it stopped at isn't expanded any further.
+
+        if found:
+            log.debug("Found a goal in %d goals after %d cells.", len(goals), expanded)
+        elif step >= 0:
+            log.debug("Ran out of planning after %d cells, going part of the way.", expanded)
+            self.count("partial_plans")
+        if step >= 0:
+            return view.vector_at(step) - self.position
 
         # No path to go to where it wants to. Which means the map is enclosed
         # in a way that the seeker can't look for all spots.
@@ -94,16 +98,53 @@ class Seeker(Agent):
         # to go to instead. But I'm lazy.
         raise ValueError("Come on bro.")
 
+    def follow_field(self, goals: frozenset[int]) -> vector:
+        """Takes one step down the distance field towards the nearest goal cell."""
+        if self.field is None or not self.field.is_valid_for(self.view, self.max_step, goals):
+            self.field = DistanceField(self.view, self.max_step, goals, self.stats)
+
+        step = self.field.next_step(self.view.index_of(self.position))
+        if step is None:
+            raise ValueError("Come on bro.")  # Same as multi_astar, nowhere to go.
+        return self.view.vector_at(step) - self.position
+
+    def replan(self, goals: list[int]) -> vector:
+        """Takes one step towards the nearest goal cell, repairing last tick's search."""
+        if self.replanner is None or not self.replanner.is_valid_for(self.view, self.max_step):
+            self.replanner = DStarLite(self.view, self.max_step, bound=self.moves_between, stats=self.stats)
+
+        step = self.replanner.next_step(self.view.index_of(self.position), goals)
+        if step is None:
+            raise ValueError("Come on bro.")  # Same as multi_astar, nowhere to go.
+        return self.view.vector_at(step) - self.position
+
+    def plan_coarse(self, goals: frozenset[int]) -> vector:
+        """Takes one step towards the nearest goal cell, planning over clusters of the map."""
+        if self.hierarchy is None or not self.hierarchy.is_valid_for(self.view, self.max_step):
+            if self.hierarchy is not None:
+                self.hierarchy.close()
+            self.hierarchy = HierarchicalPlanner(self.view, stats=self.stats)
+
+        step = self.hierarchy.next_step(self.view.index_of(self.position), goals)
+        if step is None:
+            raise ValueError("Come on bro.")  # Same as multi_astar, nowhere to go.
+        return self.view.vector_at(step) - self.position
+
     def accept(self, game: 'Game') -> vector:
         """Accepts the current world state. Returns the NEXT direction it takes."""
-        # Ravel the heatmap into a list.
-        raveled = [cell for row in self.heatmap for cell in row]
-
         # Pop ALL hottest cells, and calculate the best direction to move to.
-        highest_temp: int = max(raveled)
-        hottest_cells: set[vector] = set([vector(x, y) for y in range(len(self.heatmap))
-                                          for x in range(len(self.heatmap[y])) if self.heatmap[y][x] == highest_temp
-                                          and self.view[vector(x, y)] == CellType.EMPTY])
+        hottest = self.heatmap.extreme(highest=True)
+        if not hottest:
+            # No EMPTY cell to head for (boxes cover them all), so it stays on its own cell.
+            return self.position - self.position
+        if self.planner == "field":
+            return self.follow_field(frozenset(hottest))
+        if self.planner == "incremental":
+            return self.replan(hottest)
+        if self.planner == "hpa" and self.max_step == 1:
+            return self.plan_coarse(frozenset(hottest))
+
+        hottest_cells: set[vector] = set(map(self.view.vector_at, hottest))
 
         direction = self.multi_astar(game, hottest_cells)
         return direction
@@ -0,0 +1,390 @@
+from batch import DEFAULT_MAX_TICKS, winner
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from hide_and_seek import Game, game_from_file
+from heatmap import HEATMAPS
+from loader import MapFormatError
+from map_state import MapState
+from replay import ChangeTracker, Frame, World, grid_bytes
+from typing import Any
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import signal
+
+log = logging.getLogger(__name__)
+
+# The protocol is JSON lines both ways. Clients send {"op": ...} requests:
+#   start    {"map": name in the maps folder, "seed", "interval", "max_ticks", "heatmap",
+#             "seeker_planner", "hider_planner", "watch": true}  -> "started"
+#   watch    {"match": id}  -> a "snapshot" of the match, then one "tick" per tick and "over" at the end
+#   unwatch  {"match": id}
+#   list     -> "matches"
+#   stop     {"match": id}  -> "stopped"
+# Everything the server sends has an "event". Cells are (x, y) on the map.
+
+# The time between two ticks of a match, in seconds. Every tick has until the next one is due
+# to finish, a tick that's late is told to the spectators ("late") and the next one starts
+# right after it, instead of trying to catch up.
+DEFAULT_INTERVAL = 0.1
+
+# How many messages a client can fall behind by. Past that its queue is thrown away, and it
+# gets a fresh snapshot of every match it watches instead, so a slow client never holds up the rest.
+QUEUE_LIMIT = 256
+
+SEEKER_PLANNERS = ("astar", "field", "incremental", "hpa")
+HIDER_PLANNERS = ("dijkstra", "incremental", "astar")
+
+
+# The games themselves live in the worker processes, every match stays in the one it started
+# in. Only what a tick changed (a replay.Frame) comes back to the server.
+_games: dict[int, tuple[Game, ChangeTracker]] = {}
+
+
+def _start_match(match_id: int, map_path: str, seed: int | None, heatmap: str, seeker_planner: str,
+                 hider_planner: str, cache_dir: str | None) -> tuple[bytes, int, int, tuple[Any, ...]]:
+    """Sets up a game in this worker. Returns the map's cells, its width and height, and the
+       rest of a replay.World for it (time, score, seeker, hiders, flares)."""
+    game = game_from_file(map_path, heatmap, cache_dir, seed)
+    game.seeker.planner = seeker_planner
+    for hider in game.hiders:
+        hider.planner = hider_planner
+    changes = ChangeTracker(game)
+    _games[match_id] = (game, changes)
+
+    state = game.state
+    return grid_bytes(state), state.width, state.height, (
+        game.time_elapsed, game.score, state.index_of(game.seeker.position), list(changes.cells),
+        {state.index_of(where): until for where, until in game.flares.items()})
+
+
+def _tick_match(match_id: int, max_ticks: int) -> tuple[Frame, dict[str, Any] | None]:
+    """Plays one tick of a game in this worker. Returns what changed, and how it ended if it did."""
+    game, changes = _games[match_id]
+    gave_up = False
+    try:
+        game.tick()
+    except ValueError:
+        gave_up = True  # The seeker has nowhere to go.
+
+    frame = changes.frame(game)
+    outcome = game.terminal_score()
+    if not gave_up and outcome == 0 and game.time_elapsed < max_ticks:
+        return frame, None
+    return frame, {"winner": winner(outcome, gave_up), "gave_up": gave_up,
+                   "hiders_caught": len(changes.hiders) - len(game.hiders)}
+
+
+def _drop_match(match_id: int) -> None:
+    """Forgets a game in this worker."""
+    game, changes = _games.pop(match_id)
+    changes.close()
+
+
+class Client:
+    """A connection to the server. Everything sent to it goes through its own queue, and a task
+       of its own writes it out, so a client that reads slowly only ever waits on itself."""
+
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self.writer = writer
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue(QUEUE_LIMIT)
+        self.watching: set[int] = set()
+        self.closed = False  # The connection went away, nothing gets written out anymore.
+
+    def send(self, message: dict[str, Any]) -> bool:
+        """Queues a message. Returns False if the client is too far behind to take it."""
+        try:
+            self.queue.put_nowait(json.dumps(message, separators=(",", ":")).encode() + b"\n")
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def pump(self) -> None:
+        """Writes out the queued messages, for as long as the connection is open."""
+        try:
+            while True:
+                self.writer.write(await self.queue.get())
+                await self.writer.drain()
+        except ConnectionError:
+            self.closed = True
+
+
+@dataclass
+class Match:
+    """A match being played, as the server sees it. world is kept up to date from the frames
+       the worker sends back, so snapshots never have to ask the worker."""
+
+    id: int
+    map_name: str
+    shard: int
+    interval: float
+    max_ticks: int
+    world: World
+    watchers: set[Client] = field(default_factory=set)
+    late: int = 0           # Ticks that missed their deadline.
+    task: 'asyncio.Task[None] | None' = None
+
+
+class MatchServer:
+    """Plays many matches at once. Their games are spread over worker processes (shards), each
+       playing its share one tick at a time, so a tick of one match never stops the event loop
+       from serving the others. workers=0 plays them in a thread of this process instead."""
+
+    def __init__(self, maps_dir: str, workers: int, cache_dir: str | None = None) -> None:
+        self.maps_dir = os.path.realpath(maps_dir)
+        self.cache_dir = cache_dir
+        self.shards: list[Executor] = [ProcessPoolExecutor(max_workers=1) for _ in range(workers)] \
+            or [ThreadPoolExecutor(max_workers=1)]
+        self.load = [0] * len(self.shards)  # Matches per shard.
+        self.matches: dict[int, Match] = {}
+        self.ids = itertools.count(1)
+        self.closing = False
+
+    def map_path(self, name: str) -> str:
+        """The file of a map in the maps folder. Raises ValueError for anything outside of it."""
+        path = os.path.realpath(os.path.join(self.maps_dir, name))
+        if os.path.commonpath([path, self.maps_dir]) != self.maps_dir:
+            raise ValueError(f"No map {name}.")
+        return path
+
+    async def start_match(self, map_name: str, seed: int | None = None, interval: float = DEFAULT_INTERVAL,
+                          max_ticks: int = DEFAULT_MAX_TICKS, heatmap: str = "list",
+                          seeker_planner: str = "astar", hider_planner: str = "dijkstra") -> Match:
+        """Sets up a match on the least busy shard, and starts playing it."""
+        if heatmap not in HEATMAPS or seeker_planner not in SEEKER_PLANNERS or hider_planner not in HIDER_PLANNERS:
+            raise ValueError("Unknown heatmap or planner.")
+        path = self.map_path(map_name)
+        match_id = next(self.ids)
+        shard = min(range(len(self.shards)), key=self.load.__getitem__)
+        self.load[shard] += 1
+        try:
+            grid, width, height, start = await asyncio.get_running_loop().run_in_executor(
+                self.shards[shard], _start_match, match_id, path, seed, heatmap, seeker_planner,
+                hider_planner, self.cache_dir)
+        except BaseException:
+            self.load[shard] -= 1
+            raise
+
+        world = World(MapState.from_grid(grid, width, height), *start)
+        match = self.matches[match_id] = Match(match_id, map_name, shard, interval, max_ticks, world)
+        match.task = asyncio.create_task(self._play(match))
+        log.info("Match %d started on %s, shard %d.", match_id, map_name, shard)
+        return match
+
+    async def _play(self, match: Match) -> None:
+        """Ticks a match until it's over (or stopped), and streams every tick to its spectators."""
+        loop = asyncio.get_running_loop()
+        shard = self.shards[match.shard]
+        due = loop.time()
+        try:
+            while True:
+                due += match.interval
+                tick = loop.run_in_executor(shard, _tick_match, match.id, match.max_ticks)
+                late = False
+                if match.interval > 0:
+                    try:
+                        await asyncio.wait_for(asyncio.shield(tick), max(0.0, due - loop.time()))
+                    except TimeoutError:
+                        late = True
+                        match.late += 1
+                        self.publish(match, {"event": "late", "match": match.id, "time": match.world.time + 1})
+                frame, result = await tick
+
+                match.world.apply(frame)
+                self.publish(match, self.tick_message(match, frame, late))
+                if result is not None:
+                    self.publish(match, {"event": "over", "match": match.id, "score": frame.score,
+                                         "ticks": frame.time, **result})
+                    log.info("Match %d is over, %s won.", match.id, result["winner"])
+                    break
+
+                if late:
+                    due = loop.time()  # Start over from now, rather than rushing the ticks that were missed.
+                await asyncio.sleep(due - loop.time())
+        except Exception as error:
+            log.exception("Match %d crashed.", match.id)
+            self.publish(match, {"event": "error", "match": match.id, "message": str(error)})
+        finally:
+            del self.matches[match.id]
+            for client in match.watchers:
+                client.watching.discard(match.id)
+            self.load[match.shard] -= 1
+            if not self.closing:
+                # Whatever tick is still running has to finish before the game can go.
+                await asyncio.shield(loop.run_in_executor(shard, _drop_match, match.id))
+
+    async def stop_match(self, match_id: int) -> None:
+        """Stops playing a match, and forgets it."""
+        match = self.matches.get(match_id)
+        if match is None or match.task is None:
+            raise ValueError(f"No match {match_id}.")
+        match.task.cancel()
+        try:
+            await match.task
+        except asyncio.CancelledError:
+            pass
+
+    def cell(self, match: Match, i: int) -> list[int] | None:
+        """A cell index as [x, y], None for -1."""
+        return list(match.world.state.coords(i)) if i >= 0 else None
+
+    def snapshot(self, match: Match) -> dict[str, Any]:
+        """Everything about a match a spectator needs to follow the ticks that come after it."""
+        world = match.world
+        state = world.state
+        return {"event": "snapshot", "match": match.id, "map": match.map_name,
+                "width": state.width, "height": state.height,
+                "cells": ["".join(str(state.cells[state.index(x, y)]) for x in range(state.width))
+                          for y in range(state.height)],
+                "time": world.time, "score": world.score, "seeker": self.cell(match, world.seeker),
+                "hiders": [self.cell(match, i) for i in world.hiders],
+                "flares": [[*state.coords(i), until] for i, until in world.flares.items()]}
+
+    def tick_message(self, match: Match, frame: Frame, late: bool) -> dict[str, Any]:
+        """What a tick changed. Flares that run out by the time of the tick are gone."""
+        coords = match.world.state.coords
+        return {"event": "tick", "match": match.id, "time": frame.time, "score": frame.score,
+                "seeker": self.cell(match, frame.seeker),
+                "moves": [[number, self.cell(match, i)] for number, i in frame.moves],
+                "flares": [[*coords(i), until] for i, until in frame.flares],
+                "cells": [[*coords(i), value] for i, value in frame.writes],
+                "hash": frame.world_hash, "late": late}
+
+    def publish(self, match: Match, message: dict[str, Any]) -> None:
+        """Sends a message to everyone watching a match. Clients whose connection is gone are dropped."""
+        for client in list(match.watchers):
+            if client.closed:
+                self.unwatch(client, match.id)
+            elif not client.send(message):
+                self.resync(client)
+
+    def resync(self, client: Client) -> None:
+        """Drops everything a client hasn't read yet, and sends it where its matches are now."""
+        log.info("A client fell behind, sending it snapshots.")
+        while not client.queue.empty():
+            client.queue.get_nowait()
+        for match_id in client.watching:
+            client.send(self.snapshot(self.matches[match_id]))
+
+    def watch(self, client: Client, match_id: int) -> None:
+        if match_id not in self.matches:
+            raise ValueError(f"No match {match_id}.")
+        match = self.matches[match_id]
+        client.send(self.snapshot(match))
+        match.watchers.add(client)
+        client.watching.add(match_id)
+
+    def unwatch(self, client: Client, match_id: int) -> None:
+        if match_id in self.matches:
+            self.matches[match_id].watchers.discard(client)
+        client.watching.discard(match_id)
+
+    async def request(self, client: Client, request: dict[str, Any]) -> None:
+        """Carries out one request of a client."""
+        op = request.get("op")
+        if op == "start":
+            seed = request.get("seed")
+            match = await self.start_match(
+                str(request["map"]), None if seed is None else int(seed),
+                float(request.get("interval", DEFAULT_INTERVAL)), int(request.get("max_ticks", DEFAULT_MAX_TICKS)),
+                request.get("heatmap", "list"), request.get("seeker_planner", "astar"),
+                request.get("hider_planner", "dijkstra"))
+            client.send({"event": "started", "match": match.id})
+            if request.get("watch", True):
+                self.watch(client, match.id)
+        elif op == "watch":
+            self.watch(client, int(request["match"]))
+        elif op == "unwatch":
+            self.unwatch(client, int(request["match"]))
+        elif op == "list":
+            client.send({"event": "matches", "matches": [
+                {"match": match.id, "map": match.map_name, "time": match.world.time, "score": match.world.score,
+                 "watchers": len(match.watchers), "late": match.late} for match in self.matches.values()]})
+        elif op == "stop":
+            await self.stop_match(int(request["match"]))
+            client.send({"event": "stopped", "match": request["match"]})
+        else:
+            raise ValueError(f"Unknown op {op}.")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serves one connection until it closes. Requests run one after another, so a client's
+           replies come in the order it asked."""
+        client = Client(writer)
+        pump = asyncio.create_task(client.pump())
+        try:
+            while line := await reader.readline():
+                try:
+                    await self.request(client, json.loads(line))
+                except KeyError as error:
+                    client.send({"event": "error", "message": f"Missing {error}."})
+                except (ValueError, TypeError, AttributeError, MapFormatError, OSError) as error:
+                    client.send({"event": "error", "message": str(error) or type(error).__name__})
+        except (ConnectionError, asyncio.CancelledError):
+            pass  # Gone, or the server is shutting down. Nothing waits on this task to hear about it.
+        finally:
+            for match_id in list(client.watching):
+                self.unwatch(client, match_id)
+            pump.cancel()
+            writer.close()
+
+    async def close(self) -> None:
+        """Stops every match, and the workers once the ticks they're in the middle of are done."""
+        self.closing = True
+        for shard in self.shards:
+            shard.shutdown(wait=False, cancel_futures=True)
+        tasks = [match.task for match in self.matches.values() if match.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def serve(args: argparse.Namespace) -> None:
+    # SIGTERM stops the server the same way Ctrl+C does, with every match stopped first.
+    main_task = asyncio.current_task()
+    assert main_task is not None
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+    except NotImplementedError:  # Windows.
+        pass
+
+    server = MatchServer(args.maps, args.workers, args.cache_dir)
+    if args.unix:
+        listener = await asyncio.start_unix_server(server.handle, args.unix)
+    else:
+        listener = await asyncio.start_server(server.handle, args.host, args.port)
+    print(f"Serving maps from {server.maps_dir} on {args.unix or f'{args.host}:{args.port}'}.")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await server.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Hosts live games of Hide and Seek, "
+                                                 "see the top of server.py for the protocol.")
+    parser.add_argument("--maps", default="../maps", help="folder of the maps clients can play")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", default=None, metavar="PATH", help="listen on a Unix socket instead")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes playing the games, 0 plays them in this process")
+    parser.add_argument("--cache-dir", default=None,
+                        help="keep preprocessed maps here, so later matches load them faster")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # The engine logs every move, the server only says what happens to matches.
+    logging.getLogger().setLevel(logging.WARNING)
+    log.setLevel(logging.INFO)
+    try:
+        asyncio.run(serve(args))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+if __name__ == "__main__":
+    main()
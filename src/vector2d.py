@@ -3,7 +3,7 @@ from math import sqrt
 from typing import Generator
 
 
-@dataclass
+@dataclass(slots=True)
 class vectorf:
     """A vector but with floating point components. Please do not use this for cells."""
 
@@ -36,9 +36,10 @@ class vectorf:
         return vectorf(self.x / length, self.y / length)
 
 
-@dataclass
+@dataclass(slots=True)
 class vector:
-    """A vector with integer components. Use this for cells and agents stuff."""
+    """A vector with integer components. Use this for cells and agents stuff.
+       Vectors handed out by MapState.vector_at are shared, so never mutate a vector in place."""
 
     x: int
     y: int
@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import batch
+from batchsim import np
+from mapgen import generate_map
+
+
+@unittest.skipIf(np is None, "NumPy isn't installed, there's no batched simulator.")
+class TestBatchedGames(unittest.TestCase):
+    """Batched games have to play out exactly like run_match with the same seeds."""
+
+    def test_matches_run_match(self) -> None:
+        maps = [("open", 1, 0), ("rooms", 2, 1), ("corridors", 3, 1), ("open", 2, 1)]
+        seeds = list(range(6))
+        with tempfile.TemporaryDirectory() as folder:
+            for k, (layout, hiders, hider_step) in enumerate(maps):
+                map_path = os.path.join(folder, f"{layout}_{k}.txt")
+                with open(map_path, "w") as file:
+                    file.write(generate_map(30, 30, 0.2, layout, hiders, hider_step=hider_step,
+                                            time_limit=200, seed=k))
+
+                batched = batch.run_batched(map_path, seeds, 200)
+                for seed, result in zip(seeds, batched):
+                    with self.subTest(layout=layout, seed=seed):
+                        self.assertEqual(result, batch.run_match(map_path, seed, 200, seeker_planner="field",
+                                                                 hider_planner="dijkstra"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from hide_and_seek import Game, game_from_file
+from map_state import CellType
+from mapgen import generate_map
+from vector2d import vector
+
+
+def play(game: Game, ticks: int) -> list[int]:
+    """Ticks the game, and returns the world hash after every tick."""
+    hashes = []
+    for _ in range(ticks):
+        try:
+            game.tick()
+        except ValueError:
+            break  # The seeker gave up.
+        hashes.append(game.world_hash())
+    return hashes
+
+
+class TestGame(unittest.TestCase):
+    """The same seed has to give the same game, clones included, and boxes follow the rules."""
+
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+
+    def write_map(self, text: str) -> str:
+        map_path = os.path.join(self.folder.name, f"map{len(os.listdir(self.folder.name))}.txt")
+        with open(map_path, "w") as file:
+            file.write(text)
+        return map_path
+
+    def test_same_seed_same_game(self) -> None:
+        map_path = self.write_map(generate_map(20, 20, 0.15, "open", 2, time_limit=300, seed=1, boxes=15))
+        first = play(game_from_file(map_path, seed=7), 60)
+        self.assertEqual(play(game_from_file(map_path, seed=7), 60), first)
+        self.assertEqual(play(game_from_file(map_path, "compact", seed=7, shared=False), 60), first)
+
+    def test_clone_plays_on_alone(self) -> None:
+        map_path = self.write_map(generate_map(20, 20, 0.15, "open", 2, time_limit=300, seed=1, boxes=15))
+        game = game_from_file(map_path, seed=1)
+        play(game, 10)
+        clone = game.clone()
+        self.assertEqual(clone.world_hash(), game.world_hash())
+
+        # The clone pushes boxes and heats up its heatmaps, none of which may reach the game.
+        before, board = game.world_hash(), bytes(game.state.cells)
+        heat = game.seeker.heatmap.cells[:]
+        ahead = play(clone, 60)
+        self.assertEqual(game.world_hash(), before)
+        self.assertEqual(bytes(game.state.cells), board)
+        self.assertEqual(game.seeker.heatmap.cells[:], heat)
+        self.assertEqual(play(game, 60), ahead)
+
+    def test_world_hash_follows_the_map(self) -> None:
+        map_path = self.write_map("100\n3 1\n2 1\n"
+                                  "......X..\n"
+                                  ".SB...XH.\n"
+                                  "......X..\n")
+        game = game_from_file(map_path, seed=0)
+        start = game.world_hash()
+        self.assertTrue(game.move_agent(game.seeker, vector(1, 0)))
+        pushed = game.world_hash()
+        self.assertNotEqual(pushed, start)
+
+        # Pushing it back and stepping back undoes it.
+        game.state[vector(3, 1)] = CellType.EMPTY
+        game.state[vector(2, 1)] = CellType.BOX
+        game.seeker.position = vector(1, 1)
+        self.assertEqual(game.world_hash(), start)
+
+    def test_seeker_pushes_boxes(self) -> None:
+        # The hider is walled off from the box, so it doesn't drag it away before the game.
+        map_path = self.write_map("100\n3 1\n2 1\n"
+                                  "......X..\n"
+                                  ".SB...XH.\n"
+                                  "......X..\n")
+        game = game_from_file(map_path, seed=0)
+        state = game.state
+
+        self.assertTrue(game.move_agent(game.seeker, vector(1, 0)))
+        self.assertEqual(game.seeker.position, vector(2, 1))
+        self.assertEqual(state[vector(2, 1)], CellType.EMPTY)
+        self.assertEqual(state[vector(3, 1)], CellType.BOX)
+
+        # A wall straight ahead, so it goes to the free cell closest to that, the top one on a tie.
+        state[vector(4, 1)] = CellType.WALL
+        self.assertTrue(game.move_agent(game.seeker, vector(1, 0)))
+        self.assertEqual(game.seeker.position, vector(3, 1))
+        self.assertEqual(state[vector(4, 0)], CellType.BOX)
+
+        # Hiders can't push boxes at all.
+        state[vector(8, 1)] = CellType.BOX
+        hider = game.hiders[0]
+        self.assertFalse(game.move_agent(hider, vector(1, 0)))
+        self.assertEqual(hider.position, vector(7, 1))
+        self.assertEqual(state[vector(8, 1)], CellType.BOX)
+
+    def test_box_with_nowhere_to_go(self) -> None:
+        map_path = self.write_map("100\n3 1\n2 1\n"
+                                  "XXX..X..\n"
+                                  "XBS..XH.\n"
+                                  "XXX..X..\n")
+        game = game_from_file(map_path, seed=0)
+        self.assertFalse(game.move_agent(game.seeker, vector(-1, 0)))
+        self.assertEqual(game.seeker.position, vector(2, 1))
+        self.assertEqual(game.state[vector(1, 1)], CellType.BOX)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from array import array
+from heatmap import HEATMAPS, Heatmap, make_heatmap, np
+from map_state import CellType, MapState
+
+import random
+
+
+def full_scan(heatmap: Heatmap, highest: bool) -> list[int]:
+    """What Heatmap.extreme has to return, by looking at every cell."""
+    view = heatmap.view
+    empty = [view.index(x, y) for y in range(view.height) for x in range(view.width)
+             if view.cells[view.index(x, y)] == CellType.EMPTY.value]
+    if not empty:
+        return []
+    temp = (max if highest else min)(heatmap.get(i) for i in empty)
+    return [i for i in empty if heatmap.get(i) == temp]
+
+
+class TestExtreme(unittest.TestCase):
+    """extreme() keeps a HeatIndex up to date instead of scanning, it has to find the same cells."""
+
+    def test_matches_full_scan(self) -> None:
+        kinds = [kind for kind in HEATMAPS if np is not None or kind in ("list", "compact")]
+        rng = random.Random(0)
+        for trial in range(60):
+            width, height = rng.randint(1, 16), rng.randint(1, 16)
+            state = MapState.from_grid(bytes(rng.choice([0, 0, 0, 1, 2]) for _ in range(width * height)),
+                                       width, height)
+            inside = [state.index(x, y) for y in range(height) for x in range(width)]
+            heatmap = make_heatmap(state, kinds[trial % len(kinds)])
+            for step in range(40):
+                roll = rng.random()
+                cells = rng.sample(inside, rng.randint(0, len(inside)))
+                if roll < 0.4:
+                    heatmap.add(array("i", cells), rng.randint(-3, 3))
+                elif roll < 0.6:
+                    heatmap.fill(cells, rng.randint(-3, 3))
+                elif roll < 0.7:
+                    heatmap.set(rng.choice(inside), rng.randint(-3, 3))
+                elif roll < 0.8:
+                    # A box moves, the cell it's on stops counting.
+                    i = rng.choice(inside)
+                    if state.cells[i] != CellType.WALL.value:
+                        state[state.vector_at(i)] = rng.choice([CellType.EMPTY, CellType.BOX])
+                elif roll < 0.85:
+                    other = heatmap.copy()
+                    other.add(cells, 1)
+                    self.assertEqual(sorted(other.extreme(True)), full_scan(other, True))
+
+                for highest in (True, False):
+                    if rng.random() < 0.5:
+                        with self.subTest(trial=trial, step=step, highest=highest):
+                            self.assertEqual(sorted(heatmap.extreme(highest)), full_scan(heatmap, highest))
+
+
+if __name__ == "__main__":
+    unittest.main()
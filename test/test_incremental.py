@@ -0,0 +1,83 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from incremental import DStarLite
+from map_state import MapState
+
+import heapq
+import random
+
+
+def dijkstra(state: MapState, max_step: int, costs: list[int], goals: set[int]) -> dict[int, int]:
+    """The cheapest cost from every cell that can get to a goal, entering cell j costing costs[j]."""
+    dist = {goal: 0 for goal in goals}
+    queue = [(0, goal) for goal in goals]
+    while queue:
+        d, i = heapq.heappop(queue)
+        if d > dist[i]:
+            continue
+        # The moveset graph is undirected, so searching out from the goals works.
+        for j in state.neighbors(i, max_step):
+            if d + costs[i] < dist.get(j, d + costs[i] + 1):
+                dist[j] = d + costs[i]
+                heapq.heappush(queue, (dist[j], j))
+    return dist
+
+
+class TestDStarLite(unittest.TestCase):
+    """D* Lite has to walk the cheapest paths, before and after the costs change."""
+
+    def walk(self, planner: DStarLite, costs: list[int], start: int, goals: set[int], changed: list[int]) -> int:
+        """Follows the planner from start to a goal, and returns what the path cost."""
+        cost, at = 0, start
+        for _ in range(len(costs)):
+            step = planner.next_step(at, goals, changed)
+            changed = []
+            assert step is not None
+            if step == at:
+                return cost
+            cost += costs[step]
+            at = step
+        self.fail("The planner went round in circles.")
+
+    def test_matches_dijkstra(self) -> None:
+        rng = random.Random(0)
+        for trial in range(30):
+            width, height = rng.randint(2, 14), rng.randint(2, 14)
+            state = MapState.from_grid(bytes(1 if rng.random() < 0.25 else 0 for _ in range(width * height)),
+                                       width, height)
+            walkable = [i for i in range(len(state.cells)) if state.walkable[i]]
+            if len(walkable) < 2:
+                continue
+            max_step = rng.choice([1, 2])
+            costs = [rng.randint(1, 9) for _ in state.cells]
+            goals = set(rng.sample(walkable, rng.randint(1, min(len(walkable), 3))))
+
+            # With a bound, at least one move of the cheapest cost per max_step cells away.
+            def bound(a: int, b: int) -> int:
+                (ax, ay), (bx, by) = state.coords(a), state.coords(b)
+                return -(-max(abs(ax - bx), abs(ay - by)) // max_step)
+
+            planner = DStarLite(state, max_step, cost=costs.__getitem__, bound=bound if trial % 2 else None)
+            start = rng.choice(walkable)
+            changed: list[int] = []
+            for _ in range(3):
+                best = dijkstra(state, max_step, costs, goals)
+                with self.subTest(trial=trial, start=start):
+                    if start not in best:
+                        self.assertIsNone(planner.next_step(start, goals, changed))
+                    else:
+                        self.assertEqual(self.walk(planner, costs, start, goals, changed), best[start])
+
+                # Start again somewhere else, after some cells got cheaper or dearer.
+                changed = rng.sample(walkable, min(len(walkable), 5))
+                for i in changed:
+                    costs[i] = rng.randint(1, 9)
+                start = rng.choice(walkable)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from array import array
+from kernels import HEAT16_MAX, HEAT16_MIN
+from map_state import MapState
+from pathfinding import DistanceField
+
+import kernels
+import random
+
+
+class TestPythonKernels(unittest.TestCase):
+    """The Python kernels are what runs without _hskernels, they have to agree with pathfinding.py."""
+
+    def test_multi_astar_finds_what_the_distance_field_does(self) -> None:
+        multi_astar = kernels.python_kernels["multi_astar"]
+        rng = random.Random(0)
+        for _ in range(20):
+            width, height = rng.randint(2, 20), rng.randint(2, 20)
+            grid = bytes(1 if rng.random() < 0.3 else 0 for _ in range(width * height))
+            state = MapState.from_grid(grid, width, height)
+            walkable = [i for i in range(len(state.cells)) if state.walkable[i]]
+            if len(walkable) < 2:
+                continue
+
+            for max_step in (1, 2):
+                goals = rng.sample(walkable, rng.randint(1, min(len(walkable), 4)))
+                field = DistanceField(state, max_step, frozenset(goals))
+                for start in rng.sample(walkable, min(len(walkable), 10)):
+                    step, expanded, found = multi_astar(state.neighbors, max_step, state.stride, start, goals)
+                    distance = field.distance(start)
+                    self.assertEqual(found, distance >= 0)
+                    if distance < 0:
+                        self.assertEqual(step, -1)
+                    elif distance == 0:
+                        self.assertEqual(step, start)
+                    else:
+                        # The taxicab guess can overshoot 8-way moves, so the path isn't always a shortest one.
+                        self.assertIn(step, state.neighbors(start, max_step))
+                        self.assertGreaterEqual(field.distance(step), 0)
+
+                    # Out of budget, it still takes a step it's allowed to.
+                    step, expanded, found = multi_astar(state.neighbors, max_step, state.stride, start, goals, 1)
+                    self.assertLessEqual(expanded, 1)
+                    if not found and distance > 0:
+                        self.assertTrue(step == start or step in state.neighbors(start, max_step))
+
+    def test_moveset_walks_the_grid(self) -> None:
+        moveset = kernels.python_kernels["moveset"]
+        width, height = 5, 4
+        state = MapState.from_grid(bytes([0, 1, 0, 0, 0,
+                                          0, 0, 2, 1, 0,
+                                          1, 0, 0, 1, 0,
+                                          0, 0, 1, 0, 0]), width, height)
+
+        def walkable(x: int, y: int) -> bool:
+            return state.validate_coords(x, y) and bool(state.walkable[state.index(x, y)])
+
+        for y in range(height):
+            for x in range(width):
+                if not walkable(x, y):
+                    continue
+                spots = {(x, y)}
+                for max_step in (1, 2, 3):
+                    # Where exactly max_step single steps in the 8 directions can end.
+                    spots = {(sx + dx, sy + dy) for sx, sy in spots for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                             if (dx, dy) != (0, 0) and walkable(sx + dx, sy + dy)}
+                    cells = moveset(state.walkable, state.neighbor_offsets, state.index(x, y), max_step)
+                    self.assertEqual(cells, sorted(state.index(sx, sy) for sx, sy in spots))
+
+    def test_heat_add16_sticks_at_the_ends(self) -> None:
+        heat = array("h", [HEAT16_MAX - 1, 0, HEAT16_MIN + 1, 5])
+        kernels.python_kernels["heat_add16"](heat, [0, 1, 3], 10)
+        self.assertEqual(list(heat), [HEAT16_MAX, 10, HEAT16_MIN + 1, 15])
+        kernels.python_kernels["heat_add16"](heat, [2, 1], -20)
+        self.assertEqual(list(heat), [HEAT16_MAX, -10, HEAT16_MIN, 15])
+
+
+@unittest.skipUnless(kernels.COMPILED, "_hskernels isn't built, only the Python kernels are in use.")
+class TestKernels(unittest.TestCase):
+    """The compiled kernels have to give the same results as the Python ones."""
+
+    def test_parity(self) -> None:
+        kernels.check_parity()
+
+    def test_parity_other_maps(self) -> None:
+        kernels.check_parity(maps=10, seed=1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from loader import cache_path, load_map, read_cache, write_cache
+from mapgen import generate_map
+
+
+class TestMapCache(unittest.TestCase):
+    """A map read back from its cache has to be the map it was written from."""
+
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+        self.map_path = os.path.join(self.folder.name, "map.txt")
+        with open(self.map_path, "w") as file:
+            file.write(generate_map(17, 11, 0.25, "rooms", 2, seeker_vision=3, seeker_step=2,
+                                    time_limit=300, seed=5, boxes=3))
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+
+    def assertSameMap(self, cached: tuple, parsed: tuple, steps: list[int], radii: list[int]) -> None:
+        spec, state = cached
+        self.assertEqual(spec, parsed[0])
+        self.assertEqual(state, parsed[1])
+        self.assertEqual(state.zobrist, parsed[1].zobrist)
+        for i in range(len(state.cells)):
+            if not state.walkable[i]:
+                continue
+            for max_step in steps:
+                self.assertEqual(state.neighbors(i, max_step), parsed[1].neighbors(i, max_step))
+            for radius in radii:
+                self.assertEqual(state.visibility(i, radius), parsed[1].visibility(i, radius))
+
+    def test_round_trip(self) -> None:
+        parsed = load_map(self.map_path)
+        source = os.stat(self.map_path)
+        path = os.path.join(self.folder.name, "map.cache")
+        write_cache(path, *parsed, source, [1, 2], [2, 3])
+        for use_mmap in (True, False):
+            cached = read_cache(path, source, use_mmap)
+            assert cached is not None
+            self.assertSameMap(cached, load_map(self.map_path), [1, 2, 3], [2, 3, 4])
+
+    def test_stale_or_broken_cache(self) -> None:
+        parsed = load_map(self.map_path)
+        path = os.path.join(self.folder.name, "map.cache")
+        write_cache(path, *parsed, os.stat(self.map_path), [1], [2])
+
+        # From another file, the same file after it changed, or cut short.
+        self.assertIsNone(read_cache(path, os.stat(__file__)))
+        with open(path, "rb") as file:
+            data = file.read()
+        with open(path, "wb") as file:
+            file.write(data[:len(data) // 2])
+        self.assertIsNone(read_cache(path))
+        self.assertIsNone(read_cache(os.path.join(self.folder.name, "missing.cache")))
+
+    def test_load_map_with_cache_dir(self) -> None:
+        cache_dir = os.path.join(self.folder.name, "cache")
+        first = load_map(self.map_path, cache_dir)
+        self.assertTrue(os.path.exists(cache_path(self.map_path, cache_dir)))
+        self.assertSameMap(load_map(self.map_path, cache_dir), first, [1, 2], [2, 3])
+        self.assertSameMap(load_map(self.map_path, cache_dir), load_map(self.map_path), [1, 2], [2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import batch
+
+from hide_and_seek import game_from_file
+from mapgen import generate_map
+from replay import read_replay
+from typing import Any
+
+
+class TestReplay(unittest.TestCase):
+    """A replay has to play out again tick for tick from its map and seed."""
+
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+        self.map_path = os.path.join(self.folder.name, "map.txt")
+        with open(self.map_path, "w") as file:
+            file.write(generate_map(20, 20, 0.15, "open", 2, time_limit=150, seed=1, boxes=15))
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+
+    def record(self, seed: int, **options: Any) -> str:
+        """Plays a game with run_match, and returns the replay it recorded."""
+        batch.run_match(self.map_path, seed, 150, replay_dir=self.folder.name, **options)
+        return os.path.join(self.folder.name, f"map.txt.{seed}.replay")
+
+    def test_verify(self) -> None:
+        games: list[tuple[int, dict[str, Any]]] = [
+            (0, {}), (1, {"seeker_planner": "field", "hider_planner": "incremental"}), (2, {"plan_budget": 2})]
+        for seed, options in games:
+            with self.subTest(seed=seed):
+                replay = read_replay(self.record(seed, **options))
+                self.assertGreater(len(replay.frames), 0)
+                self.assertEqual(replay.seeker_budget, options.get("plan_budget"))
+                self.assertIsNone(replay.verify())
+
+    def test_changed_map(self) -> None:
+        replay = read_replay(self.record(0))
+        with open(self.map_path, "w") as file:
+            file.write(generate_map(20, 20, 0.15, "open", 2, time_limit=150, seed=2, boxes=15))
+        self.assertEqual(replay.verify(), 0)
+
+    def test_plan_time_is_refused(self) -> None:
+        game = game_from_file(self.map_path, seed=0)
+        game.seeker.plan_time = 0.5
+        with self.assertRaises(ValueError):
+            game.record_replay(os.path.join(self.folder.name, "timed.replay"))
+
+
+if __name__ == "__main__":
+    unittest.main()